@@ -40,6 +40,8 @@
 // ==================== 高级配置 ====================
 #define EEPROM_SIZE 512                    // EEPROM大小
 #define JSON_DOC_SIZE 200                  // JSON文档大小
+#define PAYLOAD_FORMAT_BINARY false        // AD数据使用紧凑二进制格式 (服务器按首字节自动识别)
+#define PAYLOAD_BINARY_VERSION 1           // 二进制格式版本号 (首字节)
 #define MAX_WIFI_RETRY 20                  // 最大WiFi重连次数
 #define MQTT_KEEPALIVE 60                  // MQTT保活时间
 
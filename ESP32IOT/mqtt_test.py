@@ -23,6 +23,12 @@ class ESP32MQTTTester:
         self.connected = False
         self.ad_data = []
         self.io_status = False
+        # 按 esp32/ 之后的主题路径分发，一次字典查找
+        self.handlers = {
+            "ad1/data": self.handle_ad_data,
+            "io1/control": self.handle_io_status,
+            "status": self.handle_status
+        }
         
     def on_connect(self, client, userdata, flags, rc):
         """MQTT连接回调"""
@@ -31,8 +37,8 @@ class ESP32MQTTTester:
             print(f"[{datetime.now().strftime('%H:%M:%S')}] MQTT连接成功")
             
             # 订阅ESP32相关主题
-            client.subscribe("esp32/+/+")
-            print("已订阅主题: esp32/+/+")
+            client.subscribe("esp32/#")
+            print("已订阅主题: esp32/#")
             
         else:
             print(f"[{datetime.now().strftime('%H:%M:%S')}] MQTT连接失败，错误码: {rc}")
@@ -64,12 +70,9 @@ class ESP32MQTTTester:
     
     def handle_message(self, topic, data):
         """处理不同类型的消息"""
-        if "ad1/data" in topic:
-            self.handle_ad_data(data)
-        elif "io1/control" in topic:
-            self.handle_io_status(data)
-        elif "status" in topic:
-            self.handle_status(data)
+        handler = self.handlers.get(topic.partition('/')[2])
+        if handler:
+            handler(data)
     
     def handle_ad_data(self, data):
         """处理AD数据"""
@@ -299,6 +299,39 @@ void uploadData() {
   // 读取AD1值
   int ad1Value = analogRead(AD1_PIN);
   
+#if PAYLOAD_FORMAT_BINARY
+  // 紧凑二进制格式 (小端): 版本号 u8 | 采样值 u16 | millis() u32 | 设备ID长度 u8 + 设备ID | 通道长度 u8 + 通道
+  uint8_t buffer[64];
+  unsigned int length = 0;
+  uint32_t now = millis();
+  const char* deviceId = MQTT_CLIENT_ID;
+  const char* channel = "AD1";
+  uint8_t deviceIdLength = strlen(deviceId);
+  uint8_t channelLength = strlen(channel);
+  
+  buffer[length++] = PAYLOAD_BINARY_VERSION;
+  buffer[length++] = ad1Value & 0xFF;
+  buffer[length++] = (ad1Value >> 8) & 0xFF;
+  for (int i = 0; i < 4; i++) {
+    buffer[length++] = (now >> (8 * i)) & 0xFF;
+  }
+  buffer[length++] = deviceIdLength;
+  memcpy(buffer + length, deviceId, deviceIdLength);
+  length += deviceIdLength;
+  buffer[length++] = channelLength;
+  memcpy(buffer + length, channel, channelLength);
+  length += channelLength;
+  
+  if (mqttClient.publish(MQTT_TOPIC_AD1_DATA, buffer, length)) {
+    Serial.print("数据上传成功 (二进制): ");
+    Serial.println(ad1Value);
+    dataUploadCount++;
+  } else {
+    Serial.println("数据上传失败");
+  }
+  return;
+#endif
+  
   // 创建JSON数据 - 与Python服务器格式保持一致
   DynamicJsonDocument doc(JSON_DOC_SIZE);
   doc["device_id"] = MQTT_CLIENT_ID;
@@ -0,0 +1,384 @@
+import os
+import time
+import struct
+import asyncio
+import logging
+import threading
+import configparser
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+from database import DEFAULT_DEVICE_ID, DEFAULT_CHANNEL
+from latest_cache import LatestValueCache
+from topic_router import router_from_config, shared_subscription
+from payload_codec import decode_payload, sample_offsets, device_time_ms, PayloadError
+from latency_tracker import latency_tracker
+from log_setup import SampledLogger
+
+payload_warning_log = SampledLogger(logging.WARNING)
+
+# MQTT 3.1.1 报文类型 (固定头高4位)
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+SUBSCRIBE = 0x82
+SUBACK = 0x90
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+def encode_remaining_length(length):
+    """MQTT剩余长度编码 (每字节7位，最高位表示后续还有字节)"""
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        encoded.append(byte)
+        if not length:
+            return bytes(encoded)
+
+def encode_string(value):
+    """MQTT字符串编码: 2字节长度 + UTF-8内容"""
+    data = value.encode('utf-8') if isinstance(value, str) else value
+    return struct.pack('!H', len(data)) + data
+
+def build_packet(packet_type, body=b''):
+    """组装完整报文: 固定头 + 剩余长度 + 报文体"""
+    return bytes([packet_type]) + encode_remaining_length(len(body)) + body
+
+def build_connect(client_id, keepalive, username=None, password=None):
+    """CONNECT报文 (clean session)"""
+    flags = 0x02
+    payload = encode_string(client_id)
+    if username:
+        flags |= 0x80
+        payload += encode_string(username)
+        if password:
+            flags |= 0x40
+            payload += encode_string(password)
+    body = encode_string('MQTT') + bytes([4, flags]) + struct.pack('!H', keepalive) + payload
+    return build_packet(CONNECT, body)
+
+def build_subscribe(packet_id, topics, qos=0):
+    """SUBSCRIBE报文"""
+    body = struct.pack('!H', packet_id)
+    for topic in topics:
+        body += encode_string(topic) + bytes([qos])
+    return build_packet(SUBSCRIBE, body)
+
+async def read_packet(reader):
+    """读取一个完整报文，返回 (固定头字节, 报文体)"""
+    header = (await reader.readexactly(1))[0]
+    length = 0
+    multiplier = 1
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    body = await reader.readexactly(length) if length else b''
+    return header, body
+
+def parse_publish(header, body):
+    """解析PUBLISH报文，返回 (主题, QoS, 报文ID, 负载)"""
+    qos = (header >> 1) & 0x03
+    topic_length = struct.unpack_from('!H', body, 0)[0]
+    topic = body[2:2 + topic_length].decode('utf-8')
+    offset = 2 + topic_length
+    packet_id = None
+    if qos:
+        packet_id = struct.unpack_from('!H', body, offset)[0]
+        offset += 2
+    return topic, qos, packet_id, body[offset:]
+
+class AsyncIngestEngine:
+    """基于asyncio的MQTT入库引擎
+
+    与 MQTTClient 订阅相同的主题，但不依赖paho的后台线程和阻塞回调：
+    一个协程读取报文并解析，另一个协程攒批后在单线程执行器中调用 save_batch，
+    事件循环本身不会被数据库写入阻塞，可以与异步Web服务器共用同一个事件循环。
+    只实现入库需要的MQTT 3.1.1子集 (CONNECT/SUBSCRIBE/PUBLISH接收/PING)，控制命令仍由MQTTClient发布。
+    """
+
+    def __init__(self, config_file, database_manager, latest_cache=None, broadcaster=None,
+                 client_id=None, batch_size=500, flush_interval=1.0, max_queue_size=10000):
+        self.config = configparser.ConfigParser()
+        self.config.read(config_file)
+        self.database_manager = database_manager
+
+        # MQTT配置
+        self.broker = self.config.get('MQTT', 'broker')
+        self.port = self.config.getint('MQTT', 'port')
+        self.client_id = client_id or f"{self.config.get('MQTT', 'client_id')}_ingest"
+        self.username = self.config.get('MQTT', 'username', fallback='')
+        self.password = self.config.get('MQTT', 'password', fallback='')
+        self.keepalive = self.config.getint('MQTT', 'keepalive', fallback=60)
+        self.reconnect_delay = 5
+        self.shared_group = self.config.get('MQTT', 'shared_group', fallback='').strip()
+        if self.shared_group and not client_id:
+            worker_id = self.config.get('MQTT', 'worker_id', fallback='') or os.getpid()
+            self.client_id = f"{self.client_id}_{worker_id}"
+
+        # 主题配置
+        self.ad1_topic = self.config.get('TOPICS', 'ad1_data')
+        self.io1_control_topic = self.config.get('TOPICS', 'io1_control')
+        self.status_topic = self.config.get('TOPICS', 'status')
+        self.router = router_from_config(self.config, {
+            'ad1_data': self.handle_ad1_data,
+            'telemetry': self.handle_ad1_data,
+            'io1_control': self.handle_io1_control,
+            'status': self.handle_status
+        })
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.latest_cache = latest_cache if latest_cache is not None else LatestValueCache()
+        self.broadcaster = broadcaster
+
+        # 数据库写入在单线程执行器中串行执行，保证批次顺序
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='async-ingest-db')
+        self.queue = None
+        self.stop_event = None
+        self.loop = None
+        self.thread = None
+        self.connected = False
+
+        # 统计信息
+        self.messages_received = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.batches_written = 0
+
+    # ---- 在已有事件循环中运行 ----
+
+    async def run(self):
+        """引擎主协程：维持MQTT连接并运行写入协程，直到调用stop"""
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.stop_event = asyncio.Event()
+        metrics.queue_depth.set_function(self.get_queue_depth)
+        metrics.mqtt_connected.set_function(self.get_connection_status)
+        writer_task = asyncio.create_task(self.writer_loop())
+        logging.info(f"异步入库引擎已启动 (batch_size={self.batch_size}, flush_interval={self.flush_interval}s)")
+
+        while not self.stop_event.is_set():
+            try:
+                await self.session()
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError) as e:
+                logging.warning(f"异步入库引擎MQTT连接断开: {e}")
+            except Exception as e:
+                logging.error(f"异步入库引擎错误: {e}")
+            self.connected = False
+            if not self.stop_event.is_set():
+                try:
+                    await asyncio.wait_for(self.stop_event.wait(), self.reconnect_delay)
+                except asyncio.TimeoutError:
+                    pass
+
+        # 写入协程处理完队列中剩余数据后退出
+        await self.queue.put(None)
+        await writer_task
+        logging.info(f"异步入库引擎已停止 - 收到消息: {self.messages_received}, "
+                     f"已写入: {self.rows_written}, 丢弃: {self.rows_dropped}")
+
+    async def session(self):
+        """一次MQTT会话：连接、订阅、读取消息直到断开或停止"""
+        logging.info(f"异步入库引擎正在连接MQTT代理: {self.broker}:{self.port}")
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.broker, self.port), 10)
+        try:
+            writer.write(build_connect(self.client_id, self.keepalive, self.username, self.password))
+            header, body = await asyncio.wait_for(read_packet(reader), 10)
+            if header & 0xF0 != CONNACK or body[1] != 0:
+                raise ConnectionError(f"MQTT连接被拒绝，返回码: {body[1] if len(body) > 1 else None}")
+            writer.write(build_subscribe(1, [shared_subscription(topic, self.shared_group)
+                                             for topic in self.router.subscriptions()]))
+            await writer.drain()
+            self.connected = True
+            logging.info("异步入库引擎MQTT连接成功")
+
+            ping_task = asyncio.create_task(self.ping_loop(writer))
+            read_task = asyncio.create_task(self.read_loop(reader, writer))
+            stop_task = asyncio.create_task(self.stop_event.wait())
+            try:
+                done, _ = await asyncio.wait({read_task, ping_task, stop_task},
+                                             return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in (ping_task, read_task, stop_task):
+                    task.cancel()
+                await asyncio.gather(ping_task, read_task, stop_task, return_exceptions=True)
+            for task in done:
+                if task is not stop_task and not task.cancelled() and task.exception():
+                    raise task.exception()
+            writer.write(build_packet(DISCONNECT))
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def ping_loop(self, writer):
+        """按keepalive间隔发送心跳"""
+        while True:
+            await asyncio.sleep(self.keepalive / 2)
+            writer.write(build_packet(PINGREQ))
+            await writer.drain()
+
+    async def read_loop(self, reader, writer):
+        """读取并分发报文，超过1.5倍keepalive没有任何报文视为连接失效"""
+        timeout = self.keepalive * 1.5
+        while True:
+            header, body = await asyncio.wait_for(read_packet(reader), timeout)
+            packet_type = header & 0xF0
+            if packet_type != PUBLISH:
+                # SUBACK / PINGRESP 不需要处理
+                continue
+            topic, qos, packet_id, payload = parse_publish(header, body)
+            if qos == 1:
+                writer.write(build_packet(PUBACK, struct.pack('!H', packet_id)))
+            self.messages_received += 1
+            # 单条消息处理失败只记录日志，不能结束读循环 (否则断开连接并丢失后续消息)
+            try:
+                item = self.router.dispatch(topic, payload)
+            except Exception as e:
+                payload_warning_log.log('dispatch', "处理MQTT消息失败 (%s): %s", topic, e)
+                continue
+            if item is not None:
+                # 队列满时在此等待，不再读取socket，由TCP把背压传回代理
+                await self.queue.put(item)
+
+    async def writer_loop(self):
+        """攒批写入：达到batch_size或等待flush_interval秒后写一批"""
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            row_count = len(item[1])
+            deadline = self.loop.time() + self.flush_interval
+            while row_count < self.batch_size:
+                if not self.queue.empty():
+                    item = self.queue.get_nowait()
+                else:
+                    remaining = deadline - self.loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                row_count += len(item[1])
+            await self.flush(batch)
+
+    async def flush(self, batch):
+        """在执行器中写入一批数据，事件循环继续接收消息"""
+        rows_by_table = {}
+        for table, rows in batch:
+            rows_by_table.setdefault(table, []).extend(rows)
+        row_count = sum(len(rows) for rows in rows_by_table.values())
+        ok = await self.loop.run_in_executor(self.executor, self.database_manager.save_batch, rows_by_table)
+        if ok:
+            self.rows_written += row_count
+            self.batches_written += 1
+            logging.debug("批量写入完成: %d 行", row_count)
+        else:
+            self.rows_dropped += row_count
+
+    # ---- 消息解析 (与MQTTClient的处理逻辑一致) ----
+
+    def handle_ad1_data(self, payload, device_id=None, channel=None):
+        """处理AD1数据 (单个或批量采样)，返回 (表名, 待写入的数据行列表)"""
+        try:
+            record = decode_payload('telemetry', payload)
+        except PayloadError as e:
+            metrics.invalid['telemetry'].inc()
+            payload_warning_log.log('ad1', "AD1数据格式错误: %s", e)
+            return None
+        metrics.decoded['telemetry'].inc()
+        device_id = device_id or record.device_id or DEFAULT_DEVICE_ID
+        channel = channel or record.channel or DEFAULT_CHANNEL
+        now = int(time.time() * 1000)
+        if record.values is not None:
+            # 批量采样：最后一个采样对齐到接收时间，设备时钟已同步时同时记录设备采样时间 (没有base_ts时不记录)
+            offsets = sample_offsets(record)
+            end_ts = now - offsets[-1]
+            device_end = device_time_ms(record.base_ts + offsets[-1], now) if record.base_ts is not None else None
+            device_base = device_end - offsets[-1] if device_end is not None else None
+            rows = [(device_id, channel, end_ts + offset, value,
+                     device_base + offset if device_base is not None else None, now)
+                    for offset, value in zip(offsets, record.values)]
+        else:
+            device_end = device_time_ms(record.timestamp, now)
+            rows = [(device_id, channel, now, record.value, device_end, now)]
+        if device_end is not None:
+            latency_tracker.record('publish_receive', max(0, now - device_end))
+        metrics.samples_received.inc(len(rows))
+        _, _, ts, value, _, _ = rows[-1]
+        self.latest_cache.update(device_id, channel, value, ts)
+        if self.broadcaster:
+            self.broadcaster.publish('ad1', {'device_id': device_id, 'channel': channel, 'value': value, 'ts': ts})
+        return 'telemetry', rows
+
+    def handle_io1_control(self, payload, device_id=None):
+        """处理IO1控制状态，返回待写入的数据行"""
+        try:
+            record = decode_payload('io1', payload)
+        except PayloadError as e:
+            metrics.invalid['io1'].inc()
+            payload_warning_log.log('io1', "IO1控制数据格式错误: %s", e)
+            return None
+        metrics.decoded['io1'].inc()
+        state = record.state
+        device_id = device_id or record.device_id or DEFAULT_DEVICE_ID
+        self.latest_cache.update(device_id, record.channel or 'IO1', state)
+        if self.broadcaster:
+            self.broadcaster.publish('io1', {'device_id': device_id, 'state': state})
+        return 'io1_control', [(state,)]
+
+    def handle_status(self, payload, device_id=None):
+        """处理设备状态，返回待写入的数据行"""
+        try:
+            record = decode_payload('status', payload)
+        except PayloadError as e:
+            metrics.invalid['status'].inc()
+            payload_warning_log.log('status', "设备状态数据格式错误: %s", e)
+            return None
+        metrics.decoded['status'].inc()
+        status = record.status
+        device_id = device_id or record.device_id or DEFAULT_DEVICE_ID
+        self.latest_cache.update(device_id, 'status', status)
+        if self.broadcaster:
+            self.broadcaster.publish('status', {'device_id': device_id, 'status': status})
+        return 'device_status', [(status,)]
+
+    # ---- 在独立线程中运行 (同步程序集成) ----
+
+    def start(self):
+        """在后台线程中启动独立的事件循环"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=asyncio.run, args=(self.run(),), name='async-ingest', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """通知引擎停止，写入剩余数据后返回"""
+        if self.loop and self.stop_event:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+        if self.thread:
+            self.thread.join(timeout=timeout)
+            self.thread = None
+        self.executor.shutdown(wait=True)
+
+    def get_connection_status(self):
+        """获取连接状态"""
+        return self.connected
+
+    def get_queue_depth(self):
+        """获取当前队列深度"""
+        return self.queue.qsize() if self.queue else 0
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Web API基准测试 (进程内，不经过网络)
+用Flask测试客户端逐个请求各个API，测量每个接口的请求速率和延迟分位数，
+数据库预先写入合成时序数据，最新值缓存由 MQTTClient 的消息处理填充。
+不含WSGI服务器和网络开销，服务器模式的对比见 bench_web_server.py。
+用法: python benchmarks/bench_api.py [--rows 100000] [--requests 1000]
+"""
+
+import os
+import json
+import logging
+import argparse
+import tempfile
+
+from common import write_config, latency_stats, time_each, seeded_random
+from bench_storage import populate, device_name, BASE_TS, SAMPLE_INTERVAL_MS
+
+from database import DatabaseManager
+from mqtt_client import MQTTClient
+from web_server import WebServer
+
+
+def endpoints(rows, devices, requests, seed):
+    """(名称, 请求路径列表)，参数由seed决定"""
+    rng = seeded_random(seed + 2)
+    span_ms = max(1, rows // devices) * SAMPLE_INTERVAL_MS
+    hour = 3600 * 1000
+
+    def device():
+        return device_name(rng.randrange(devices))
+
+    def window(width_ms):
+        since = BASE_TS + rng.randrange(max(1, span_ms - width_ms))
+        return since, since + width_ms
+
+    def paths(build):
+        return [build() for _ in range(requests)]
+
+    return [
+        ('test', paths(lambda: '/api/test')),
+        ('status', paths(lambda: '/api/status')),
+        ('latest', paths(lambda: '/api/latest')),
+        ('ad1_current', paths(lambda: '/api/ad1/current')),
+        ('devices', paths(lambda: '/api/devices')),
+        ('history_100', paths(lambda: f'/api/telemetry/{device()}/AD1/history?limit=100')),
+        ('history_1h_1000', paths(lambda: '/api/telemetry/{}/AD1/history?since={}&until={}&limit=1000'.format(
+            device(), *window(hour)))),
+        ('rollup_full_range', paths(lambda: f'/api/telemetry/{device()}/AD1/rollup'
+                                            f'?since={BASE_TS}&until={BASE_TS + span_ms}')),
+        ('latency', paths(lambda: '/api/latency')),
+        ('metrics', paths(lambda: '/metrics')),
+    ]
+
+
+def run(rows=100000, devices=100, requests=1000, seed=42):
+    """返回每个接口的 req/s 和延迟分位数"""
+    result = {'rows': rows, 'devices': devices, 'requests': requests, 'endpoints': {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'api.db')
+        config_file = write_config(tmp_dir, db_path)
+        db = DatabaseManager(db_path)
+        db.init_database()
+        populate(db, rows, devices, seed=seed)
+        mqtt_client = MQTTClient(config_file, db)
+        # 最新值缓存: 每个设备一条
+        for index in range(devices):
+            mqtt_client.latest_cache.update(device_name(index), 'AD1', index, BASE_TS)
+        server = WebServer(config_file, db, mqtt_client)
+        client = server.app.test_client()
+
+        def get(path):
+            response = client.get(path)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} 返回 {response.status_code}")
+            response.get_data()
+
+        for name, paths in endpoints(rows, devices, requests, seed):
+            time_each(get, [(path,) for path in paths[:20]])
+            result['endpoints'][name] = latency_stats(time_each(get, [(path,) for path in paths]))
+        db.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Web API基准测试")
+    parser.add_argument('--rows', type=int, default=100000, help="预先写入的时序数据行数")
+    parser.add_argument('--devices', type=int, default=100, help="设备数")
+    parser.add_argument('--requests', type=int, default=1000, help="每个接口的请求数")
+    parser.add_argument('--seed', type=int, default=42, help="随机种子")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    result = run(args.rows, args.devices, args.requests, args.seed)
+    for name, stats in result['endpoints'].items():
+        print(f"{name:<20}{stats['ops_per_sec']:>10.0f} req/s  p50 {stats['p50_ms']:8.3f} ms  "
+              f"p99 {stats['p99_ms']:8.3f} ms")
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DatabaseManager写入性能基准测试
+对比: 每次调用都 connect()/close() 的旧写法、连接池长连接、写后批量入库队列
+各模式写入同一张表 (telemetry，含汇总表增量更新)、相同的数据。
+连接池的加速比以相同存储参数 (WAL + synchronous=NORMAL) 下的逐次连接为基准，只反映连接复用的效果；
+旧的回滚日志 + synchronous=FULL 单独成行，反映存储参数的效果
+用法: python benchmarks/bench_database.py [--count 2000]
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+from ingest_writer import IngestWriter
+
+
+def connect_per_call_insert(db, value, ts):
+    """旧实现：每次写入都新建并关闭连接；连接参数和写入内容与 save_ad1_data 相同 (telemetry + 汇总表)"""
+    conn = db._create_connection()
+    rows = db._resolve_telemetry_rows(conn, [('bench', 'AD1', ts, value, None, ts)])
+    db._insert_telemetry(conn, rows)
+    conn.commit()
+    db._close_connection(conn)
+
+
+def bench_connect_per_call(db_path, count, journal_mode='WAL', synchronous='NORMAL'):
+    db = DatabaseManager(db_path, journal_mode=journal_mode, synchronous=synchronous)
+    start = time.perf_counter()
+    for i in range(count):
+        connect_per_call_insert(db, i % 4096, i)
+    elapsed = time.perf_counter() - start
+    db.close()
+    return count / elapsed
+
+
+def bench_pooled(db_path, count):
+    db = DatabaseManager(db_path)
+    start = time.perf_counter()
+    for i in range(count):
+        db.save_ad1_data(i % 4096, 'bench', 'AD1', ts=i)
+    elapsed = time.perf_counter() - start
+    db.close()
+    return count / elapsed
+
+
+def bench_write_behind(db_path, count):
+    db = DatabaseManager(db_path)
+    writer = IngestWriter(db, batch_size=500, flush_interval=0.5, max_queue_size=count + 1)
+    writer.start()
+    start = time.perf_counter()
+    for i in range(count):
+        writer.submit('telemetry', ('bench', 'AD1', i, i % 4096, None, i))
+    writer.stop()  # 计入全部数据落盘的时间
+    elapsed = time.perf_counter() - start
+    db.close()
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DatabaseManager写入性能基准测试")
+    parser.add_argument('--count', type=int, default=2000, help="每种模式的写入条数")
+    args = parser.parse_args()
+
+    # 避免每条INFO日志干扰测量
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        legacy = bench_connect_per_call(os.path.join(tmp_dir, 'per_call_delete.db'), args.count,
+                                        journal_mode='DELETE', synchronous='FULL')
+        before = bench_connect_per_call(os.path.join(tmp_dir, 'per_call.db'), args.count)
+        after = bench_pooled(os.path.join(tmp_dir, 'pooled.db'), args.count)
+        batched = bench_write_behind(os.path.join(tmp_dir, 'write_behind.db'), args.count)
+
+    # 括号内为相对 connect-per-call (WAL, NORMAL) 的倍数
+    print(f"connect-per-call (DELETE, FULL): {legacy:10.1f} inserts/s ({legacy / before:.2f}x)")
+    print(f"connect-per-call (WAL, NORMAL):  {before:10.1f} inserts/s")
+    print(f"pooled (WAL, NORMAL):            {after:10.1f} inserts/s ({after / before:.2f}x)")
+    print(f"write-behind (WAL, NORMAL):      {batched:10.1f} inserts/s ({batched / before:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
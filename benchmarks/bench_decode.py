@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+入站负载解码性能基准测试
+负载结构取自 ESP32Simulator 和 ESP32IOT/src/main.cpp 实际发送的消息，
+对比: 旧写法 (decode('utf-8') + json.loads + 字段检查) 与 PayloadCodec 的各个后端，
+固件AD1数据的JSON与紧凑二进制格式，以及每条消息一行INFO日志的开销。
+用法: python benchmarks/bench_decode.py [--count 200000]
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payload_codec import PayloadCodec, PayloadError, encode_telemetry_binary, msgspec, orjson
+
+
+def sample_payloads():
+    """(名称, 负载类型, 必需字段, bytes负载)"""
+    now = datetime.now().isoformat()
+    shapes = [
+        ('simulator ad1', 'telemetry', 'value',
+         {"device_id": "esp32_simulator", "channel": "AD1", "value": 2048, "unit": "ADC", "timestamp": now}),
+        ('simulator batch10', 'telemetry', 'values',
+         {"device_id": "esp32_simulator", "channel": "AD1", "unit": "ADC", "base_ts": 123456,
+          "deltas": [0] + [10] * 9, "values": [2048 + i for i in range(10)]}),
+        ('simulator io1', 'io1', 'state',
+         {"device_id": "esp32_simulator", "channel": "IO1", "state": True, "timestamp": now}),
+        ('simulator status', 'status', 'status',
+         {"device_id": "esp32_simulator", "status": "running", "io1_state": False, "timestamp": now}),
+        ('firmware ad1', 'telemetry', 'value',
+         {"device_id": "esp32_device", "channel": "AD1", "value": 1234, "unit": "ADC", "timestamp": 123456,
+          "io1_state": False, "wifi_rssi": -57, "uptime": 123}),
+        ('firmware status', 'status', 'status',
+         {"device_id": "esp32_device", "status": "online", "timestamp": 123456, "ip": "192.168.124.20",
+          "io1_state": False, "uptime": 123, "wifi_rssi": -57}),
+        ('firmware io1', 'io1', 'state',
+         {"device_id": "esp32_device", "channel": "IO1", "state": False, "timestamp": 123456}),
+    ]
+    payloads = [(name, kind, field, json.dumps(message).encode('utf-8')) for name, kind, field, message in shapes]
+    payloads.append(('malformed', 'telemetry', 'value', b'{"device_id": "esp32_device", "value": '))
+    return payloads
+
+
+def legacy_decode(payload, field):
+    """旧写法：先转str，json.loads，再检查字段"""
+    try:
+        data = json.loads(payload.decode('utf-8'))
+        if field in data:
+            return data
+    except json.JSONDecodeError:
+        pass
+    return None
+
+
+def bench(func, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入站负载解码性能基准测试")
+    parser.add_argument('--count', type=int, default=200000, help="每种负载的解码次数")
+    args = parser.parse_args()
+
+    backends = ['json'] + (['orjson'] if orjson is not None else []) + (['msgspec'] if msgspec is not None else [])
+    codecs = {backend: PayloadCodec(backend) for backend in backends}
+    print(f"可用后端: {', '.join(backends)}  (每项 {args.count} 次，单位 msgs/s)")
+    print(f"{'payload':<18}{'legacy':>12}" + ''.join(f"{backend:>12}" for backend in backends))
+
+    for name, kind, field, payload in sample_payloads():
+        row = [bench(lambda: legacy_decode(payload, field), args.count)]
+        for backend in backends:
+            decode = codecs[backend].decode
+
+            def run():
+                try:
+                    decode(kind, payload)
+                except PayloadError:
+                    pass
+            row.append(bench(run, args.count))
+        print(f"{name:<18}" + ''.join(f"{rate:>12.0f}" for rate in row))
+
+    # 同一条固件AD1数据的JSON与二进制格式
+    firmware_json = sample_payloads()[4][3]
+    firmware_binary = encode_telemetry_binary(1234, 123456, "esp32_device", "AD1")
+    print(f"\nfirmware ad1 格式   {'bytes':>8}" + ''.join(f"{backend:>12}" for backend in backends))
+    for name, payload in (('json', firmware_json), ('binary', firmware_binary)):
+        rates = [bench(lambda: codecs[backend].decode('telemetry', payload), args.count) for backend in backends]
+        print(f"{name:<18}{len(payload):>8}" + ''.join(f"{rate:>12.0f}" for rate in rates))
+
+    # 每条消息一行日志的开销 (日志写入内存，不含磁盘IO)
+    logger = logging.getLogger('bench_decode')
+    logger.addHandler(logging.StreamHandler(io.StringIO()))
+    logger.propagate = False
+    payload = sample_payloads()[0][3]
+    logger.setLevel(logging.INFO)
+    info_rate = bench(lambda: logger.info(f"收到消息: esp32/ad1/data -> {payload.decode('utf-8')}"), args.count)
+    logger.setLevel(logging.WARNING)
+    debug_rate = bench(lambda: logger.debug("收到消息: %s -> %s", 'esp32/ad1/data', payload), args.count)
+    print(f"\n每条消息INFO日志:     {info_rate:>12.0f} msgs/s")
+    print(f"DEBUG日志(未启用):    {debug_rate:>12.0f} msgs/s")
+
+
+if __name__ == "__main__":
+    main()
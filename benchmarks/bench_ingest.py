@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MQTT入库处理基准测试 (不需要MQTT代理)
+用合成消息直接调用 MQTTClient.on_message (paho回调入口) 和 AsyncIngestEngine 的路由分发，
+测量 解码+路由+入队 的吞吐量，经写后队列全部落盘的端到端吞吐量，
+以及经进程内MQTT代理 (transport = loopback) 发布到全部落盘的吞吐量。
+用法: python benchmarks/bench_ingest.py [--count 100000]
+"""
+
+import os
+import time
+import json
+import logging
+import argparse
+import tempfile
+
+from common import write_config, rate, seeded_random
+
+from database import DatabaseManager
+from ingest_writer import IngestWriter
+from mqtt_client import MQTTClient
+from async_ingest import AsyncIngestEngine
+from loopback_broker import LoopbackClient
+from payload_codec import encode_telemetry_binary, encode_telemetry_batch_binary
+
+DEVICES = 50
+BATCH_SAMPLES = 10
+
+
+class SyntheticMessage:
+    """与paho的MQTTMessage相同的属性"""
+    __slots__ = ('topic', 'payload')
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def build_messages(case, count, seed):
+    """生成count条某种格式的消息，设备和采样值由seed决定"""
+    rng = seeded_random(seed)
+    messages = []
+    for index in range(count):
+        device_id = f"bench_{rng.randrange(DEVICES):04d}"
+        topic = f"esp32/{device_id}/AD1/data"
+        value = rng.randint(0, 4095)
+        if case == 'json':
+            payload = json.dumps({"device_id": device_id, "channel": "AD1", "value": value, "unit": "ADC",
+                                  "timestamp": index}).encode('utf-8')
+        elif case == 'binary':
+            payload = encode_telemetry_binary(value, index)
+        elif case == 'json_batch':
+            payload = json.dumps({"device_id": device_id, "channel": "AD1", "unit": "ADC", "base_ts": index,
+                                  "deltas": [0] + [100] * (BATCH_SAMPLES - 1),
+                                  "values": [rng.randint(0, 4095) for _ in range(BATCH_SAMPLES)]},
+                                 separators=(',', ':')).encode('utf-8')
+        elif case == 'binary_batch':
+            payload = encode_telemetry_batch_binary([rng.randint(0, 4095) for _ in range(BATCH_SAMPLES)],
+                                                    [0] + [100] * (BATCH_SAMPLES - 1), index)
+        elif case == 'legacy_topic':
+            # 旧的单设备主题，设备ID只在负载中
+            topic = 'esp32/ad1/data'
+            payload = json.dumps({"device_id": device_id, "channel": "AD1", "value": value, "unit": "ADC",
+                                  "timestamp": index}).encode('utf-8')
+        else:
+            raise ValueError(f"未知的消息类型: {case}")
+        messages.append(SyntheticMessage(topic, payload))
+    return messages
+
+
+CASES = ('json', 'binary', 'json_batch', 'binary_batch', 'legacy_topic')
+
+
+def samples_per_message(case):
+    return BATCH_SAMPLES if case.endswith('_batch') else 1
+
+
+def bench_paho_dispatch(config_file, db, messages):
+    """MQTTClient.on_message -> 解码 -> 入队 (写线程不运行，只测回调本身)"""
+    writer = IngestWriter(db, max_queue_size=len(messages) + 1)
+    client = MQTTClient(config_file, db, writer)
+    return rate(len(messages), lambda: [client.on_message(None, None, message) for message in messages])
+
+
+def bench_asyncio_dispatch(config_file, db, messages):
+    """AsyncIngestEngine 的路由分发和解码 (返回待写入数据行，不含事件循环调度)"""
+    engine = AsyncIngestEngine(config_file, db)
+    dispatch = engine.router.dispatch
+    result = rate(len(messages), lambda: [dispatch(message.topic, message.payload) for message in messages])
+    engine.executor.shutdown()
+    return result
+
+
+def bench_end_to_end(config_file, db, messages):
+    """on_message 到全部数据行提交的吞吐量 (写后队列按默认批大小写入)"""
+    writer = IngestWriter(db, batch_size=500, flush_interval=0.2, max_queue_size=len(messages) + 1)
+    client = MQTTClient(config_file, db, writer)
+    writer.start()
+
+    def run():
+        for message in messages:
+            client.on_message(None, None, message)
+        writer.stop(timeout=600)
+    return rate(len(messages), run)
+
+
+def bench_loopback(config_file, db, messages):
+    """LoopbackClient.publish -> 进程内代理 -> MQTTClient -> 全部数据行提交 (config_file 需为 transport = loopback)"""
+    writer = IngestWriter(db, batch_size=500, flush_interval=0.2, max_queue_size=len(messages) + 1)
+    client = MQTTClient(config_file, db, writer)
+    writer.start()
+    client.connect()
+    publisher = LoopbackClient(client_id='bench_publisher')
+    publisher.connect(client.broker, client.port)
+    publisher.loop_start()
+    while not publisher.is_connected():
+        time.sleep(0.01)
+    # 入库客户端上线时发布的状态消息也会被自己收到
+    expected = client.messages_received + len(messages)
+
+    def run():
+        for message in messages:
+            publisher.publish(message.topic, message.payload)
+        while client.messages_received < expected:
+            time.sleep(0.001)
+        writer.stop(timeout=600)
+    result = rate(len(messages), run)
+    publisher.loop_stop()
+    client.client.loop_stop()
+    client.client.disconnect()
+    return result
+
+
+def run(count=100000, seed=42, cases=CASES):
+    """返回各消息类型的 msgs/s 和 samples/s"""
+    result = {'count': count, 'cases': {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for case in cases:
+            db_path = os.path.join(tmp_dir, f'{case}.db')
+            config_file = write_config(tmp_dir, db_path, name=f'{case}.ini')
+            loopback_config = write_config(tmp_dir, db_path, name=f'{case}_loopback.ini',
+                                           MQTT={'transport': 'loopback', 'port': 18830})
+            db = DatabaseManager(db_path)
+            db.init_database()
+            messages = build_messages(case, count, seed)
+            # 预热: 主题路由缓存、设备编号缓存
+            bench_paho_dispatch(config_file, db, messages[:1000])
+
+            paho_rate = bench_paho_dispatch(config_file, db, messages)
+            asyncio_rate = bench_asyncio_dispatch(config_file, db, messages)
+            end_to_end_rate = bench_end_to_end(config_file, db, messages)
+            loopback_rate = bench_loopback(loopback_config, db, messages)
+            samples = samples_per_message(case)
+            result['cases'][case] = {
+                'paho_dispatch_msgs_per_sec': paho_rate,
+                'asyncio_dispatch_msgs_per_sec': asyncio_rate,
+                'end_to_end_msgs_per_sec': end_to_end_rate,
+                'end_to_end_samples_per_sec': round(end_to_end_rate * samples, 1),
+                'loopback_msgs_per_sec': loopback_rate,
+            }
+            db.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MQTT入库处理基准测试")
+    parser.add_argument('--count', type=int, default=100000, help="每种消息的条数")
+    parser.add_argument('--seed', type=int, default=42, help="随机种子")
+    parser.add_argument('--cases', default=','.join(CASES), help="消息类型")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    result = run(args.count, args.seed, args.cases.split(','))
+    print(f"{'case':<14}{'paho msgs/s':>14}{'asyncio msgs/s':>16}{'e2e msgs/s':>13}{'e2e samples/s':>15}"
+          f"{'loopback msgs/s':>17}")
+    for case, stats in result['cases'].items():
+        print(f"{case:<14}{stats['paho_dispatch_msgs_per_sec']:>14.0f}{stats['asyncio_dispatch_msgs_per_sec']:>16.0f}"
+              f"{stats['end_to_end_msgs_per_sec']:>13.0f}{stats['end_to_end_samples_per_sec']:>15.0f}"
+              f"{stats['loopback_msgs_per_sec']:>17.0f}")
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
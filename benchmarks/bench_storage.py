@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DatabaseManager存储基准测试
+用 save_batch 批量写入 rows 行合成时序数据 (devices 个设备，每设备每秒一个采样)，
+再测量历史分页、时间范围、游标翻页、汇总曲线和设备列表查询的延迟。
+数据和查询参数由seed决定，同一参数多次运行结果可比。
+用法: python benchmarks/bench_storage.py [--rows 1000000] [--devices 100] [--queries 200]
+"""
+
+import os
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+from common import latency_stats, time_each, seeded_random
+
+from database import DatabaseManager
+
+# 合成数据的起始时间 (固定值，保证可复现)
+BASE_TS = 1_700_000_000_000
+SAMPLE_INTERVAL_MS = 1000
+
+
+def device_name(index):
+    return f"bench_{index:04d}"
+
+
+def populate(db, rows, devices, batch_size=5000, seed=42):
+    """按时间顺序轮流为各设备写入rows行，返回写入速率 (rows/s)"""
+    rng = seeded_random(seed)
+    names = [device_name(index) for index in range(devices)]
+    written = 0
+    start = time.perf_counter()
+    while written < rows:
+        count = min(batch_size, rows - written)
+        batch = []
+        for position in range(written, written + count):
+            step, device = divmod(position, devices)
+            batch.append((names[device], 'AD1', BASE_TS + step * SAMPLE_INTERVAL_MS, rng.randint(0, 4095)))
+        if not db.save_batch({'telemetry': batch}):
+            raise RuntimeError("批量写入失败")
+        written += count
+    return round(rows / (time.perf_counter() - start), 1)
+
+
+def query_cases(rows, devices, queries, seed):
+    """各类查询的 (名称, 函数, 参数列表)"""
+    rng = seeded_random(seed + 1)
+    span_ms = max(1, rows // devices) * SAMPLE_INTERVAL_MS
+    end_ts = BASE_TS + span_ms
+
+    def random_device():
+        return device_name(rng.randrange(devices))
+
+    def random_window(width_ms):
+        since = BASE_TS + rng.randrange(max(1, span_ms - width_ms))
+        return since, since + width_ms
+
+    hour = 3600 * 1000
+    return [
+        ('latest_page_100', 'get_telemetry_page',
+         [(random_device(), 'AD1', None, None, None, 100) for _ in range(queries)]),
+        ('range_1h_page_1000', 'get_telemetry_page',
+         [(random_device(), 'AD1') + random_window(hour) + (None, 1000) for _ in range(queries)]),
+        # 从时间范围中间的游标继续翻页
+        ('cursor_page_100', 'get_telemetry_page',
+         [(random_device(), 'AD1', None, None, f"{random_window(0)[0]},{2 ** 62}", 100) for _ in range(queries)]),
+        ('rollup_1h', 'query_telemetry_rollup',
+         [(random_device(), 'AD1') + random_window(hour) for _ in range(queries)]),
+        ('rollup_full_range', 'query_telemetry_rollup',
+         [(random_device(), 'AD1', BASE_TS, end_ts) for _ in range(queries)]),
+        ('devices', 'get_devices', [() for _ in range(max(1, queries // 10))]),
+    ]
+
+
+def run(rows=1000000, devices=100, queries=200, batch_size=5000, seed=42, db_dir=None):
+    """写入并查询，返回结果字典"""
+    with tempfile.TemporaryDirectory(dir=db_dir) as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'storage.db')
+        db = DatabaseManager(db_path)
+        db.init_database()
+        insert_rate = populate(db, rows, devices, batch_size, seed)
+        size_mb = round(os.path.getsize(db_path) / 1024 / 1024, 1)
+
+        result = {
+            'rows': rows,
+            'devices': devices,
+            'batch_size': batch_size,
+            'insert_rows_per_sec': insert_rate,
+            'db_size_mb': size_mb,
+            'queries': {},
+        }
+        for name, method, args_list in query_cases(rows, devices, queries, seed):
+            func = getattr(db, method)
+            # 预热: 页缓存和预编译语句
+            time_each(func, args_list[:5])
+            result['queries'][name] = latency_stats(time_each(func, args_list))
+        db.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DatabaseManager存储基准测试")
+    parser.add_argument('--rows', type=int, default=1000000, help="写入的总行数 (如 1000000 / 10000000)")
+    parser.add_argument('--devices', type=int, default=100, help="设备数")
+    parser.add_argument('--queries', type=int, default=200, help="每类查询的次数")
+    parser.add_argument('--batch-size', type=int, default=5000, help="每个事务写入的行数")
+    parser.add_argument('--seed', type=int, default=42, help="随机种子")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    result = run(args.rows, args.devices, args.queries, args.batch_size, args.seed)
+    print(f"写入 {result['rows']} 行: {result['insert_rows_per_sec']:.0f} rows/s, 数据库 {result['db_size_mb']} MB")
+    for name, stats in result['queries'].items():
+        print(f"{name:<22}{stats['ops_per_sec']:>10.0f} q/s  p50 {stats['p50_ms']:8.3f} ms  "
+              f"p99 {stats['p99_ms']:8.3f} ms")
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
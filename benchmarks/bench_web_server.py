@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WebServer负载基准测试
+对比: Flask开发服务器 与 waitress 多线程模式 的吞吐量和延迟
+测试前先打开 --streams 个实时推送 (SSE) 长连接并保持到结束，验证推送客户端不会占满waitress线程:
+超过 threads - stream_reserved_threads 的推送连接应被拒绝 (503)，普通请求不应超时。
+用法: python benchmarks/bench_web_server.py [--clients 16] [--duration 5] [--streams 16] [--path /api/ad1/current]
+"""
+
+import os
+import sys
+import time
+import json
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import http.client
+import configparser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+from mqtt_client import MQTTClient
+from web_server import WebServer
+from live_stream import LiveBroadcaster
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def write_config(tmp_dir, mode, port, threads):
+    """基于项目config.ini生成测试用配置"""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(ROOT_DIR, 'config.ini'))
+    config['WEB_SERVER']['host'] = '127.0.0.1'
+    config['WEB_SERVER']['port'] = str(port)
+    config['WEB_SERVER']['server'] = mode
+    config['WEB_SERVER']['threads'] = str(threads)
+    path = os.path.join(tmp_dir, f'config_{mode}.ini')
+    with open(path, 'w', encoding='utf-8') as f:
+        config.write(f)
+    return path
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(('127.0.0.1', port)) == 0:
+                return True
+        time.sleep(0.1)
+    return False
+
+
+def run_clients(port, path, clients, duration):
+    """多个客户端线程在duration秒内持续请求，返回 (请求数, 延迟列表)"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        local = []
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                conn.getresponse().read()
+                local.append(time.perf_counter() - start)
+            except Exception:
+                errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors[0]
+
+
+def open_streams(port, count):
+    """打开count个SSE连接并保持，返回 (连接列表, 被拒绝数, 超时数)"""
+    streams, rejected, timeouts = [], 0, 0
+    for _ in range(count):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        try:
+            conn.request('GET', '/api/stream')
+            response = conn.getresponse()
+        except OSError:
+            timeouts += 1
+            conn.close()
+            continue
+        if response.status == 200:
+            streams.append(conn)
+        else:
+            response.read()
+            rejected += 1
+            conn.close()
+    return streams, rejected, timeouts
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else 0.0
+
+
+def bench_mode(tmp_dir, mode, args):
+    port = free_port()
+    config_file = write_config(tmp_dir, mode, port, args.threads)
+    db = DatabaseManager(os.path.join(tmp_dir, 'bench.db'))
+    mqtt_client = MQTTClient(config_file, db)
+    # 准备当前值和历史数据
+    for i in range(1000):
+        mqtt_client.handle_ad1_data(json.dumps({'device_id': 'bench', 'channel': 'AD1', 'value': i}))
+        db.save_ad1_data(i, 'bench', 'AD1')
+
+    server = WebServer(config_file, db, mqtt_client, broadcaster=LiveBroadcaster())
+    threading.Thread(target=server.start, daemon=True).start()
+    if not wait_for_port(port):
+        raise RuntimeError(f"{mode} 服务器启动失败")
+
+    streams, rejected, timeouts = open_streams(port, args.streams)
+    latencies, errors = run_clients(port, args.path, args.clients, args.duration)
+    for conn in streams:
+        conn.close()
+    return {
+        'mode': mode,
+        'streams_open': len(streams),
+        'streams_rejected': rejected,
+        'streams_timeout': timeouts,
+        'requests': len(latencies),
+        'errors': errors,
+        'req_per_sec': len(latencies) / args.duration,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebServer负载基准测试")
+    parser.add_argument('--clients', type=int, default=16, help="并发客户端数")
+    parser.add_argument('--duration', type=float, default=5, help="每种模式的测试时长(秒)")
+    parser.add_argument('--threads', type=int, default=16, help="waitress线程数")
+    parser.add_argument('--streams', type=int, default=16, help="测试期间保持打开的SSE连接数")
+    parser.add_argument('--path', default='/api/ad1/current', help="请求路径")
+    parser.add_argument('--modes', default='dev,waitress', help="测试的服务器模式")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode in args.modes.split(','):
+            result = bench_mode(tmp_dir, mode, args)
+            print(f"{result['mode']:10s} {result['req_per_sec']:10.1f} req/s  "
+                  f"p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  "
+                  f"errors {result['errors']}  streams {result['streams_open']} open / "
+                  f"{result['streams_rejected']} rejected / {result['streams_timeout']} timeout")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""基准测试公共工具: 测试用配置、计时和统计"""
+
+import os
+import sys
+import time
+import random
+import configparser
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+def write_config(tmp_dir, db_path, name='config.ini', **sections):
+    """基于项目config.ini生成测试用配置，sections为 {节: {项: 值}} 覆盖"""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(ROOT_DIR, 'config.ini'))
+    config['DATABASE']['db_path'] = db_path
+    # 基准测试不连接MQTT代理，地址只用于构造客户端
+    config['MQTT']['broker'] = '127.0.0.1'
+    for section, options in sections.items():
+        for key, value in options.items():
+            config[section][key] = str(value)
+    path = os.path.join(tmp_dir, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        config.write(f)
+    return path
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))] if sorted_values else 0.0
+
+
+def latency_stats(samples):
+    """秒为单位的单次耗时列表 -> 每秒次数和毫秒分位数"""
+    values = sorted(samples)
+    total = sum(values)
+    return {
+        'ops_per_sec': round(len(values) / total, 1) if total else 0.0,
+        'p50_ms': round(percentile(values, 0.50) * 1000, 4),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 4),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 4),
+    }
+
+
+def time_each(func, args_list):
+    """对每组参数调用一次func，返回每次的耗时(秒)"""
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def rate(count, func):
+    """执行func，返回 count / 耗时"""
+    start = time.perf_counter()
+    func()
+    return round(count / (time.perf_counter() - start), 1)
+
+
+def seeded_random(seed):
+    """独立的随机数生成器，保证同一seed下数据和查询参数完全一致"""
+    return random.Random(seed)
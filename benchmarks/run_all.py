@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试套件入口 (离线运行，不需要MQTT代理和网络)
+依次运行 storage (bench_storage)、ingest (bench_ingest)、api (bench_api)，
+把结果和运行环境写入JSON文件，用于回归跟踪；--compare 与之前的结果逐项对比。
+用法:
+  python benchmarks/run_all.py                        # 默认规模 (100万行)
+  python benchmarks/run_all.py --preset quick         # 快速检查
+  python benchmarks/run_all.py --preset large         # 1000万行
+  python benchmarks/run_all.py --compare benchmarks/results/baseline.json --threshold 0.15
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+
+from common import ROOT_DIR
+
+import bench_storage
+import bench_ingest
+import bench_api
+import payload_codec
+
+# 各规模的参数: {套件: run() 的参数}
+PRESETS = {
+    'quick': {
+        'storage': {'rows': 100000, 'queries': 100},
+        'ingest': {'count': 10000},
+        'api': {'rows': 50000, 'requests': 200},
+    },
+    'default': {
+        'storage': {'rows': 1000000, 'queries': 200},
+        'ingest': {'count': 100000},
+        'api': {'rows': 100000, 'requests': 1000},
+    },
+    'large': {
+        'storage': {'rows': 10000000, 'queries': 200},
+        'ingest': {'count': 200000},
+        'api': {'rows': 1000000, 'requests': 1000},
+    },
+}
+
+SUITES = {
+    'storage': bench_storage.run,
+    'ingest': bench_ingest.run,
+    'api': bench_api.run,
+}
+
+
+def environment():
+    """结果对比时需要知道的运行环境"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'sqlite': sqlite3.sqlite_version,
+        'json_backend': payload_codec.default_codec.backend,
+    }
+
+
+def flatten(value, prefix=''):
+    """嵌套结果展开为 {a.b.c: 数值}"""
+    items = {}
+    if isinstance(value, dict):
+        for key, child in value.items():
+            items.update(flatten(child, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        items[prefix] = value
+    return items
+
+
+def higher_is_better(key):
+    name = key.rsplit('.', 1)[-1]
+    if name.endswith('_per_sec'):
+        return True
+    if name.endswith('_ms') or name.endswith('_mb'):
+        return False
+    return None
+
+
+def compare(baseline, current, threshold):
+    """逐项对比两次结果的 suites 部分，返回变差超过threshold的指标列表"""
+    old = flatten(baseline.get('suites', {}))
+    new = flatten(current.get('suites', {}))
+    regressions = []
+    print(f"\n{'指标':<62}{'基线':>12}{'本次':>12}{'变化':>9}")
+    for key in sorted(old.keys() & new.keys()):
+        direction = higher_is_better(key)
+        if direction is None or not old[key]:
+            continue
+        change = (new[key] - old[key]) / old[key]
+        worse = -change if direction else change
+        mark = ''
+        if worse > threshold:
+            mark = '  <-- 变差'
+            regressions.append(key)
+        print(f"{key:<62}{old[key]:>12.4g}{new[key]:>12.4g}{change:>+9.1%}{mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="基准测试套件")
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='default', help="测试规模")
+    parser.add_argument('--suites', default=','.join(SUITES), help="要运行的套件，逗号分隔")
+    parser.add_argument('--seed', type=int, default=42, help="随机种子 (数据和查询参数)")
+    parser.add_argument('--output', help="结果文件，默认 benchmarks/results/<时间>_<preset>.json")
+    parser.add_argument('--compare', help="与之前的结果文件对比")
+    parser.add_argument('--threshold', type=float, default=0.10, help="对比时视为变差的相对变化")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    suites = [name.strip() for name in args.suites.split(',') if name.strip()]
+    unknown = [name for name in suites if name not in SUITES]
+    if unknown:
+        parser.error(f"未知的套件: {', '.join(unknown)}")
+
+    result = {'meta': environment(), 'preset': args.preset, 'seed': args.seed, 'params': {}, 'suites': {}}
+    for name in suites:
+        params = dict(PRESETS[args.preset][name], seed=args.seed)
+        print(f"运行 {name}: {params}", flush=True)
+        start = time.perf_counter()
+        result['params'][name] = params
+        result['suites'][name] = SUITES[name](**params)
+        print(f"  完成，用时 {time.perf_counter() - start:.1f}s", flush=True)
+
+    output = args.output or os.path.join(
+        ROOT_DIR, 'benchmarks', 'results', f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{args.preset}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if any(baseline.get('params', {}).get(name) != params for name, params in result['params'].items()):
+            print("注意: 基线的测试规模或参数与本次不同，对比结果仅供参考")
+        regressions = compare(baseline, result, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} 项指标变差超过 {args.threshold:.0%}")
+            sys.exit(1)
+        print(f"\n没有指标变差超过 {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
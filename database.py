@@ -1,139 +1,690 @@
 import sqlite3
 import json
+import time
+import queue
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 import logging
+import metrics
+from log_setup import SampledLogger
+from latency_tracker import latency_tracker
+
+# 未携带device_id/channel字段的数据归入的默认设备和通道
+DEFAULT_DEVICE_ID = 'esp32'
+DEFAULT_CHANNEL = 'AD1'
+
+# 批量写入支持的表及其INSERT语句
+# telemetry的行格式为 (设备名, 通道名, 毫秒时间戳, 值, 设备时间戳, 接收时间戳)，写入前转换为整数编号；
+# 后两项可省略 (按NULL写入)
+BATCH_INSERT_SQL = {
+    'telemetry': 'INSERT INTO telemetry (device, channel, ts, value, device_ts, ingest_ts) VALUES (?, ?, ?, ?, ?, ?)',
+    'io1_control': 'INSERT INTO io1_control (state) VALUES (?)',
+    'device_status': 'INSERT INTO device_status (status) VALUES (?)',
+}
+
+# 逐条保存的成功日志按采样输出
+save_log = SampledLogger()
+
+# 分页查询单页最大条数
+MAX_PAGE_SIZE = 1000
+
+# 汇总表的时间桶宽度(秒): 1分钟、1小时、1天
+ROLLUP_RESOLUTIONS = (60, 3600, 86400)
+
+# 汇总表增量更新：同一个桶的计数和累加，最值取较大/较小者
+ROLLUP_UPSERT_SQL = '''
+    INSERT INTO telemetry_rollup (resolution, device, channel, bucket, count, sum, min, max)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (resolution, device, channel, bucket) DO UPDATE SET
+        count = count + excluded.count,
+        sum = sum + excluded.sum,
+        min = MIN(min, excluded.min),
+        max = MAX(max, excluded.max)
+'''
+
+# 数据库模式迁移: (版本号, 说明, SQL语句列表)
+# 版本号记录在 PRAGMA user_version 中，新增迁移只能追加到列表末尾
+SCHEMA_MIGRATIONS = [
+    (1, "创建基础数据表", [
+        '''
+        CREATE TABLE IF NOT EXISTS ad1_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            value INTEGER NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS io1_control (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            state BOOLEAN NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS device_status (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (2, "为时间戳创建索引", [
+        'CREATE INDEX IF NOT EXISTS idx_ad1_data_timestamp ON ad1_data (timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_io1_control_timestamp ON io1_control (timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_device_status_timestamp ON device_status (timestamp)',
+    ]),
+    (3, "多设备多通道时序表", [
+        # 设备名和通道名字典，时序表中只保存整数编号
+        '''
+        CREATE TABLE IF NOT EXISTS devices (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS channels (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+        ''',
+        # ts为UTC毫秒时间戳
+        '''
+        CREATE TABLE IF NOT EXISTS telemetry (
+            id INTEGER PRIMARY KEY,
+            device INTEGER NOT NULL REFERENCES devices (id),
+            channel INTEGER NOT NULL REFERENCES channels (id),
+            ts INTEGER NOT NULL,
+            value NUMERIC NOT NULL
+        )
+        ''',
+        # 已出现过的 设备+通道 组合
+        '''
+        CREATE TABLE IF NOT EXISTS series (
+            device INTEGER NOT NULL REFERENCES devices (id),
+            channel INTEGER NOT NULL REFERENCES channels (id),
+            PRIMARY KEY (device, channel)
+        ) WITHOUT ROWID
+        ''',
+        # 按设备+通道的查询走索引范围扫描
+        'CREATE INDEX IF NOT EXISTS idx_telemetry_device_channel_ts ON telemetry (device, channel, ts)',
+        'CREATE INDEX IF NOT EXISTS idx_telemetry_ts ON telemetry (ts)',
+        # 旧的ad1_data数据迁移到默认设备的AD1通道
+        f"INSERT OR IGNORE INTO devices (name) VALUES ('{DEFAULT_DEVICE_ID}')",
+        f"INSERT OR IGNORE INTO channels (name) VALUES ('{DEFAULT_CHANNEL}')",
+        f'''
+        INSERT INTO telemetry (device, channel, ts, value)
+        SELECT d.id, c.id, CAST(strftime('%s', a.timestamp) AS INTEGER) * 1000, a.value
+        FROM ad1_data a, devices d, channels c
+        WHERE d.name = '{DEFAULT_DEVICE_ID}' AND c.name = '{DEFAULT_CHANNEL}'
+        ORDER BY a.id
+        ''',
+        'INSERT OR IGNORE INTO series (device, channel) SELECT DISTINCT device, channel FROM telemetry',
+    ]),
+    (4, "时间桶汇总表", [
+        # resolution为桶宽度(秒)，bucket为桶起始的毫秒时间戳
+        '''
+        CREATE TABLE IF NOT EXISTS telemetry_rollup (
+            resolution INTEGER NOT NULL,
+            device INTEGER NOT NULL,
+            channel INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            sum REAL NOT NULL,
+            min NUMERIC NOT NULL,
+            max NUMERIC NOT NULL,
+            PRIMARY KEY (resolution, device, channel, bucket)
+        ) WITHOUT ROWID
+        ''',
+    ] + [
+        # 用已有的原始数据回填各级汇总
+        f'''
+        INSERT INTO telemetry_rollup (resolution, device, channel, bucket, count, sum, min, max)
+        SELECT {resolution}, device, channel, ts - ts % {resolution * 1000},
+               COUNT(*), SUM(value), MIN(value), MAX(value)
+        FROM telemetry
+        GROUP BY device, channel, ts - ts % {resolution * 1000}
+        '''
+        for resolution in ROLLUP_RESOLUTIONS
+    ]),
+    (5, "记录设备时间戳和接收时间戳", [
+        # device_ts: 设备上报的采样时间 (UTC毫秒，设备没有同步时钟时为NULL)
+        # ingest_ts: 服务器收到消息的时间 (UTC毫秒)，与提交时间之差即入库延迟
+        'ALTER TABLE telemetry ADD COLUMN device_ts INTEGER',
+        'ALTER TABLE telemetry ADD COLUMN ingest_ts INTEGER',
+    ]),
+]
+
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
 
 class DatabaseManager:
-    def __init__(self, db_path):
+    def __init__(self, db_path, pool_size=8, timeout=30, journal_mode='WAL',
+                 synchronous='NORMAL', cache_size=-16000, mmap_size=268435456):
         self.db_path = db_path
+        self.timeout = timeout
+
+        # 存储参数：WAL + synchronous=NORMAL 只在检查点时fsync，
+        # cache_size为负数时单位是KiB，mmap_size单位是字节
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+
+        # 连接池：paho网络线程和Flask工作线程共享一组长连接，
+        # 避免每次读写都重新 connect()/close()
+        self.pool_size = pool_size
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._pool_lock = threading.Lock()
+        self._open_connections = 0
+        self._closed = False
+
+        # 设备/通道名 -> 整数编号 的内存缓存
+        self._device_ids = {}
+        self._channel_ids = {}
+        self._known_series = set()
+
         self.init_database()
-        
+
+    def _create_connection(self):
+        """创建新的数据库连接"""
+        # 连接会在线程间借还，但同一时刻只被一个线程使用
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        # 以下参数只对当前连接生效，每个新连接都需要设置
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute(f'PRAGMA cache_size={int(self.cache_size)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        with self._pool_lock:
+            self._open_connections += 1
+        return conn
+
+    def _close_connection(self, conn):
+        """关闭连接并更新计数"""
+        with self._pool_lock:
+            self._open_connections -= 1
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """从连接池借出一个连接，用完自动归还"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("数据库连接池已关闭")
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._create_connection()
+
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._release_connection(conn)
+
+    def _release_connection(self, conn):
+        """归还连接，池已满或已关闭时直接关闭"""
+        if not self._closed:
+            try:
+                self._pool.put_nowait(conn)
+                return
+            except queue.Full:
+                pass
+        self._close_connection(conn)
+
+    def close(self):
+        """关闭连接池中的所有连接"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            self._close_connection(conn)
+        logging.info("数据库连接池已关闭")
+
     def init_database(self):
-        """初始化数据库表"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # 创建AD1数据表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS ad1_data (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    value INTEGER NOT NULL,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # 创建IO1控制状态表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS io1_control (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    state BOOLEAN NOT NULL,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # 创建设备状态表
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS device_status (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    status TEXT NOT NULL,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            conn.commit()
-            conn.close()
-            logging.info("数据库初始化成功")
-            
+        """初始化数据库：设置日志模式并执行模式迁移"""
+        try:
+            with self.connection() as conn:
+                # 增量回收空闲页：只对尚未建表的新数据库生效，旧数据库见 convert_to_incremental_vacuum
+                conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                # WAL模式下读者不阻塞写者，设置会持久化到数据库文件
+                journal_mode = conn.execute(f'PRAGMA journal_mode={self.journal_mode}').fetchone()[0]
+                self.migrate_schema(conn)
+            logging.info(f"数据库初始化成功 (journal_mode={journal_mode}, schema_version={SCHEMA_VERSION})")
+
         except Exception as e:
             logging.error(f"数据库初始化失败: {e}")
-    
-    def save_ad1_data(self, value):
-        """保存AD1数据"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('INSERT INTO ad1_data (value) VALUES (?)', (value,))
+
+    def get_schema_version(self, conn):
+        """获取数据库模式版本"""
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def migrate_schema(self, conn):
+        """按版本依次执行尚未应用的模式迁移，每个版本一个事务"""
+        for version, description, statements in SCHEMA_MIGRATIONS:
+            if version <= self.get_schema_version(conn):
+                continue
+            # IMMEDIATE事务先取得写锁，再确认版本，避免多个进程重复迁移
+            conn.execute('BEGIN IMMEDIATE')
+            if version <= self.get_schema_version(conn):
+                conn.rollback()
+                continue
+            logging.info(f"执行数据库迁移 v{version}: {description}")
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+
+    def _lookup_id(self, conn, table, name, cache):
+        """查找设备/通道名对应的整数编号，不存在时创建"""
+        name_id = cache.get(name)
+        if name_id is None:
+            # 新名称单独提交，保证缓存中的编号一定已经落盘
+            conn.execute(f'INSERT OR IGNORE INTO {table} (name) VALUES (?)', (name,))
             conn.commit()
-            conn.close()
-            logging.info(f"AD1数据保存成功: {value}")
+            name_id = conn.execute(f'SELECT id FROM {table} WHERE name = ?', (name,)).fetchone()[0]
+            cache[name] = name_id
+        return name_id
+
+    def get_device_key(self, conn, device_id):
+        """获取设备编号"""
+        return self._lookup_id(conn, 'devices', device_id, self._device_ids)
+
+    def get_channel_key(self, conn, channel):
+        """获取通道编号"""
+        return self._lookup_id(conn, 'channels', channel, self._channel_ids)
+
+    def _resolve_telemetry_rows(self, conn, rows):
+        """把 (设备名, 通道名, ts, 值[, 设备时间戳, 接收时间戳]) 转换为 (设备编号, 通道编号, ts, 值, 设备时间戳, 接收时间戳)
+
+        新的设备/通道/序列会单独提交，因此必须在本事务的任何数据写入之前调用，
+        否则会把已写入的数据提前提交，破坏每批一个事务的约定。
+        """
+        resolved = []
+        for row in rows:
+            key = (self.get_device_key(conn, row[0]), self.get_channel_key(conn, row[1]))
+            if key not in self._known_series:
+                conn.execute('INSERT OR IGNORE INTO series (device, channel) VALUES (?, ?)', key)
+                conn.commit()
+                self._known_series.add(key)
+            resolved.append(key + tuple(row[2:]) if len(row) == 6 else key + (row[2], row[3], None, None))
+        return resolved
+
+    def _insert_telemetry(self, conn, rows):
+        """写入已转换编号的时序数据，并在同一事务中增量更新汇总表"""
+        conn.executemany(BATCH_INSERT_SQL['telemetry'], rows)
+
+        # 先在内存中按桶聚合，每个桶只执行一次UPSERT
+        buckets = {}
+        for device, channel, ts, value, _, _ in rows:
+            for resolution in ROLLUP_RESOLUTIONS:
+                key = (resolution, device, channel, ts - ts % (resolution * 1000))
+                agg = buckets.get(key)
+                if agg is None:
+                    buckets[key] = [1, value, value, value]
+                else:
+                    agg[0] += 1
+                    agg[1] += value
+                    if value < agg[2]:
+                        agg[2] = value
+                    if value > agg[3]:
+                        agg[3] = value
+        conn.executemany(ROLLUP_UPSERT_SQL, [key + tuple(agg) for key, agg in buckets.items()])
+
+    def save_ad1_data(self, value, device_id=DEFAULT_DEVICE_ID, channel=DEFAULT_CHANNEL, ts=None, device_ts=None):
+        """保存AD1数据，ts为接收时间 (默认当前时间)，device_ts为设备上报的采样时间"""
+        if ts is None:
+            ts = int(time.time() * 1000)
+        try:
+            with self.connection() as conn:
+                rows = self._resolve_telemetry_rows(conn, [(device_id, channel, ts, value, device_ts, ts)])
+                self._insert_telemetry(conn, rows)
+                conn.commit()
+            latency_tracker.record('receive_commit', time.time() * 1000 - ts)
+            metrics.rows_written.labels('telemetry').inc()
+            save_log.log('ad1', "AD1数据保存成功: %s", value)
             return True
         except Exception as e:
             logging.error(f"AD1数据保存失败: {e}")
             return False
-    
+
     def save_io1_control(self, state):
         """保存IO1控制状态"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('INSERT INTO io1_control (state) VALUES (?)', (state,))
-            conn.commit()
-            conn.close()
-            logging.info(f"IO1控制状态保存成功: {state}")
+            with self.connection() as conn:
+                conn.execute('INSERT INTO io1_control (state) VALUES (?)', (state,))
+                conn.commit()
+            metrics.rows_written.labels('io1_control').inc()
+            save_log.log('io1', "IO1控制状态保存成功: %s", state)
             return True
         except Exception as e:
             logging.error(f"IO1控制状态保存失败: {e}")
             return False
-    
+
     def save_device_status(self, status):
         """保存设备状态"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('INSERT INTO device_status (status) VALUES (?)', (status,))
-            conn.commit()
-            conn.close()
-            logging.info(f"设备状态保存成功: {status}")
+            with self.connection() as conn:
+                conn.execute('INSERT INTO device_status (status) VALUES (?)', (status,))
+                conn.commit()
+            metrics.rows_written.labels('device_status').inc()
+            save_log.log('status', "设备状态保存成功: %s", status)
             return True
         except Exception as e:
             logging.error(f"设备状态保存失败: {e}")
             return False
-    
-    def get_latest_ad1_data(self, limit=100):
-        """获取最新的AD1数据"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT value, timestamp FROM ad1_data 
-                ORDER BY timestamp DESC LIMIT ?
-            ''', (limit,))
-            data = cursor.fetchall()
-            conn.close()
-            return data
+
+    def save_batch(self, rows_by_table):
+        """批量保存数据，所有表在同一个事务中提交
+
+        rows_by_table: {表名: [参数元组, ...]}
+        """
+        row_count = sum(len(rows) for rows in rows_by_table.values())
+        start = time.perf_counter()
+        try:
+            with self.connection() as conn:
+                # 先解析设备/通道编号 (新名称会单独提交)，之后所有数据写入在同一个事务中
+                telemetry_rows = rows_by_table.get('telemetry')
+                resolved = self._resolve_telemetry_rows(conn, telemetry_rows) if telemetry_rows else None
+                for table, rows in rows_by_table.items():
+                    if not rows:
+                        continue
+                    if table == 'telemetry':
+                        self._insert_telemetry(conn, resolved)
+                    else:
+                        conn.executemany(BATCH_INSERT_SQL[table], rows)
+                conn.commit()
+        except Exception as e:
+            metrics.rows_dropped.labels('db_error').inc(row_count)
+            logging.error(f"批量数据保存失败: {e}")
+            return False
+        metrics.db_commit_seconds.observe(time.perf_counter() - start)
+        metrics.db_batch_rows.observe(row_count)
+        for table, rows in rows_by_table.items():
+            if rows:
+                metrics.rows_written.labels(table).inc(len(rows))
+        telemetry_rows = rows_by_table.get('telemetry')
+        if telemetry_rows:
+            self.record_ingest_latency(telemetry_rows)
+        return True
+
+    def record_ingest_latency(self, rows):
+        """记录刚提交的时序数据的 接收->提交 延迟，并按间隔抽样测量 提交->读回 延迟"""
+        committed_ms = time.time() * 1000
+        latency_tracker.record_many('receive_commit', [committed_ms - row[5] for row in rows
+                                                      if len(row) == 6 and row[5] is not None])
+        if not latency_tracker.should_probe():
+            return
+        # 与历史数据API相同的查询读回本批最后一行，只查一次，不在写线程上等待
+        # (WAL下提交后新的读事务立即可见，读不到时本次抽样作废)
+        device_id, channel, ts = rows[-1][:3]
+        found, _ = self.get_telemetry_page(device_id, channel, since=ts, until=ts + 1, limit=1)
+        if found:
+            latency_tracker.record('commit_readback', time.time() * 1000 - committed_ms)
+
+    def get_latest_ad1_data(self, limit=100, channel=DEFAULT_CHANNEL):
+        """获取所有设备最新的AD1数据"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.execute('''
+                    SELECT t.value, strftime('%Y-%m-%d %H:%M:%S', t.ts / 1000, 'unixepoch')
+                    FROM telemetry t JOIN channels c ON t.channel = c.id
+                    WHERE c.name = ?
+                    ORDER BY t.ts DESC LIMIT ?
+                ''', (channel, limit))
+                return cursor.fetchall()
         except Exception as e:
             logging.error(f"获取AD1数据失败: {e}")
             return []
-    
+
+    def get_latest_telemetry(self, device_id, channel=DEFAULT_CHANNEL, limit=100):
+        """获取单个设备单个通道的最新数据，返回 [(ts, value), ...]"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.execute('''
+                    SELECT t.ts, t.value FROM telemetry t
+                    WHERE t.device = (SELECT id FROM devices WHERE name = ?)
+                      AND t.channel = (SELECT id FROM channels WHERE name = ?)
+                    ORDER BY t.ts DESC LIMIT ?
+                ''', (device_id, channel, limit))
+                return cursor.fetchall()
+        except Exception as e:
+            logging.error(f"获取设备数据失败: {e}")
+            return []
+
+    @staticmethod
+    def encode_cursor(sort_key, row_id):
+        """分页游标: 上一页最后一行的 (排序键, id)"""
+        return f"{sort_key},{row_id}"
+
+    @staticmethod
+    def decode_cursor(cursor, key_type=int):
+        """解析分页游标，返回 (排序键, id)"""
+        sort_key, row_id = cursor.rsplit(',', 1)
+        return key_type(sort_key), int(row_id)
+
+    def _fetch_page(self, sql, params, limit):
+        """多取一行判断是否还有下一页，返回 (rows, 是否还有下一页)"""
+        with self.connection() as conn:
+            rows = conn.execute(sql, params + [limit + 1]).fetchall()
+        return rows[:limit], len(rows) > limit
+
+    def get_telemetry_page(self, device_id, channel=DEFAULT_CHANNEL, since=None, until=None,
+                           cursor=None, limit=100, ascending=False):
+        """按时间范围和游标分页查询时序数据
+
+        since/until为毫秒时间戳 (since <= ts < until)，cursor为上一页返回的next_cursor。
+        基于 (device, channel, ts) 索引定位，翻到多深每页代价都相同。
+        返回 ([(id, ts, value), ...], next_cursor)，没有下一页时next_cursor为None。
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        compare, order = ('>', 'ASC') if ascending else ('<', 'DESC')
+        conditions = [
+            'device = (SELECT id FROM devices WHERE name = ?)',
+            'channel = (SELECT id FROM channels WHERE name = ?)',
+        ]
+        params = [device_id, channel]
+        if since is not None:
+            conditions.append('ts >= ?')
+            params.append(int(since))
+        if until is not None:
+            conditions.append('ts < ?')
+            params.append(int(until))
+        if cursor:
+            conditions.append(f'(ts, id) {compare} (?, ?)')
+            params.extend(self.decode_cursor(cursor))
+
+        try:
+            rows, has_more = self._fetch_page(f'''
+                SELECT id, ts, value FROM telemetry
+                WHERE {' AND '.join(conditions)}
+                ORDER BY ts {order}, id {order} LIMIT ?
+            ''', params, limit)
+        except Exception as e:
+            logging.error(f"分页查询时序数据失败: {e}")
+            return [], None
+        next_cursor = self.encode_cursor(rows[-1][1], rows[-1][0]) if has_more else None
+        return rows, next_cursor
+
+    def get_event_page(self, table, since=None, until=None, cursor=None, limit=50, ascending=False):
+        """按时间范围和游标分页查询事件表 (io1_control/device_status)
+
+        since/until为 'YYYY-MM-DD HH:MM:SS' 格式的UTC时间。
+        返回 ([(id, 值, timestamp), ...], next_cursor)。
+        """
+        value_columns = {'io1_control': 'state', 'device_status': 'status'}
+        if table not in value_columns:
+            raise ValueError(f"不支持的表: {table}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        compare, order = ('>', 'ASC') if ascending else ('<', 'DESC')
+        conditions = ['1 = 1']
+        params = []
+        if since is not None:
+            conditions.append('timestamp >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('timestamp < ?')
+            params.append(until)
+        if cursor:
+            conditions.append(f'(timestamp, id) {compare} (?, ?)')
+            params.extend(self.decode_cursor(cursor, key_type=str))
+
+        try:
+            rows, has_more = self._fetch_page(f'''
+                SELECT id, {value_columns[table]}, timestamp FROM {table}
+                WHERE {' AND '.join(conditions)}
+                ORDER BY timestamp {order}, id {order} LIMIT ?
+            ''', params, limit)
+        except Exception as e:
+            logging.error(f"分页查询{table}失败: {e}")
+            return [], None
+        next_cursor = self.encode_cursor(rows[-1][2], rows[-1][0]) if has_more else None
+        return rows, next_cursor
+
+    def choose_rollup_resolution(self, since, until, max_points):
+        """选择能在max_points个点内覆盖时间范围的最细汇总粒度(秒)
+
+        所有粒度都超出点数预算时返回最粗的粒度。
+        """
+        span_ms = max(until - since, 0)
+        for resolution in ROLLUP_RESOLUTIONS:
+            if span_ms / (resolution * 1000) <= max_points:
+                return resolution
+        return ROLLUP_RESOLUTIONS[-1]
+
+    def query_telemetry_rollup(self, device_id, channel, since, until, max_points=500, resolution=None):
+        """查询时间范围内的汇总曲线，代价与桶数量成正比而与原始行数无关
+
+        since/until为毫秒时间戳，与原始数据查询相同按 [since, until) 半开区间取桶：
+        包含since所在的桶，不包含从until开始的桶，相邻时间窗口不会重复统计边界上的桶。
+        返回 (粒度秒数, [(bucket, min, max, avg, count), ...])
+        """
+        if resolution is None:
+            resolution = self.choose_rollup_resolution(since, until, max_points)
+        bucket_ms = resolution * 1000
+        try:
+            with self.connection() as conn:
+                cursor = conn.execute('''
+                    SELECT bucket, min, max, sum / count, count FROM telemetry_rollup
+                    WHERE resolution = ?
+                      AND device = (SELECT id FROM devices WHERE name = ?)
+                      AND channel = (SELECT id FROM channels WHERE name = ?)
+                      AND bucket >= ? AND bucket < ?
+                    ORDER BY bucket
+                ''', (resolution, device_id, channel, since - since % bucket_ms, until))
+                return resolution, cursor.fetchall()
+        except Exception as e:
+            logging.error(f"获取汇总数据失败: {e}")
+            return resolution, []
+
+    def _delete_chunk(self, sql, params):
+        """执行一次分块删除并立即提交，返回删除的行数"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.execute(sql, params)
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logging.error(f"删除过期数据失败: {e}")
+            return 0
+
+    def purge_telemetry_chunk(self, cutoff_ts, chunk_size):
+        """删除一批早于cutoff_ts(毫秒)的原始时序数据"""
+        return self._delete_chunk('''
+            DELETE FROM telemetry WHERE id IN (
+                SELECT id FROM telemetry WHERE ts < ? ORDER BY ts LIMIT ?
+            )
+        ''', (cutoff_ts, chunk_size))
+
+    def purge_rollup_chunk(self, resolution, cutoff_ts, chunk_size):
+        """删除一批指定粒度下早于cutoff_ts(毫秒)的汇总数据"""
+        return self._delete_chunk('''
+            DELETE FROM telemetry_rollup WHERE (resolution, device, channel, bucket) IN (
+                SELECT resolution, device, channel, bucket FROM telemetry_rollup
+                WHERE resolution = ? AND bucket < ? LIMIT ?
+            )
+        ''', (resolution, cutoff_ts, chunk_size))
+
+    def purge_event_chunk(self, table, days, chunk_size):
+        """删除一批早于days天的事件数据 (io1_control/device_status/ad1_data)"""
+        if table not in ('ad1_data', 'io1_control', 'device_status'):
+            raise ValueError(f"不支持的表: {table}")
+        return self._delete_chunk(f'''
+            DELETE FROM {table} WHERE id IN (
+                SELECT id FROM {table} WHERE timestamp < datetime('now', ?) ORDER BY timestamp LIMIT ?
+            )
+        ''', (f'-{int(days)} days', chunk_size))
+
+    def is_incremental_vacuum_enabled(self):
+        """数据库是否已启用增量回收 (auto_vacuum=INCREMENTAL)"""
+        with self.connection() as conn:
+            return conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+    def convert_to_incremental_vacuum(self):
+        """把旧数据库转换为增量回收模式，需要一次完整VACUUM，期间会锁库"""
+        try:
+            with self.connection() as conn:
+                conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                conn.execute('VACUUM')
+            logging.info("数据库已转换为增量回收模式")
+            return True
+        except Exception as e:
+            logging.error(f"转换增量回收模式失败: {e}")
+            return False
+
+    def incremental_vacuum(self, pages):
+        """回收最多pages个空闲页，返回剩余空闲页数"""
+        try:
+            with self.connection() as conn:
+                # incremental_vacuum 每回收一页返回一行，需要取完结果才会执行完毕
+                conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+                return conn.execute('PRAGMA freelist_count').fetchone()[0]
+        except Exception as e:
+            logging.error(f"增量回收失败: {e}")
+            return 0
+
+    def get_devices(self):
+        """获取所有设备及其通道，返回 {设备名: [通道名, ...]}"""
+        try:
+            with self.connection() as conn:
+                devices = {name: [] for (name,) in conn.execute('SELECT name FROM devices ORDER BY name')}
+                cursor = conn.execute('''
+                    SELECT d.name, c.name FROM series s
+                    JOIN devices d ON s.device = d.id
+                    JOIN channels c ON s.channel = c.id
+                    ORDER BY d.name, c.name
+                ''')
+                for device_name, channel_name in cursor:
+                    devices[device_name].append(channel_name)
+                return devices
+        except Exception as e:
+            logging.error(f"获取设备列表失败: {e}")
+            return {}
+
     def get_latest_io1_control(self, limit=50):
         """获取最新的IO1控制状态"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT state, timestamp FROM io1_control 
-                ORDER BY timestamp DESC LIMIT ?
-            ''', (limit,))
-            data = cursor.fetchall()
-            conn.close()
-            return data
+            with self.connection() as conn:
+                cursor = conn.execute('''
+                    SELECT state, timestamp FROM io1_control
+                    ORDER BY timestamp DESC LIMIT ?
+                ''', (limit,))
+                return cursor.fetchall()
         except Exception as e:
             logging.error(f"获取IO1控制状态失败: {e}")
             return []
-    
+
     def get_device_status_history(self, limit=50):
         """获取设备状态历史"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT status, timestamp FROM device_status 
-                ORDER BY timestamp DESC LIMIT ?
-            ''', (limit,))
-            data = cursor.fetchall()
-            conn.close()
-            return data
+            with self.connection() as conn:
+                cursor = conn.execute('''
+                    SELECT status, timestamp FROM device_status
+                    ORDER BY timestamp DESC LIMIT ?
+                ''', (limit,))
+                return cursor.fetchall()
         except Exception as e:
             logging.error(f"获取设备状态历史失败: {e}")
             return []
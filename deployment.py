@@ -0,0 +1,300 @@
+"""
+多进程部署模式
+入库进程 (MQTTClient + 写线程 + 模拟器) 与 N 个Web工作进程分开运行，
+共享WAL数据库和共享内存最新值表，HTTP负载可以扩展到多个CPU核而不拖慢入库。
+由 main.py 在 [DEPLOYMENT] mode = multiprocess 时启动。
+"""
+
+import time
+import signal
+import socket
+import logging
+import threading
+import configparser
+import multiprocessing
+
+from database import DatabaseManager
+from shared_latest import SharedLatestTable, SharedSnapshot
+from log_setup import setup_logging, SampledLogger, PROCESS_LOG_FORMAT
+
+relay_error_log = SampledLogger(logging.ERROR)
+
+def latency_snapshot_name(shm_name):
+    """入库延迟快照的共享内存名称"""
+    return f'{shm_name}_latency'
+
+def setup_process_logging(config, process_name):
+    """子进程日志配置，每个进程写自己的日志文件"""
+    return setup_logging(config, process_name, PROCESS_LOG_FORMAT)
+
+def install_child_signal_handlers(stop_event):
+    """子进程忽略Ctrl+C，由主进程统一通过stop_event通知退出"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
+def create_database_manager(config):
+    """按配置创建数据库管理器"""
+    return DatabaseManager(
+        config.get('DATABASE', 'db_path'),
+        pool_size=config.getint('DATABASE', 'pool_size', fallback=8),
+        journal_mode=config.get('DATABASE', 'journal_mode', fallback='WAL'),
+        synchronous=config.get('DATABASE', 'synchronous', fallback='NORMAL'),
+        cache_size=config.getint('DATABASE', 'cache_size', fallback=-16000),
+        mmap_size=config.getint('DATABASE', 'mmap_size', fallback=268435456)
+    )
+
+def run_ingest_process(config_file, shm_name, stop_event, ready_event=None):
+    """入库进程：接收MQTT消息、批量写库、更新共享最新值表
+
+    附加共享内存并完成数据库迁移后设置 ready_event，主进程据此启动Web工作进程。
+    """
+    from ingest_writer import IngestWriter
+    from retention import RetentionManager
+    from mqtt_client import MQTTClient
+    from esp32_simulator import ESP32Simulator
+
+    install_child_signal_handlers(stop_event)
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    log_listener = setup_process_logging(config, 'ingest')
+
+    latest_table = SharedLatestTable(shm_name)
+    latency_snapshot = SharedSnapshot(latency_snapshot_name(shm_name))
+    database_manager = create_database_manager(config)
+    if ready_event is not None:
+        ready_event.set()
+    ingest_writer = IngestWriter(
+        database_manager,
+        batch_size=config.getint('INGEST', 'batch_size', fallback=500),
+        flush_interval=config.getfloat('INGEST', 'flush_interval', fallback=1.0),
+        max_queue_size=config.getint('INGEST', 'max_queue_size', fallback=10000)
+    )
+    retention_manager = None
+    if config.getboolean('RETENTION', 'enabled', fallback=True):
+        retention_manager = RetentionManager.from_config(config, database_manager)
+    mqtt_client = MQTTClient(config_file, database_manager, ingest_writer, latest_cache=latest_table)
+    esp32_simulator = ESP32Simulator(config_file)
+
+    ingest_writer.start()
+    if retention_manager:
+        retention_manager.start()
+    mqtt_client.connect()
+    esp32_simulator.connect()
+    threading.Thread(target=LatencyExporter(latency_snapshot).run, args=(stop_event,), daemon=True).start()
+    logging.info("入库进程已启动")
+
+    stop_event.wait()
+
+    logging.info("入库进程正在停止...")
+    esp32_simulator.disconnect()
+    mqtt_client.disconnect()
+    ingest_writer.stop()
+    if retention_manager:
+        retention_manager.stop()
+    database_manager.close()
+    latest_table.close()
+    latency_snapshot.close()
+    logging.info("入库进程已停止")
+    if log_listener:
+        log_listener.stop()
+
+class SharedTableRelay:
+    """把共享最新值表中的变化转发给本进程的实时推送客户端
+
+    Web工作进程不接收MQTT消息，按固定间隔检查共享表中更新过的条目，
+    推送的是最新值，间隔内的中间值会被合并。
+    """
+
+    def __init__(self, latest_table, broadcaster, interval=0.2):
+        self.latest_table = latest_table
+        self.broadcaster = broadcaster
+        self.interval = interval
+        self.versions = {}
+
+    def run(self, stop_event):
+        # 启动时已存在的值不重复推送
+        try:
+            self.latest_table.changed_since(self.versions)
+        except Exception as e:
+            relay_error_log.log('relay', "共享最新值读取失败: %s", e)
+        while not stop_event.wait(self.interval):
+            if not self.broadcaster.client_count():
+                continue
+            # 单次转发失败不能结束线程，否则本进程的实时推送永久停止
+            try:
+                self.relay_changes()
+            except Exception as e:
+                relay_error_log.log('relay', "共享最新值转发失败: %s", e)
+
+    def relay_changes(self):
+        for entry in self.latest_table.changed_since(self.versions):
+            channel = entry['channel']
+            if channel == 'IO1':
+                self.broadcaster.publish('io1', {'device_id': entry['device_id'], 'state': entry['value']})
+            elif channel == 'status':
+                self.broadcaster.publish('status', {'device_id': entry['device_id'], 'status': entry['value']})
+            else:
+                entry.pop('age', None)
+                self.broadcaster.publish('ad1', entry)
+
+class LatencyExporter:
+    """把入库进程的延迟统计定期写入共享内存快照
+
+    延迟在入库进程的写线程中统计，Web工作进程的 /api/latency 读取最近一次写入的快照。
+    """
+
+    def __init__(self, snapshot, interval=1.0):
+        self.snapshot = snapshot
+        self.interval = interval
+
+    def run(self, stop_event):
+        from latency_tracker import latency_tracker
+
+        while True:
+            try:
+                self.snapshot.publish(latency_tracker.snapshot())
+            except Exception as e:
+                relay_error_log.log('latency', "入库延迟快照写入失败: %s", e)
+            if stop_event.wait(self.interval):
+                return
+
+def create_listen_socket(host, port, backlog):
+    """创建启用SO_REUSEPORT的监听套接字，多个进程可监听同一端口由内核分配连接"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+def run_web_worker(config_file, shm_name, worker_index, stop_event):
+    """Web工作进程：只读数据库 + 共享最新值表，IO1控制命令通过独立的MQTT连接发布"""
+    from mqtt_client import MQTTClient
+    from live_stream import LiveBroadcaster
+    from web_server import WebServer
+
+    install_child_signal_handlers(stop_event)
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    log_listener = setup_process_logging(config, f'web{worker_index}')
+
+    latest_table = SharedLatestTable(shm_name)
+    latency_snapshot = SharedSnapshot(latency_snapshot_name(shm_name))
+    database_manager = create_database_manager(config)
+    mqtt_client = MQTTClient(config_file, database_manager, latest_cache=latest_table,
+                             client_id=f"{config.get('MQTT', 'client_id')}_web{worker_index}",
+                             subscribe=False)
+    broadcaster = LiveBroadcaster(
+        buffer_size=config.getint('WEB_SERVER', 'stream_buffer_size', fallback=100),
+        max_clients=config.getint('WEB_SERVER', 'stream_max_clients', fallback=16)
+    )
+    web_server = WebServer(config_file, database_manager, mqtt_client,
+                           latest_cache=latest_table, broadcaster=broadcaster,
+                           latency_snapshot=latency_snapshot)
+
+    relay = SharedTableRelay(latest_table, broadcaster)
+    threading.Thread(target=relay.run, args=(stop_event,), daemon=True).start()
+    mqtt_client.connect()
+
+    # 支持SO_REUSEPORT时所有工作进程共用一个端口，否则依次使用 port, port+1, ...
+    listen_socket = None
+    server = config.get('WEB_SERVER', 'server', fallback='dev').lower()
+    if server == 'waitress' and hasattr(socket, 'SO_REUSEPORT'):
+        listen_socket = create_listen_socket(config.get('WEB_SERVER', 'host'), web_server.port,
+                                             config.getint('WEB_SERVER', 'backlog', fallback=1024))
+    else:
+        web_server.port += worker_index
+
+    threading.Thread(target=web_server.start, args=(listen_socket,), daemon=True).start()
+    logging.info(f"Web工作进程 {worker_index} 已启动，端口 {web_server.port}")
+
+    stop_event.wait()
+
+    mqtt_client.disconnect()
+    database_manager.close()
+    latest_table.close()
+    latency_snapshot.close()
+    logging.info(f"Web工作进程 {worker_index} 已停止")
+    if log_listener:
+        log_listener.stop()
+
+class MultiProcessDeployment:
+    """多进程部署的主进程：创建共享内存，启动并监控入库进程和Web工作进程"""
+
+    def __init__(self, config_file, config):
+        self.config_file = config_file
+        self.web_workers = config.getint('DEPLOYMENT', 'web_workers', fallback=2)
+        self.shm_name = config.get('DEPLOYMENT', 'shared_memory_name', fallback='esp32_latest_values')
+        self.shm_slots = config.getint('DEPLOYMENT', 'shared_memory_slots', fallback=4096)
+        self.ready_timeout = config.getfloat('DEPLOYMENT', 'ingest_ready_timeout', fallback=30)
+
+        # spawn在各平台行为一致 (Windows只支持spawn)
+        self.context = multiprocessing.get_context('spawn')
+        self.stop_event = self.context.Event()
+        self.ingest_ready = self.context.Event()
+        self.latest_table = None
+        self.latency_snapshot = None
+        self.processes = {}
+
+    def start(self):
+        """创建共享最新值表并启动所有子进程"""
+        self.latest_table = SharedLatestTable(self.shm_name, self.shm_slots, create=True)
+        self.latency_snapshot = SharedSnapshot(latency_snapshot_name(self.shm_name), create=True)
+        # 先启动入库进程，由它完成数据库迁移后再启动Web工作进程
+        self.start_process('ingest', run_ingest_process,
+                           (self.config_file, self.shm_name, self.stop_event, self.ingest_ready))
+        self.wait_for_ingest()
+        for index in range(self.web_workers):
+            self.start_process(f'web{index}', run_web_worker,
+                               (self.config_file, self.shm_name, index, self.stop_event))
+        logging.info(f"多进程部署已启动: 1个入库进程, {self.web_workers}个Web工作进程")
+
+    def wait_for_ingest(self):
+        """等待入库进程就绪，入库进程提前退出或超时时记录错误后继续启动"""
+        process = self.processes['ingest'][0]
+        deadline = time.monotonic() + self.ready_timeout
+        while not self.ingest_ready.wait(0.1):
+            if not process.is_alive():
+                logging.error(f"入库进程启动失败 (exitcode={process.exitcode})")
+                return False
+            if time.monotonic() >= deadline:
+                logging.error(f"入库进程 {self.ready_timeout} 秒内未就绪，继续启动Web工作进程")
+                return False
+        return True
+
+    def start_process(self, name, target, args):
+        """启动一个子进程"""
+        process = self.context.Process(target=target, args=args, name=name, daemon=False)
+        process.start()
+        self.processes[name] = (process, target, args)
+        logging.info(f"子进程 {name} 已启动 (pid={process.pid})")
+
+    def check_processes(self):
+        """重启意外退出的子进程"""
+        if self.stop_event.is_set():
+            return
+        for name, (process, target, args) in list(self.processes.items()):
+            if not process.is_alive():
+                logging.error(f"子进程 {name} 意外退出 (exitcode={process.exitcode})，正在重启")
+                self.start_process(name, target, args)
+
+    def get_status(self):
+        """子进程运行状态"""
+        return {name: process.is_alive() for name, (process, _, _) in self.processes.items()}
+
+    def stop(self, timeout=15):
+        """通知所有子进程退出并等待，超时则强制结束"""
+        self.stop_event.set()
+        for name, (process, _, _) in self.processes.items():
+            process.join(timeout=timeout)
+            if process.is_alive():
+                logging.warning(f"子进程 {name} 未能按时退出，强制结束")
+                process.terminate()
+                process.join()
+        if self.latest_table:
+            self.latest_table.close()
+            self.latest_table = None
+        if self.latency_snapshot:
+            self.latency_snapshot.close()
+            self.latency_snapshot = None
+        logging.info("多进程部署已停止")
@@ -6,6 +6,192 @@ import threading
 import logging
 import configparser
 from datetime import datetime
+from loopback_broker import LoopbackClient
+from payload_codec import encode_telemetry_binary, encode_telemetry_batch_binary
+
+# 可选: 有NumPy时AD1数据按块向量化生成 (AD1BlockGenerator)，否则逐个采样生成
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def ad1_value_generator(ad1_min, ad1_max, rng=None):
+    """AD1数据生成器 - 趋势 + 噪声 + 随机突变，负载生成器的虚拟设备也使用它
+
+    rng 为 random.Random 实例时结果由其种子决定，默认使用全局random。
+    """
+    rng = rng if rng is not None else random
+    # 初始化基础值
+    base_value = rng.randint(ad1_min, ad1_max)
+    trend = rng.choice([-1, 1])  # 趋势方向
+    trend_strength = rng.randint(5, 20)  # 趋势强度
+    noise_level = rng.randint(10, 30)  # 噪声水平
+    
+    while True:
+        # 模拟真实的AD值变化模式
+        if rng.random() < 0.05:  # 5%概率大幅跳跃（模拟环境突变）
+            base_value = rng.randint(ad1_min, ad1_max)
+            trend = rng.choice([-1, 1])
+            trend_strength = rng.randint(5, 20)
+            noise_level = rng.randint(10, 30)
+        elif rng.random() < 0.15:  # 15%概率趋势改变
+            trend = rng.choice([-1, 1])
+            trend_strength = rng.randint(5, 20)
+        elif rng.random() < 0.25:  # 25%概率噪声水平变化
+            noise_level = rng.randint(10, 30)
+        else:
+            # 70%概率正常变化（趋势+噪声）
+            # 应用趋势
+            trend_change = trend * trend_strength
+            base_value += trend_change
+            
+            # 添加噪声
+            noise = rng.randint(-noise_level, noise_level)
+            base_value += noise
+            
+            # 确保值在范围内
+            if base_value < ad1_min:
+                base_value = ad1_min
+                trend = 1  # 反转趋势
+            elif base_value > ad1_max:
+                base_value = ad1_max
+                trend = -1  # 反转趋势
+        
+        # 确保值在有效范围内
+        base_value = max(ad1_min, min(ad1_max, base_value))
+        
+        yield int(base_value)
+
+def _forward_fill(mask, values, initial):
+    """mask为真的位置取values，其余位置沿用前一个值，开头沿用initial"""
+    index = np.where(mask, np.arange(len(mask)), -1)
+    np.maximum.accumulate(index, out=index)
+    return np.where(index >= 0, values[np.maximum(index, 0)], initial)
+
+class AD1BlockGenerator:
+    """按块生成AD1数据，模型与 ad1_value_generator 相同 (趋势 + 噪声 + 随机突变)
+
+    有NumPy时每次向量化生成 chunk_size 个采样: 事件类型 (突变 / 趋势改变 / 噪声改变 / 正常变化) 和所需的随机数一次抽取，
+    趋势、强度、噪声水平按事件位置前向填充，数值用分段累加 (突变处重置) 得到。
+    越界后的钳位和趋势反转是唯一的顺序依赖，只影响到下一次突变为止，这一小段逐个采样重算。
+    没有NumPy时退回逐个采样的 ad1_value_generator。
+    seed 和 chunk_size 相同时输出序列相同，与每次取多少个无关 (NumPy和逐个采样两种实现的序列不同)。
+    既可以 next_block(count) 批量取数组，也可以像生成器一样 next() 逐个取值；
+    同时存在大量生成器时 (如负载生成器的虚拟设备) 用较小的 chunk_size 减少内存占用。
+    """
+
+    def __init__(self, ad1_min, ad1_max, seed=None, chunk_size=4096):
+        self.ad1_min = ad1_min
+        self.ad1_max = ad1_max
+        self.chunk_size = chunk_size
+        if np is None:
+            self.rng = random.Random(seed)
+            self._scalar = ad1_value_generator(ad1_min, ad1_max, self.rng)
+            return
+        self._scalar = None
+        self.rng = np.random.default_rng(seed)
+        self.base_value = int(self.rng.integers(ad1_min, ad1_max + 1))
+        self.trend = int(self.rng.choice((-1, 1)))
+        self.trend_strength = int(self.rng.integers(5, 21))
+        self.noise_level = int(self.rng.integers(10, 31))
+        # 已生成未取走的采样
+        self._chunk = np.empty(0, dtype=np.int64)
+        self._position = 0
+
+    @property
+    def vectorized(self):
+        return self._scalar is None
+
+    def next_block(self, count):
+        """取count个采样，返回int64数组 (没有NumPy时为列表)"""
+        if self._scalar is not None:
+            return [next(self._scalar) for _ in range(count)]
+        parts = []
+        while count > 0:
+            if self._position >= len(self._chunk):
+                self._chunk = self._generate_chunk(self.chunk_size)
+                self._position = 0
+            part = self._chunk[self._position:self._position + count]
+            self._position += len(part)
+            count -= len(part)
+            parts.append(part)
+        return parts[0].copy() if len(parts) == 1 else np.concatenate(parts)
+
+    def _generate_chunk(self, size):
+        rng = self.rng
+        low, high = self.ad1_min, self.ad1_max
+        # 与逐个采样的判断顺序相同: 5%突变，其余15%趋势改变，再其余25%噪声改变，剩下为正常变化
+        draws = rng.random((4, size))
+        jump = draws[0] < 0.05
+        trend_change = ~jump & (draws[1] < 0.15)
+        noise_change = ~jump & ~trend_change & (draws[2] < 0.25)
+        normal = ~(jump | trend_change | noise_change)
+        jump_values = rng.integers(low, high + 1, size)
+        new_trends = rng.integers(0, 2, size) * 2 - 1
+        new_strengths = rng.integers(5, 21, size)
+        new_noise_levels = rng.integers(10, 31, size)
+
+        sets_trend = jump | trend_change
+        trends = _forward_fill(sets_trend, new_trends, self.trend)
+        strengths = _forward_fill(sets_trend, new_strengths, self.trend_strength)
+        noise_levels = _forward_fill(jump | noise_change, new_noise_levels, self.noise_level)
+        # 只有正常变化的采样有增量: 趋势 * 强度 + [-噪声水平, 噪声水平] 内的均匀整数
+        steps = np.where(normal, strengths, 0)
+        noise = np.where(normal, np.floor(draws[3] * (2 * noise_levels + 1)).astype(np.int64) - noise_levels, 0)
+
+        # 分段累加，突变处重置为新的基础值
+        totals = np.cumsum(trends * steps + noise)
+        reset_at = _forward_fill(jump, np.arange(size), -1)
+        anchor = np.maximum(reset_at, 0)
+        path = np.where(reset_at >= 0, jump_values[anchor] - totals[anchor] + totals, self.base_value + totals)
+        trend = int(trends[-1])
+
+        outside = np.flatnonzero((path < low) | (path > high))
+        if len(outside):
+            jumps = np.flatnonzero(jump)
+            done = 0
+            for first in outside.tolist():
+                if first < done:
+                    continue
+                # 从第一个越界的采样到下一次突变逐个重算: 钳位并反转趋势
+                index = np.searchsorted(jumps, first)
+                end = int(jumps[index]) if index < len(jumps) else size
+                value = int(path[first - 1]) if first else self.base_value
+                current = int(trends[first])
+                for offset, (set_trend, new_trend, step, delta) in enumerate(zip(
+                        sets_trend[first:end].tolist(), new_trends[first:end].tolist(),
+                        steps[first:end].tolist(), noise[first:end].tolist())):
+                    if set_trend:
+                        current = new_trend
+                    value += current * step + delta
+                    if value < low:
+                        value, current = low, 1
+                    elif value > high:
+                        value, current = high, -1
+                    path[first + offset] = value
+                if end == size:
+                    trend = current
+                done = end
+
+        self.base_value = int(path[-1])
+        self.trend = trend
+        self.trend_strength = int(strengths[-1])
+        self.noise_level = int(noise_levels[-1])
+        return path
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._scalar is not None:
+            return next(self._scalar)
+        if self._position >= len(self._chunk):
+            self._chunk = self._generate_chunk(self.chunk_size)
+            self._position = 0
+        # 逐个取值时返回Python整数，JSON编码等不需要处理NumPy类型
+        value = int(self._chunk[self._position])
+        self._position += 1
+        return value
 
 class ESP32Simulator:
     def __init__(self, config_file):
@@ -19,6 +205,8 @@ class ESP32Simulator:
         self.username = self.config.get('MQTT', 'username')
         self.password = self.config.get('MQTT', 'password')
         self.keepalive = self.config.getint('MQTT', 'keepalive')
+        # loopback 时连接同一进程内的代理，与后台入库客户端之间不经过TCP
+        self.transport = self.config.get('MQTT', 'transport', fallback='tcp').strip().lower()
         
         # 主题配置
         self.ad1_topic = self.config.get('TOPICS', 'ad1_data')
@@ -31,9 +219,21 @@ class ESP32Simulator:
         self.ad1_min = self.config.getint('ESP32_SIMULATOR', 'ad1_min')
         self.ad1_max = self.config.getint('ESP32_SIMULATOR', 'ad1_max')
         self.io1_default = self.config.getboolean('ESP32_SIMULATOR', 'io1_default')
+        # AD1数据负载格式: json 或 binary (紧凑二进制，见 payload_codec)
+        self.payload_format = self.config.get('ESP32_SIMULATOR', 'payload_format', fallback='json').lower()
+        self.start_time = time.monotonic()
+        # 批量上报: batch_samples > 1 时按 sample_rate (Hz) 采样，每 batch_samples 个采样合并为一条消息
+        self.sample_rate = self.config.getfloat('ESP32_SIMULATOR', 'sample_rate', fallback=10.0)
+        self.batch_samples = self.config.getint('ESP32_SIMULATOR', 'batch_samples', fallback=1)
+        # 随机种子: 设置后AD1数据序列可复现，留空则每次不同
+        seed = self.config.get('ESP32_SIMULATOR', 'seed', fallback='').strip()
+        self.seed = int(seed) if seed else None
         
         # 创建MQTT客户端
-        self.client = mqtt.Client(client_id=self.client_id)
+        if self.transport == 'loopback':
+            self.client = LoopbackClient(client_id=self.client_id)
+        else:
+            self.client = mqtt.Client(client_id=self.client_id)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
@@ -52,47 +252,8 @@ class ESP32Simulator:
         self.ad1_generator = self.create_ad1_generator()
         
     def create_ad1_generator(self):
-        """创建AD1数据生成器 - 增强版"""
-        # 初始化基础值
-        base_value = random.randint(self.ad1_min, self.ad1_max)
-        trend = random.choice([-1, 1])  # 趋势方向
-        trend_strength = random.randint(5, 20)  # 趋势强度
-        noise_level = random.randint(10, 30)  # 噪声水平
-        
-        while True:
-            # 模拟真实的AD值变化模式
-            if random.random() < 0.05:  # 5%概率大幅跳跃（模拟环境突变）
-                base_value = random.randint(self.ad1_min, self.ad1_max)
-                trend = random.choice([-1, 1])
-                trend_strength = random.randint(5, 20)
-                noise_level = random.randint(10, 30)
-            elif random.random() < 0.15:  # 15%概率趋势改变
-                trend = random.choice([-1, 1])
-                trend_strength = random.randint(5, 20)
-            elif random.random() < 0.25:  # 25%概率噪声水平变化
-                noise_level = random.randint(10, 30)
-            else:
-                # 70%概率正常变化（趋势+噪声）
-                # 应用趋势
-                trend_change = trend * trend_strength
-                base_value += trend_change
-                
-                # 添加噪声
-                noise = random.randint(-noise_level, noise_level)
-                base_value += noise
-                
-                # 确保值在范围内
-                if base_value < self.ad1_min:
-                    base_value = self.ad1_min
-                    trend = 1  # 反转趋势
-                elif base_value > self.ad1_max:
-                    base_value = self.ad1_max
-                    trend = -1  # 反转趋势
-            
-            # 确保值在有效范围内
-            base_value = max(self.ad1_min, min(self.ad1_max, base_value))
-            
-            yield int(base_value)
+        """创建AD1数据生成器 - 增强版 (有NumPy时按块生成)"""
+        return AD1BlockGenerator(self.ad1_min, self.ad1_max, self.seed)
     
     def on_connect(self, client, userdata, flags, rc):
         """MQTT连接回调"""
@@ -169,6 +330,10 @@ class ESP32Simulator:
     
     def simulation_loop(self):
         """模拟循环 - 增强版"""
+        if self.batch_samples > 1:
+            self.batch_simulation_loop()
+            return
+        
         data_count = 0
         start_time = time.time()
         
@@ -196,24 +361,85 @@ class ESP32Simulator:
                 logging.error(f"ESP32模拟器模拟循环错误: {e}")
                 time.sleep(1)
     
+    def batch_simulation_loop(self):
+        """批量采样模拟循环：按sample_rate采样，每batch_samples个采样发布一条批量消息"""
+        interval_ms = max(1, int(round(1000 / self.sample_rate)))
+        batch_period = self.batch_samples * interval_ms / 1000
+        last_status = 0
+        sample_count = 0
+        next_publish = time.monotonic()
+        logging.info(f"ESP32模拟器批量采样模式: {self.sample_rate}Hz, 每条消息 {self.batch_samples} 个采样")
+        
+        while self.simulation_running and self.connected:
+            try:
+                base_ts = int((time.monotonic() - self.start_time) * 1000)
+                values = [next(self.ad1_generator) for _ in range(self.batch_samples)]
+                self.publish_ad1_batch(values, interval_ms, base_ts)
+                sample_count += len(values)
+                
+                # 设备状态仍按simulation_interval发布
+                if time.monotonic() - last_status >= self.simulation_interval:
+                    self.publish_status("running")
+                    last_status = time.monotonic()
+                    logging.info(f"ESP32模拟器统计 - 已发送采样: {sample_count}, 当前AD值: {values[-1]}")
+                
+                next_publish += batch_period
+                time.sleep(max(0, next_publish - time.monotonic()))
+                
+            except Exception as e:
+                logging.error(f"ESP32模拟器模拟循环错误: {e}")
+                time.sleep(1)
+    
+    def publish_ad1_batch(self, values, interval_ms, base_ts):
+        """发布一批AD1采样 (首个采样时间 + 采样间隔)"""
+        if not self.connected:
+            return
+        
+        try:
+            deltas = [0] + [interval_ms] * (len(values) - 1)
+            if self.payload_format == 'binary':
+                payload = encode_telemetry_batch_binary(values, deltas, base_ts, self.client_id, "AD1")
+            else:
+                message = {
+                    "device_id": self.client_id,
+                    "channel": "AD1",
+                    "unit": "ADC",
+                    "base_ts": base_ts,
+                    "deltas": deltas,
+                    "values": values
+                }
+                payload = json.dumps(message, separators=(',', ':'))
+            result = self.client.publish(self.ad1_topic, payload)
+            
+            if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                logging.error(f"ESP32模拟器AD1批量数据发送失败: {result.rc}")
+                
+        except Exception as e:
+            logging.error(f"ESP32模拟器发送AD1批量数据失败: {e}")
+    
     def publish_ad1_data(self, value):
         """发布AD1数据"""
         if not self.connected:
             return
         
         try:
-            message = {
-                "device_id": self.client_id,
-                "channel": "AD1",
-                "value": value,
-                "unit": "ADC",
-                "timestamp": datetime.now().isoformat()
-            }
-            payload = json.dumps(message)
+            if self.payload_format == 'binary':
+                # 与固件一致，时间戳为启动后的毫秒数
+                uptime_ms = int((time.monotonic() - self.start_time) * 1000)
+                payload = encode_telemetry_binary(value, uptime_ms, self.client_id, "AD1")
+            else:
+                message = {
+                    "device_id": self.client_id,
+                    "channel": "AD1",
+                    "value": value,
+                    "unit": "ADC",
+                    "timestamp": datetime.now().isoformat()
+                }
+                payload = json.dumps(message)
             result = self.client.publish(self.ad1_topic, payload)
             
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                logging.debug(f"ESP32模拟器AD1数据已发送: {value}")
+                logging.debug("ESP32模拟器AD1数据已发送: %s", value)
             else:
                 logging.error(f"ESP32模拟器AD1数据发送失败: {result.rc}")
                 
@@ -259,7 +485,7 @@ class ESP32Simulator:
             result = self.client.publish(self.status_topic, payload)
             
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                logging.debug(f"ESP32模拟器状态已发布: {status}")
+                logging.debug("ESP32模拟器状态已发布: %s", status)
             else:
                 logging.error(f"ESP32模拟器状态发布失败: {result.rc}")
                 
@@ -296,6 +522,7 @@ class ESP32Simulator:
             "ad1_range": f"{self.ad1_min}-{self.ad1_max}",
             "simulation_interval": self.simulation_interval,
             "mqtt_broker": f"{self.broker}:{self.port}",
+            "mqtt_transport": self.transport,
             "topics": {
                 "ad1_data": self.ad1_topic,
                 "io1_control": self.io1_control_topic,
@@ -0,0 +1,137 @@
+import queue
+import threading
+import time
+import logging
+import metrics
+from log_setup import SampledLogger
+
+# 队列满时每条消息都会丢弃，告警按采样限流
+drop_warning_log = SampledLogger(logging.WARNING)
+queue_full_rows = metrics.rows_dropped.labels('queue_full')
+
+class IngestWriter:
+    """写后（write-behind）入库队列
+    
+    MQTT回调只负责把数据行放入有界队列，由独立的写线程按批次
+    (达到batch_size行或等待flush_interval秒) 用executemany在一个事务中写入数据库。
+    队列元素为 (表名, [数据行, ...])，设备端批量上报的多个采样只占一个队列位置。
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, database_manager, batch_size=500, flush_interval=1.0,
+                 max_queue_size=10000, put_timeout=1.0):
+        self.database_manager = database_manager
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        
+        self.writer_thread = None
+        self.running = False
+        # 停止标记无法入队时 (队列一直满) 改用的停止信号
+        self._stop_requested = threading.Event()
+        
+        # 统计信息
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.batches_written = 0
+    
+    def start(self):
+        """启动写线程"""
+        if self.running:
+            return
+        self.running = True
+        self._stop_requested.clear()
+        self.writer_thread = threading.Thread(target=self.writer_loop, name="ingest-writer", daemon=True)
+        self.writer_thread.start()
+        metrics.queue_depth.set_function(self.get_queue_depth)
+        logging.info(f"入库写线程已启动 (batch_size={self.batch_size}, flush_interval={self.flush_interval}s)")
+    
+    def stop(self, timeout=10):
+        """停止写线程，并把队列中剩余的数据全部写入"""
+        if not self.running:
+            return
+        self.running = False
+        deadline = time.monotonic() + timeout
+        # 停止标记排在已入队数据之后，写线程处理完剩余数据再退出
+        try:
+            self.queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            # 写线程已退出或卡住时队列一直是满的，不能无限等待：改为设置停止信号，
+            # 写线程若仍在运行，会把队列写空后退出
+            logging.warning("入库队列已满，停止标记无法入队，改用停止信号")
+            self._stop_requested.set()
+        self.writer_thread.join(timeout=max(0, deadline - time.monotonic()))
+        if self.writer_thread.is_alive():
+            logging.warning(f"入库写线程未能在 {timeout} 秒内停止，队列中剩余 {self.queue.qsize()} 项未写入")
+        logging.info(f"入库写线程已停止 - 已写入: {self.rows_written}, 丢弃: {self.rows_dropped}")
+    
+    def submit(self, table, row):
+        """提交一行数据到写队列
+        
+        队列满时最多阻塞put_timeout秒（对MQTT网络线程形成背压），仍然满则丢弃。
+        """
+        return self.submit_many(table, [row])
+    
+    def submit_many(self, table, rows):
+        """提交同一张表的多行数据 (如一条批量采样消息)，作为一个整体入队"""
+        try:
+            self.queue.put((table, rows), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            self.rows_dropped += len(rows)
+            queue_full_rows.inc(len(rows))
+            drop_warning_log.log(table, "入库队列已满，丢弃数据: %s (%d 行)", table, len(rows))
+            return False
+    
+    def get_queue_depth(self):
+        """获取当前队列深度"""
+        return self.queue.qsize()
+    
+    def writer_loop(self):
+        """写线程主循环"""
+        stopping = False
+        while not stopping:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._stop_requested.is_set():
+                    break
+                continue
+            
+            if item is self._STOP:
+                break
+            
+            batch = [item]
+            row_count = len(item[1])
+            deadline = time.monotonic() + self.flush_interval
+            while row_count < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                row_count += len(item[1])
+            
+            self.flush(batch)
+    
+    def flush(self, batch):
+        """在一个事务中写入一批数据"""
+        rows_by_table = {}
+        for table, rows in batch:
+            rows_by_table.setdefault(table, []).extend(rows)
+        row_count = sum(len(rows) for rows in rows_by_table.values())
+        
+        if self.database_manager.save_batch(rows_by_table):
+            self.rows_written += row_count
+            self.batches_written += 1
+            logging.debug("批量写入完成: %d 行", row_count)
+        else:
+            self.rows_dropped += row_count
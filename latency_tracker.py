@@ -0,0 +1,126 @@
+import time
+import threading
+from bisect import bisect_left
+import metrics
+
+# 延迟阶段: 设备发布->服务器收到、收到->数据库提交、提交->写入进程读回
+STAGES = ('publish_receive', 'receive_commit', 'commit_readback')
+
+# 分桶上界(毫秒): 0.1ms ~ 10分钟按约1.2倍递增，分位数误差不超过20%
+BUCKET_BOUNDS = tuple(round(0.1 * 1.2 ** i, 4) for i in range(87))
+
+class RollingHistogram:
+    """滑动窗口直方图
+
+    最近 window 秒的观测值按 slot 秒分段计数，过期的分段整体丢弃，
+    不保存原始观测值，内存与观测次数无关。
+    """
+
+    def __init__(self, window=60, slot=5):
+        self.slot = slot
+        self.slots = max(1, int(window // slot))
+        # 每个分段: [分段序号, 各桶计数, 观测次数, 总和, 最大值]
+        self._segments = [[-1, None, 0, 0.0, 0.0] for _ in range(self.slots)]
+        self._lock = threading.Lock()
+
+    def _segment(self, now):
+        index = int(now // self.slot)
+        segment = self._segments[index % self.slots]
+        if segment[0] != index:
+            segment[0] = index
+            segment[1] = [0] * (len(BUCKET_BOUNDS) + 1)
+            segment[2] = 0
+            segment[3] = 0.0
+            segment[4] = 0.0
+        return segment
+
+    def observe_many(self, values, now=None):
+        if not values:
+            return
+        with self._lock:
+            segment = self._segment(time.monotonic() if now is None else now)
+            counts = segment[1]
+            for value in values:
+                counts[bisect_left(BUCKET_BOUNDS, value)] += 1
+            segment[2] += len(values)
+            segment[3] += sum(values)
+            segment[4] = max(segment[4], max(values))
+
+    def observe(self, value, now=None):
+        self.observe_many((value,), now)
+
+    def summary(self, now=None):
+        """窗口内的 count / mean / p50 / p95 / p99 / max (毫秒)，分位数取所在桶的上界"""
+        current = int((time.monotonic() if now is None else now) // self.slot)
+        counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        count, total, maximum = 0, 0.0, 0.0
+        with self._lock:
+            for index, bucket_counts, segment_count, segment_sum, segment_max in self._segments:
+                if bucket_counts is None or current - index >= self.slots:
+                    continue
+                for bucket, bucket_count in enumerate(bucket_counts):
+                    counts[bucket] += bucket_count
+                count += segment_count
+                total += segment_sum
+                maximum = max(maximum, segment_max)
+        result = {'count': count, 'mean': round(total / count, 3) if count else None}
+        for name, fraction in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+            result[name] = self._percentile(counts, count, fraction, maximum)
+        result['max'] = round(maximum, 3) if count else None
+        return result
+
+    @staticmethod
+    def _percentile(counts, count, fraction, maximum):
+        if not count:
+            return None
+        rank = fraction * count
+        seen = 0
+        for bucket, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                bound = BUCKET_BOUNDS[bucket] if bucket < len(BUCKET_BOUNDS) else maximum
+                # 桶上界不会超过实际最大值
+                return round(min(bound, maximum), 3)
+        return round(maximum, 3)
+
+class LatencyTracker:
+    """入库链路各阶段延迟
+
+    每个阶段一个滑动窗口直方图 (供 /api/latency 查询分位数)，同时累计到
+    Prometheus指标 esp32_ingest_latency_seconds{stage}。
+    commit_readback 由写入方在提交后按 probe_interval 抽样，在写入进程内用API相同的查询读回最新一行来测量，
+    只反映SQLite提交后的读取耗时，不包括HTTP、Web工作进程和共享最新值表的延迟。
+    """
+
+    def __init__(self, window=60, slot=5, probe_interval=1.0):
+        self.window = window
+        self.probe_interval = probe_interval
+        self.histograms = {stage: RollingHistogram(window, slot) for stage in STAGES}
+        self._metrics = {stage: metrics.ingest_latency_seconds.labels(stage) for stage in STAGES}
+        self._last_probe = 0.0
+
+    def record(self, stage, latency_ms):
+        self.record_many(stage, (latency_ms,))
+
+    def record_many(self, stage, latencies_ms):
+        self.histograms[stage].observe_many(latencies_ms)
+        metric = self._metrics[stage]
+        for latency in latencies_ms:
+            metric.observe(latency / 1000)
+
+    def should_probe(self):
+        """是否到了下一次读回抽样的时间"""
+        now = time.monotonic()
+        if now - self._last_probe < self.probe_interval:
+            return False
+        self._last_probe = now
+        return True
+
+    def snapshot(self):
+        return {
+            'window': self.window,
+            'stages': {stage: histogram.summary() for stage, histogram in self.histograms.items()}
+        }
+
+# 进程内共用的延迟统计
+latency_tracker = LatencyTracker()
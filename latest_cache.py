@@ -0,0 +1,64 @@
+import time
+
+class LatestValueCache:
+    """最新值缓存
+    
+    按 (设备, 通道) 保存最新一条数据，由MQTT消息处理线程写入，Web层O(1)读取。
+    写入时整体替换条目元组、读取时直接取字典引用，依赖GIL保证单次字典操作的原子性，
+    读路径无需加锁。
+    """
+    
+    def __init__(self):
+        self._entries = {}
+        # 每个通道(以及全部通道)最近一次更新的设备，使 get_latest 也是O(1)
+        self._latest_keys = {}
+    
+    def update(self, device_id, channel, value, ts=None):
+        """更新最新值，ts为数据时间(毫秒)，同时记录本地更新时间"""
+        now = time.time()
+        if ts is None:
+            ts = int(now * 1000)
+        key = (device_id, channel)
+        self._entries[key] = (value, ts, now)
+        self._latest_keys[channel] = key
+        self._latest_keys[None] = key
+    
+    def get(self, device_id, channel):
+        """获取最新值，不存在时返回None
+        
+        返回 {'device_id', 'channel', 'value', 'ts', 'age'}，age为距上次更新的秒数
+        """
+        entry = self._entries.get((device_id, channel))
+        if entry is None:
+            return None
+        return self._to_dict(device_id, channel, entry)
+    
+    def get_latest(self, channel=None):
+        """获取所有设备中最近更新的一条 (可按通道过滤)"""
+        key = self._latest_keys.get(channel)
+        if key is None:
+            return None
+        return self.get(*key)
+    
+    def snapshot(self, max_age=None):
+        """获取所有条目，max_age(秒)用于过滤掉过期条目"""
+        now = time.time()
+        return [
+            self._to_dict(device_id, channel, entry, now)
+            for (device_id, channel), entry in list(self._entries.items())
+            if max_age is None or now - entry[2] <= max_age
+        ]
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    @staticmethod
+    def _to_dict(device_id, channel, entry, now=None):
+        value, ts, updated = entry
+        return {
+            'device_id': device_id,
+            'channel': channel,
+            'value': value,
+            'ts': ts,
+            'age': round((now or time.time()) - updated, 3)
+        }
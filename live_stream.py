@@ -0,0 +1,123 @@
+import json
+import queue
+import threading
+import logging
+
+class StreamSubscriber:
+    """单个推送客户端：有界缓冲区 + 慢消费者连续丢帧计数"""
+    
+    def __init__(self, buffer_size, device_id=None):
+        self.buffer = queue.Queue(maxsize=buffer_size)
+        self.device_id = device_id
+        # 连续丢弃的帧数，成功放入一帧后清零
+        self.dropped = 0
+        self.closed = False
+    
+    def offer(self, frame):
+        """非阻塞放入一帧，缓冲区满时丢弃并返回False"""
+        try:
+            self.buffer.put_nowait(frame)
+            self.dropped = 0
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+    
+    def next_frame(self, timeout):
+        """取下一帧，超时返回None"""
+        try:
+            return self.buffer.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class LiveBroadcaster:
+    """实时数据推送 (Server-Sent Events)
+    
+    每条MQTT消息只序列化一次为SSE帧，再分发给所有订阅者的有界缓冲区；
+    发布方从不阻塞，缓冲区满的客户端丢帧，连续丢帧超过max_drops的客户端被断开。
+    """
+    
+    def __init__(self, buffer_size=100, max_clients=16, max_drops=500):
+        self.buffer_size = buffer_size
+        self.max_clients = max_clients
+        self.max_drops = max_drops
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        
+        # 统计信息
+        self.events_published = 0
+        self.frames_dropped = 0
+        self.clients_disconnected = 0
+    
+    def subscribe(self, device_id=None, max_clients=None):
+        """注册新客户端，超过最大客户端数 (max_clients 可进一步收紧) 时返回None"""
+        limit = self.max_clients if max_clients is None else min(self.max_clients, max_clients)
+        with self._lock:
+            if len(self._subscribers) >= limit:
+                return None
+            subscriber = StreamSubscriber(self.buffer_size, device_id)
+            self._subscribers.add(subscriber)
+        logging.info(f"实时推送客户端已连接，当前客户端数: {len(self._subscribers)}")
+        return subscriber
+    
+    def unsubscribe(self, subscriber):
+        """注销客户端"""
+        subscriber.closed = True
+        with self._lock:
+            if subscriber not in self._subscribers:
+                return
+            self._subscribers.discard(subscriber)
+        logging.info(f"实时推送客户端已断开，当前客户端数: {len(self._subscribers)}")
+    
+    def client_count(self):
+        """当前客户端数"""
+        return len(self._subscribers)
+    
+    def publish(self, event, data):
+        """向所有客户端推送一条事件"""
+        if not self._subscribers:
+            return
+        
+        frame = self.encode_frame(event, data)
+        device_id = data.get('device_id')
+        self.events_published += 1
+        
+        # 复制一份集合，分发过程中不持锁
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            if subscriber.device_id is not None and subscriber.device_id != device_id:
+                continue
+            if subscriber.offer(frame):
+                continue
+            self.frames_dropped += 1
+            if subscriber.dropped > self.max_drops:
+                logging.warning(f"实时推送客户端消费过慢，已连续丢弃 {subscriber.dropped} 帧，断开连接")
+                self.clients_disconnected += 1
+                self.unsubscribe(subscriber)
+    
+    @staticmethod
+    def encode_frame(event, data):
+        """编码为SSE帧"""
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        return f"event: {event}\ndata: {payload}\n\n".encode('utf-8')
+    
+    def stream(self, subscriber, keepalive=15):
+        """SSE响应体生成器，客户端断开时自动注销"""
+        try:
+            yield b"retry: 3000\n\n"
+            while not subscriber.closed:
+                frame = subscriber.next_frame(keepalive)
+                # 空闲时发送注释行保持连接，同时尽早发现断开的客户端
+                yield frame if frame is not None else b": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+    
+    def get_stats(self):
+        """推送统计信息"""
+        return {
+            'clients': self.client_count(),
+            'events_published': self.events_published,
+            'frames_dropped': self.frames_dropped,
+            'clients_disconnected': self.clients_disconnected
+        }
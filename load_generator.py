@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+设备集群负载生成器
+在一个进程中模拟大量虚拟ESP32设备 (少量MQTT连接复用多个设备ID)，用于容量规划:
+按配置的单设备速率、突发模式、负载格式和爬坡时间发布AD1数据，
+同时用一个监听连接订阅部分设备的主题，统计实际发布速率和 发布->投递 的端到端延迟。
+用法: python load_generator.py [--devices 5000 --rate 2 --pattern burst --duration 120]
+参数默认值取自 config.ini 的 [LOAD_GENERATOR] 节。
+"""
+
+import os
+import json
+import time
+import heapq
+import random
+import asyncio
+import logging
+import argparse
+import configparser
+from async_ingest import (PUBLISH, CONNACK, PINGREQ, DISCONNECT, build_packet, build_connect, build_subscribe,
+                          encode_string, read_packet, parse_publish)
+from esp32_simulator import AD1BlockGenerator
+from payload_codec import (PayloadCodec, PayloadError, encode_telemetry_binary, encode_telemetry_batch_binary,
+                           sample_offsets)
+
+# 发布模式: steady 均匀 (随机相位)、sync 所有设备同时发布、poisson 随机间隔、burst 每次连发burst_size条
+PATTERNS = ('steady', 'sync', 'poisson', 'burst')
+
+def percentile(sorted_values, fraction):
+    """已排序列表的分位数，空列表返回None"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+def latency_summary(latencies):
+    """延迟统计 (毫秒)"""
+    values = sorted(latencies)
+    return {
+        'count': len(values),
+        'p50': percentile(values, 0.50),
+        'p95': percentile(values, 0.95),
+        'p99': percentile(values, 0.99),
+        'max': values[-1] if values else None,
+    }
+
+class VirtualDevice:
+    """一个虚拟设备：发布主题、下次发布间隔和负载生成"""
+
+    __slots__ = ('device_id', 'topic', 'generator', 'rate', 'pattern', 'burst_size',
+                 'payload_format', 'batch_samples', 'sample_interval_ms')
+
+    def __init__(self, device_id, topic, generator, rate, pattern='steady', burst_size=10,
+                 payload_format='json', batch_samples=1):
+        self.device_id = device_id
+        # 预先编码的主题，发布时直接拼接负载
+        self.topic = encode_string(topic)
+        self.generator = generator
+        self.rate = rate
+        self.pattern = pattern
+        self.burst_size = burst_size
+        self.payload_format = payload_format
+        self.batch_samples = batch_samples
+        # 批量消息中相邻采样的间隔，使采样速率为 rate * batch_samples
+        self.sample_interval_ms = max(1, int(round(1000 / (rate * batch_samples))))
+
+    def first_delay(self):
+        """首次发布相对设备上线时间的延迟"""
+        if self.pattern == 'sync':
+            return 0.0
+        return random.uniform(0, self.next_interval())
+
+    def next_interval(self):
+        """到下一次发布的间隔 (秒)"""
+        if self.pattern == 'poisson':
+            return random.expovariate(self.rate)
+        if self.pattern == 'burst':
+            # 平均速率不变，只是集中发出
+            return self.burst_size / self.rate
+        return 1 / self.rate
+
+    def messages_per_wakeup(self):
+        return self.burst_size if self.pattern == 'burst' else 1
+
+    def build_payload(self, now_ms):
+        """生成一条AD1负载，时间戳为发布时刻的毫秒时间 (监听端据此计算延迟)"""
+        ts = now_ms & 0xFFFFFFFF
+        if self.batch_samples > 1:
+            values = [next(self.generator) for _ in range(self.batch_samples)]
+            deltas = [0] + [self.sample_interval_ms] * (self.batch_samples - 1)
+            # 最后一个采样的时间为当前时间
+            base_ts = (now_ms - self.sample_interval_ms * (self.batch_samples - 1)) & 0xFFFFFFFF
+            if self.payload_format == 'binary':
+                return encode_telemetry_batch_binary(values, deltas, base_ts, self.device_id, "AD1")
+            return json.dumps({"device_id": self.device_id, "channel": "AD1", "unit": "ADC", "base_ts": base_ts,
+                               "deltas": deltas, "values": values}, separators=(',', ':')).encode('utf-8')
+        value = next(self.generator)
+        if self.payload_format == 'binary':
+            return encode_telemetry_binary(value, ts, self.device_id, "AD1")
+        return json.dumps({"device_id": self.device_id, "channel": "AD1", "value": value, "unit": "ADC",
+                           "timestamp": ts}, separators=(',', ':')).encode('utf-8')
+
+class LoadGenerator:
+    """虚拟设备集群
+
+    devices个设备平均分配到connections条MQTT连接上，每条连接用一个按下次发布时间排序的堆调度其中的设备，
+    不为每个设备创建线程或协程。设备在ramp_up秒内逐个上线。
+    监听连接订阅等距抽样的latency_devices个设备的主题 (主题中不含设备ID时订阅整个AD1主题)，
+    用负载中的发布时间戳计算 发布->代理->订阅者 的延迟，它是后端入库延迟的下限。
+    """
+
+    def __init__(self, config_file, **overrides):
+        self.config = configparser.ConfigParser()
+        self.config.read(config_file)
+
+        # MQTT配置
+        self.broker = self.config.get('MQTT', 'broker')
+        self.port = self.config.getint('MQTT', 'port')
+        self.username = self.config.get('MQTT', 'username', fallback='')
+        self.password = self.config.get('MQTT', 'password', fallback='')
+        self.keepalive = self.config.getint('MQTT', 'keepalive', fallback=60)
+
+        # 负载配置，命令行参数优先
+        def option(name, getter, fallback):
+            value = overrides.get(name)
+            return value if value is not None else getter('LOAD_GENERATOR', name, fallback=fallback)
+
+        self.devices = option('devices', self.config.getint, 1000)
+        self.rate = option('rate', self.config.getfloat, 1.0)
+        self.pattern = option('pattern', self.config.get, 'steady').lower()
+        self.burst_size = option('burst_size', self.config.getint, 10)
+        self.payload_format = option('payload_format', self.config.get, 'json').lower()
+        self.batch_samples = option('batch_samples', self.config.getint, 1)
+        self.ramp_up = option('ramp_up', self.config.getfloat, 10.0)
+        self.duration = option('duration', self.config.getfloat, 60.0)
+        self.connections = max(1, option('connections', self.config.getint, 4))
+        self.device_prefix = option('device_prefix', self.config.get, 'loadgen_')
+        self.latency_devices = option('latency_devices', self.config.getint, 20)
+        self.report_interval = option('report_interval', self.config.getfloat, 5.0)
+        # 随机种子: 设置后各设备的AD1数据序列可复现 (设备i使用 seed + i)
+        seed = str(option('seed', self.config.get, '')).strip()
+        self.seed = int(seed) if seed else None
+        self.ad1_min = self.config.getint('ESP32_SIMULATOR', 'ad1_min', fallback=0)
+        self.ad1_max = self.config.getint('ESP32_SIMULATOR', 'ad1_max', fallback=4095)
+        if self.pattern not in PATTERNS:
+            raise ValueError(f"未知的发布模式: {self.pattern} (可选: {', '.join(PATTERNS)})")
+        if self.rate <= 0:
+            raise ValueError("rate必须大于0")
+
+        # 带 {device_id} 的遥测主题可以区分设备，否则所有设备发布到AD1主题，设备ID只在负载中
+        self.topic_pattern = self.config.get('TOPICS', 'telemetry', fallback='') or self.config.get('TOPICS', 'ad1_data')
+        self.codec = PayloadCodec()
+
+        # 统计信息
+        self.published = 0
+        self.samples_published = 0
+        self.active_devices = 0
+        self.connection_errors = 0
+        self.max_lag = 0.0
+        self.latencies = []
+        self.window_latencies = []
+        self.received = 0
+        self.decode_errors = 0
+
+    def device_topic(self, device_id):
+        return self.topic_pattern.replace('{device_id}', device_id).replace('{channel}', 'AD1')
+
+    def create_devices(self):
+        return [
+            VirtualDevice(f"{self.device_prefix}{index:05d}",
+                          self.device_topic(f"{self.device_prefix}{index:05d}"),
+                          AD1BlockGenerator(self.ad1_min, self.ad1_max,
+                                            None if self.seed is None else self.seed + index, chunk_size=256),
+                          self.rate, self.pattern, self.burst_size, self.payload_format, self.batch_samples)
+            for index in range(self.devices)
+        ]
+
+    async def connect(self, client_id):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.broker, self.port), 10)
+        writer.write(build_connect(client_id, self.keepalive, self.username, self.password))
+        header, body = await asyncio.wait_for(read_packet(reader), 10)
+        if header & 0xF0 != CONNACK or body[1] != 0:
+            writer.close()
+            raise ConnectionError(f"MQTT连接被拒绝，返回码: {body[1] if len(body) > 1 else None}")
+        return reader, writer
+
+    async def discard_incoming(self, reader):
+        """发布连接只会收到PINGRESP，读出丢弃，避免接收缓冲区堆积"""
+        while True:
+            await read_packet(reader)
+
+    async def publish_loop(self, index, devices, start, end):
+        """一条MQTT连接：按堆中的到期时间依次让设备发布"""
+        loop = asyncio.get_running_loop()
+        try:
+            reader, writer = await self.connect(f"{self.device_prefix}{os.getpid()}_{index}")
+        except (OSError, asyncio.TimeoutError, ConnectionError) as e:
+            self.connection_errors += 1
+            logging.error(f"负载生成连接 {index} 失败: {e}")
+            return
+        discard_task = asyncio.create_task(self.discard_incoming(reader))
+        # 设备按全局序号在ramp_up内均匀上线
+        heap = []
+        for position, (order, device) in enumerate(devices):
+            online = start + self.ramp_up * order / max(1, self.devices)
+            heap.append((online + device.first_delay(), position, device, True))
+        heapq.heapify(heap)
+        last_ping = loop.time()
+        burst_written = 0
+        try:
+            while heap:
+                due, position, device, first = heap[0]
+                now = loop.time()
+                if due >= end or now >= end:
+                    break
+                if due > now:
+                    await asyncio.sleep(due - now)
+                    continue
+                if first:
+                    self.active_devices += 1
+                self.max_lag = max(self.max_lag, now - due)
+                now_ms = int(time.time() * 1000)
+                for _ in range(device.messages_per_wakeup()):
+                    writer.write(build_packet(PUBLISH, device.topic + device.build_payload(now_ms)))
+                    self.published += 1
+                    self.samples_published += device.batch_samples
+                    burst_written += 1
+                heapq.heapreplace(heap, (due + device.next_interval(), position, device, False))
+
+                # 落后于计划时连续发布，定期等待发送缓冲区排空，并让出事件循环给监听连接
+                if burst_written >= 500:
+                    burst_written = 0
+                    await writer.drain()
+                    await asyncio.sleep(0)
+                if now - last_ping >= self.keepalive / 2:
+                    writer.write(build_packet(PINGREQ))
+                    last_ping = now
+            writer.write(build_packet(DISCONNECT))
+            await writer.drain()
+        except (OSError, ConnectionError) as e:
+            self.connection_errors += 1
+            logging.error(f"负载生成连接 {index} 断开: {e}")
+        finally:
+            discard_task.cancel()
+            writer.close()
+
+    def monitor_filters(self):
+        """监听连接订阅的主题"""
+        if '{device_id}' not in self.topic_pattern:
+            return [self.device_topic('')]
+        count = min(self.latency_devices, self.devices)
+        # 按设备序号等距抽样，覆盖每条发布连接
+        step = max(1, self.devices // max(1, count))
+        return [self.device_topic(f"{self.device_prefix}{index:05d}") for index in range(0, self.devices, step)][:count]
+
+    async def monitor_loop(self, ready):
+        """订阅抽样设备的主题，计算每条消息的 发布->投递 延迟"""
+        try:
+            reader, writer = await self.connect(f"{self.device_prefix}{os.getpid()}_monitor")
+            writer.write(build_subscribe(1, self.monitor_filters()))
+            await writer.drain()
+        except (OSError, asyncio.TimeoutError, ConnectionError) as e:
+            self.connection_errors += 1
+            logging.error(f"延迟监听连接失败: {e}")
+            ready.set()
+            return
+        ready.set()
+        try:
+            while True:
+                header, body = await read_packet(reader)
+                if header & 0xF0 != PUBLISH:
+                    continue
+                now_ms = int(time.time() * 1000)
+                _, _, _, payload = parse_publish(header, body)
+                try:
+                    record = self.codec.decode('telemetry', payload)
+                except PayloadError:
+                    self.decode_errors += 1
+                    continue
+                if record.values is not None:
+                    if record.base_ts is None:
+                        continue
+                    sent = record.base_ts + sample_offsets(record)[-1]
+                elif isinstance(record.timestamp, int):
+                    sent = record.timestamp
+                else:
+                    continue
+                latency = (now_ms - sent) & 0xFFFFFFFF
+                self.received += 1
+                self.window_latencies.append(latency)
+        finally:
+            writer.close()
+
+    async def report_loop(self, start):
+        """定期输出实际发布速率、调度滞后和延迟分位数"""
+        loop = asyncio.get_running_loop()
+        last_time, last_published = start, 0
+        while True:
+            await asyncio.sleep(self.report_interval)
+            now = loop.time()
+            rate = (self.published - last_published) / (now - last_time)
+            last_time, last_published = now, self.published
+            window, self.window_latencies = self.window_latencies, []
+            self.latencies.extend(window)
+            stats = latency_summary(window)
+            latency = (f"延迟(ms) p50={stats['p50']} p95={stats['p95']} p99={stats['p99']} max={stats['max']}"
+                       if stats['count'] else "延迟: 无样本")
+            print(f"[{now - start:6.1f}s] 在线设备 {self.active_devices:>6}  发布 {rate:>9.0f} msgs/s  "
+                  f"调度滞后 {self.max_lag * 1000:.0f}ms  {latency}", flush=True)
+            self.max_lag = 0.0
+
+    async def run(self):
+        """运行duration秒，返回汇总结果"""
+        loop = asyncio.get_running_loop()
+        devices = self.create_devices()
+        ready = asyncio.Event()
+        monitor_task = asyncio.create_task(self.monitor_loop(ready))
+        await ready.wait()
+        await asyncio.sleep(0.2)
+
+        start = loop.time()
+        end = start + self.duration
+        groups = [list(enumerate(devices))[index::self.connections] for index in range(self.connections)]
+        report_task = asyncio.create_task(self.report_loop(start))
+        await asyncio.gather(*(self.publish_loop(index, group, start, end) for index, group in enumerate(groups)))
+        # 发布连接可能在最后一次唤醒后提前结束，速率按完整的运行时间计算
+        await asyncio.sleep(max(0.0, end - loop.time()))
+        elapsed = loop.time() - start
+        # 等待最后一批消息投递到监听连接
+        await asyncio.sleep(1)
+        for task in (report_task, monitor_task):
+            task.cancel()
+        await asyncio.gather(report_task, monitor_task, return_exceptions=True)
+        self.latencies.extend(self.window_latencies)
+        self.window_latencies = []
+
+        return {
+            'devices': self.devices,
+            'connections': self.connections,
+            'pattern': self.pattern,
+            'payload_format': self.payload_format,
+            'batch_samples': self.batch_samples,
+            'duration': round(elapsed, 3),
+            'target_rate': self.devices * self.rate,
+            'published': self.published,
+            'publish_rate': round(self.published / elapsed, 1),
+            'sample_rate': round(self.samples_published / elapsed, 1),
+            'monitored_messages': self.received,
+            'decode_errors': self.decode_errors,
+            'connection_errors': self.connection_errors,
+            'latency_ms': latency_summary(self.latencies),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="ESP32设备集群负载生成器")
+    parser.add_argument('--config', default='config.ini', help="配置文件")
+    parser.add_argument('--devices', type=int, help="虚拟设备数")
+    parser.add_argument('--rate', type=float, help="每个设备每秒发布的消息数")
+    parser.add_argument('--pattern', choices=PATTERNS, help="发布模式")
+    parser.add_argument('--burst-size', dest='burst_size', type=int, help="burst模式每次连发的消息数")
+    parser.add_argument('--format', dest='payload_format', choices=('json', 'binary'), help="负载格式")
+    parser.add_argument('--batch-samples', dest='batch_samples', type=int, help="每条消息的采样数")
+    parser.add_argument('--ramp-up', dest='ramp_up', type=float, help="所有设备上线所用的秒数")
+    parser.add_argument('--duration', type=float, help="运行秒数")
+    parser.add_argument('--connections', type=int, help="MQTT连接数")
+    parser.add_argument('--latency-devices', dest='latency_devices', type=int, help="用于测量延迟的抽样设备数")
+    parser.add_argument('--report-interval', dest='report_interval', type=float, help="统计输出间隔(秒)")
+    parser.add_argument('--seed', type=int, help="AD1数据的随机种子")
+    parser.add_argument('--output', help="把汇总结果写入JSON文件")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    overrides = {key: value for key, value in vars(args).items() if key not in ('config', 'output')}
+    generator = LoadGenerator(args.config, **overrides)
+    print(f"负载生成: {generator.devices} 个设备 x {generator.rate} msgs/s ({generator.pattern}), "
+          f"{generator.connections} 条连接, 格式 {generator.payload_format}, 每条 {generator.batch_samples} 个采样, "
+          f"爬坡 {generator.ramp_up}s, 运行 {generator.duration}s -> {generator.broker}:{generator.port}")
+    try:
+        result = asyncio.run(generator.run())
+    except KeyboardInterrupt:
+        return
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import os
+import time
+import queue
+import logging
+import logging.handlers
+from datetime import datetime
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# 多进程部署时子进程的日志带进程名
+PROCESS_LOG_FORMAT = '%(asctime)s - %(processName)s - %(levelname)s - %(message)s'
+
+# 热路径日志的采样参数，由 setup_logging 按 [LOGGING] 配置设置
+sample_every = 100
+max_per_second = 5
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """非阻塞队列日志处理器：调用线程只把日志记录放入有界队列，队列满时直接丢弃并计数"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 监听线程在同一进程内，记录无需序列化，格式化全部交给监听线程中的处理器
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class SampledLogger:
+    """热路径 (每条消息) 日志
+
+    同一个key每 sample_every 条只输出一条 (首条总是输出)，并且每秒最多输出 max_per_second 条，
+    输出时附带累计条数。未启用的级别在第一步就返回，不做任何格式化。
+    """
+
+    def __init__(self, level=logging.INFO, logger=None):
+        self.level = level
+        self.logger = logger or logging.getLogger()
+        # key -> [累计条数, 当前窗口开始时间, 窗口内已输出条数]
+        self._state = {}
+
+    def log(self, key, msg, *args):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        state = self._state.get(key)
+        if state is None:
+            state = self._state[key] = [0, 0.0, 0]
+        state[0] += 1
+        if (state[0] - 1) % sample_every:
+            return
+        now = time.monotonic()
+        if now - state[1] >= 1:
+            state[1] = now
+            state[2] = 0
+        if state[2] >= max_per_second:
+            return
+        state[2] += 1
+        self.logger.log(self.level, msg + " (累计 %d 条)", *args, state[0])
+
+def setup_logging(config, name='backend', log_format=LOG_FORMAT):
+    """按 [LOGGING] 配置初始化日志，返回需要在退出时停止的QueueListener (未启用队列时为None)
+
+    文件和控制台处理器在后台监听线程中执行，业务线程只做一次非阻塞入队。
+    """
+    global sample_every, max_per_second
+    level = getattr(logging, config.get('LOGGING', 'level', fallback='INFO').upper(), logging.INFO)
+    sample_every = max(1, config.getint('LOGGING', 'sample_every', fallback=100))
+    max_per_second = config.getint('LOGGING', 'max_per_second', fallback=5)
+
+    if not os.path.exists('logs'):
+        os.makedirs('logs')
+    log_file = f"logs/esp32_{name}_{datetime.now().strftime('%Y%m%d')}.log"
+    formatter = logging.Formatter(log_format)
+    handlers = []
+    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    file_handler.setFormatter(formatter)
+    handlers.append(file_handler)
+    if config.getboolean('LOGGING', 'console', fallback=True):
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
+
+    listener = None
+    if config.getboolean('LOGGING', 'async', fallback=True):
+        log_queue = queue.Queue(maxsize=config.getint('LOGGING', 'queue_size', fallback=10000))
+        listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        handlers = [DroppingQueueHandler(log_queue)]
+
+    logging.basicConfig(level=level, handlers=handlers, force=True)
+    logging.info("日志系统初始化完成，日志文件: %s", log_file)
+    return listener
@@ -0,0 +1,290 @@
+import queue
+import logging
+import threading
+
+# 与 paho-mqtt 相同的取值，调用方可以继续用 mqtt.MQTT_ERR_SUCCESS 等常量比较
+MQTT_ERR_SUCCESS = 0
+MQTT_ERR_NO_CONN = 4
+MQTTv311 = 4
+MQTTv5 = 5
+
+def topic_matches(topic_filter, topic):
+    """MQTT主题过滤器匹配 (+ 和 #)，通配符不匹配以 $ 开头的主题"""
+    if topic.startswith('$') and topic_filter[:1] in ('+', '#'):
+        return False
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    for index, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if index >= len(topic_levels) or (level != '+' and level != topic_levels[index]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+class LoopbackMessage:
+    """与paho的MQTTMessage相同的属性"""
+    __slots__ = ('topic', 'payload', 'qos', 'retain', 'mid')
+
+    def __init__(self, topic, payload, qos=0, retain=False, mid=0):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.mid = mid
+
+class LoopbackPublishResult:
+    """与paho的MQTTMessageInfo相同的 rc / mid，消息已在publish返回前投递，无需等待"""
+    __slots__ = ('rc', 'mid')
+
+    def __init__(self, rc, mid):
+        self.rc = rc
+        self.mid = mid
+
+    def wait_for_publish(self, timeout=None):
+        return None
+
+    def is_published(self):
+        return self.rc == MQTT_ERR_SUCCESS
+
+class LoopbackBroker:
+    """进程内MQTT代理
+
+    不经过套接字，publish 在发布者线程中完成主题匹配并把消息放入各订阅客户端的接收队列，
+    由各客户端自己的循环线程调用 on_message，与paho的线程模型一致。
+    支持 + / # 通配、$share/<组>/<过滤器> 共享订阅 (组内轮询投递) 和保留消息；
+    QoS只做记录，进程内投递不会丢失。同一地址 (broker:port) 的客户端连接到同一个代理实例。
+    """
+
+    def __init__(self, name='loopback'):
+        self.name = name
+        self.lock = threading.Lock()
+        self.subscriptions = {}      # client -> {过滤器: qos}
+        self.shared = {}             # (组, 过滤器) -> [client, ...]
+        self.round_robin = {}        # (组, 过滤器) -> 下一个成员序号
+        self.retained = {}           # 主题 -> LoopbackMessage
+        # 主题 -> (普通订阅者, 共享订阅组)，订阅变化时清空
+        self._cache = {}
+        self.messages_published = 0
+
+    def attach(self, client):
+        with self.lock:
+            self.subscriptions.setdefault(client, {})
+
+    def detach(self, client):
+        with self.lock:
+            self.subscriptions.pop(client, None)
+            for members in self.shared.values():
+                if client in members:
+                    members.remove(client)
+            self._cache.clear()
+
+    def subscribe(self, client, topic_filter, qos=0):
+        """返回订阅时需要补发的保留消息"""
+        with self.lock:
+            if topic_filter.startswith('$share/'):
+                _, group, real_filter = topic_filter.split('/', 2)
+                members = self.shared.setdefault((group, real_filter), [])
+                if client not in members:
+                    members.append(client)
+                real = real_filter
+            else:
+                self.subscriptions.setdefault(client, {})[topic_filter] = qos
+                real = topic_filter
+            self._cache.clear()
+            return [message for topic, message in self.retained.items() if topic_matches(real, topic)]
+
+    def unsubscribe(self, client, topic_filter):
+        with self.lock:
+            if topic_filter.startswith('$share/'):
+                _, group, real_filter = topic_filter.split('/', 2)
+                members = self.shared.get((group, real_filter), [])
+                if client in members:
+                    members.remove(client)
+            else:
+                self.subscriptions.get(client, {}).pop(topic_filter, None)
+            self._cache.clear()
+
+    def _match(self, topic):
+        """主题 -> (普通订阅者, 共享订阅组键)，调用方持有锁"""
+        cached = self._cache.get(topic)
+        if cached is None:
+            # 一个客户端有多个匹配的订阅时只投递一次
+            clients = tuple(client for client, filters in self.subscriptions.items()
+                            if any(topic_matches(topic_filter, topic) for topic_filter in filters))
+            groups = tuple(key for key in self.shared if topic_matches(key[1], topic))
+            cached = (clients, groups)
+            self._cache[topic] = cached
+        return cached
+
+    def publish(self, message):
+        """把消息放入所有匹配的订阅者的接收队列，返回投递的客户端数"""
+        with self.lock:
+            self.messages_published += 1
+            if message.retain:
+                if message.payload:
+                    self.retained[message.topic] = message
+                else:
+                    self.retained.pop(message.topic, None)
+            clients, groups = self._match(message.topic)
+            targets = list(clients)
+            for key in groups:
+                members = self.shared[key]
+                if members:
+                    index = self.round_robin.get(key, 0) % len(members)
+                    self.round_robin[key] = index + 1
+                    target = members[index]
+                    if target not in targets:
+                        targets.append(target)
+        for target in targets:
+            target._deliver(message)
+        return len(targets)
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+def get_broker(host='localhost', port=1883):
+    """按地址取得进程内代理，不存在时创建"""
+    name = f"{host}:{port}"
+    with _brokers_lock:
+        broker = _brokers.get(name)
+        if broker is None:
+            broker = _brokers[name] = LoopbackBroker(name)
+            logging.info(f"进程内MQTT代理已创建: {name}")
+        return broker
+
+class LoopbackClient:
+    """与paho-mqtt Client接口兼容的进程内客户端 ([MQTT] transport = loopback)
+
+    实现本项目用到的部分: on_connect / on_message / on_disconnect 回调、username_pw_set、
+    connect、loop_start / loop_stop / loop_forever、subscribe / unsubscribe、publish、
+    disconnect、is_connected。回调在客户端自己的循环线程中执行；
+    协议为MQTTv5时回调多传一个 properties 参数 (None)。接收队列不限长度。
+    """
+
+    _STOP = object()
+
+    def __init__(self, client_id='', protocol=MQTTv311, userdata=None):
+        self._client_id = client_id
+        self.protocol = protocol
+        self.userdata = userdata
+        self.on_connect = None
+        self.on_message = None
+        self.on_disconnect = None
+        self.broker = None
+        self._connected = False
+        self._inbox = queue.SimpleQueue()
+        self._thread = None
+        self._mid = 0
+        self._mid_lock = threading.Lock()
+
+    def username_pw_set(self, username, password=None):
+        """进程内代理不做认证，保留接口"""
+        pass
+
+    def connect(self, host='localhost', port=1883, keepalive=60):
+        """连接到同一地址的进程内代理；与paho一样，on_connect 在循环线程中调用"""
+        if self.broker is not None:
+            self.broker.detach(self)
+        self.broker = get_broker(host, port)
+        self.broker.attach(self)
+        self._inbox.put(('connect', None))
+        return MQTT_ERR_SUCCESS
+
+    def disconnect(self):
+        if self.broker is None:
+            return MQTT_ERR_NO_CONN
+        self.broker.detach(self)
+        self.broker = None
+        self._connected = False
+        self._inbox.put(('disconnect', 0))
+        return MQTT_ERR_SUCCESS
+
+    def is_connected(self):
+        return self._connected
+
+    def _next_mid(self):
+        with self._mid_lock:
+            self._mid = self._mid % 65535 + 1
+            return self._mid
+
+    def subscribe(self, topic, qos=0):
+        if not self._connected or self.broker is None:
+            return MQTT_ERR_NO_CONN, None
+        mid = self._next_mid()
+        for message in self.broker.subscribe(self, topic, qos):
+            self._deliver(message)
+        return MQTT_ERR_SUCCESS, mid
+
+    def unsubscribe(self, topic):
+        if not self._connected or self.broker is None:
+            return MQTT_ERR_NO_CONN, None
+        self.broker.unsubscribe(self, topic)
+        return MQTT_ERR_SUCCESS, self._next_mid()
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        """负载转换规则与paho相同: str 按UTF-8编码，数字转为字符串，None 为空负载"""
+        mid = self._next_mid()
+        if not self._connected or self.broker is None:
+            return LoopbackPublishResult(MQTT_ERR_NO_CONN, mid)
+        if payload is None:
+            payload = b''
+        elif isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        elif isinstance(payload, (int, float)):
+            payload = str(payload).encode('ascii')
+        elif isinstance(payload, (bytearray, memoryview)):
+            payload = bytes(payload)
+        self.broker.publish(LoopbackMessage(topic, payload, qos, retain, mid))
+        return LoopbackPublishResult(MQTT_ERR_SUCCESS, mid)
+
+    def _deliver(self, message):
+        self._inbox.put(('message', message))
+
+    def _callback(self, callback, *args):
+        if callback is None:
+            return
+        if self.protocol == MQTTv5:
+            args += (None,)
+        try:
+            callback(self, self.userdata, *args)
+        except Exception as e:
+            logging.error(f"进程内MQTT客户端 {self._client_id} 回调失败: {e}")
+
+    def _loop(self):
+        while True:
+            item = self._inbox.get()
+            if item is self._STOP:
+                return
+            kind, value = item
+            if kind == 'message':
+                if self.on_message is not None:
+                    try:
+                        self.on_message(self, self.userdata, value)
+                    except Exception as e:
+                        logging.error(f"进程内MQTT客户端 {self._client_id} 处理消息失败: {e}")
+            elif kind == 'connect':
+                self._connected = True
+                self._callback(self.on_connect, {'session present': 0}, 0)
+            elif kind == 'disconnect':
+                self._callback(self.on_disconnect, value)
+
+    def loop_start(self):
+        if self._thread is not None:
+            return MQTT_ERR_SUCCESS
+        self._thread = threading.Thread(target=self._loop, name=f"loopback-{self._client_id}", daemon=True)
+        self._thread.start()
+        return MQTT_ERR_SUCCESS
+
+    def loop_stop(self):
+        """处理完已收到的消息后停止循环线程"""
+        if self._thread is None:
+            return MQTT_ERR_SUCCESS
+        self._inbox.put(self._STOP)
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        return MQTT_ERR_SUCCESS
+
+    def loop_forever(self):
+        self._loop()
+        return MQTT_ERR_SUCCESS
@@ -6,21 +6,25 @@ ESP32数据采集和控制系统主程序
 功能: 北向采集AD1数据，南向控制IO1开关
 """
 
-import os
 import sys
 import time
 import signal
 import logging
 import configparser
 import threading
-from datetime import datetime
 
 # 导入自定义模块
 from database import DatabaseManager
 from mqtt_client import MQTTClient
+from ingest_writer import IngestWriter
+from async_ingest import AsyncIngestEngine
+from retention import RetentionManager
+from live_stream import LiveBroadcaster
 from esp32_simulator import ESP32Simulator  # ESP32模拟器已重新启用
 from web_server import WebServer
+from deployment import MultiProcessDeployment
 from ip_config import IPConfigManager  # 导入动态IP配置管理器
+from log_setup import setup_logging
 
 class ESP32BackendSystem:
     def __init__(self, config_file="config.ini"):
@@ -42,9 +46,13 @@ class ESP32BackendSystem:
         
         # 系统组件
         self.database_manager = None
+        self.ingest_writer = None
+        self.async_ingest = None
+        self.retention_manager = None
         self.mqtt_client = None
         self.esp32_simulator = None  # ESP32模拟器已重新启用
         self.web_server = None
+        self.deployment = None
         
         # 运行状态
         self.running = False
@@ -78,33 +86,8 @@ class ESP32BackendSystem:
             logging.error(f"IP配置更新失败: {e}")
     
     def setup_logging(self):
-        """设置日志配置"""
-        log_level = logging.INFO
-        log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        
-        # 创建logs目录
-        if not os.path.exists('logs'):
-            os.makedirs('logs')
-        
-        # 文件处理器
-        log_file = f"logs/esp32_backend_{datetime.now().strftime('%Y%m%d')}.log"
-        file_handler = logging.FileHandler(log_file, encoding='utf-8')
-        file_handler.setLevel(log_level)
-        file_handler.setFormatter(logging.Formatter(log_format))
-        
-        # 控制台处理器
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(log_level)
-        console_handler.setFormatter(logging.Formatter(log_format))
-        
-        # 根日志器配置
-        logging.basicConfig(
-            level=log_level,
-            format=log_format,
-            handlers=[file_handler, console_handler]
-        )
-        
-        logging.info(f"日志系统初始化完成，日志文件: {log_file}")
+        """设置日志配置 (见 [LOGGING])，文件和控制台输出在后台线程中进行"""
+        self.log_listener = setup_logging(self.config, 'backend')
     
     def initialize_components(self):
         """初始化系统组件"""
@@ -113,17 +96,62 @@ class ESP32BackendSystem:
             
             # 初始化数据库管理器
             db_path = self.config.get('DATABASE', 'db_path')
-            self.database_manager = DatabaseManager(db_path)
+            self.database_manager = DatabaseManager(
+                db_path,
+                pool_size=self.config.getint('DATABASE', 'pool_size', fallback=8),
+                journal_mode=self.config.get('DATABASE', 'journal_mode', fallback='WAL'),
+                synchronous=self.config.get('DATABASE', 'synchronous', fallback='NORMAL'),
+                cache_size=self.config.getint('DATABASE', 'cache_size', fallback=-16000),
+                mmap_size=self.config.getint('DATABASE', 'mmap_size', fallback=268435456)
+            )
             if not self.database_manager:
                 raise Exception("数据库管理器初始化失败")
             logging.info("数据库管理器初始化完成")
             
+            # 初始化写后入库队列
+            self.ingest_writer = IngestWriter(
+                self.database_manager,
+                batch_size=self.config.getint('INGEST', 'batch_size', fallback=500),
+                flush_interval=self.config.getfloat('INGEST', 'flush_interval', fallback=1.0),
+                max_queue_size=self.config.getint('INGEST', 'max_queue_size', fallback=10000)
+            )
+            logging.info("入库队列初始化完成")
+            
+            # 初始化数据保留策略
+            if self.config.getboolean('RETENTION', 'enabled', fallback=True):
+                self.retention_manager = RetentionManager.from_config(self.config, self.database_manager)
+                logging.info("数据保留策略初始化完成")
+            
+            # 初始化实时推送
+            broadcaster = LiveBroadcaster(
+                buffer_size=self.config.getint('WEB_SERVER', 'stream_buffer_size', fallback=100),
+                max_clients=self.config.getint('WEB_SERVER', 'stream_max_clients', fallback=16)
+            )
+            
             # 初始化MQTT客户端
-            self.mqtt_client = MQTTClient(self.config_file, self.database_manager)
+            # engine = asyncio 时由异步入库引擎订阅数据，MQTTClient只负责发布控制命令
+            use_async_engine = self.config.get('MQTT', 'engine', fallback='paho').lower() == 'asyncio'
+            if use_async_engine and self.config.get('MQTT', 'transport', fallback='tcp').lower() == 'loopback':
+                # 异步引擎直接读写TCP连接，进程内代理只能由paho兼容的客户端使用
+                logging.warning("transport = loopback 不支持 asyncio 入库引擎，改用 paho")
+                use_async_engine = False
+            self.mqtt_client = MQTTClient(self.config_file, self.database_manager, self.ingest_writer,
+                                          broadcaster=broadcaster, subscribe=not use_async_engine)
             if not self.mqtt_client:
                 raise Exception("MQTT客户端初始化失败")
             logging.info("MQTT客户端初始化完成")
             
+            if use_async_engine:
+                self.async_ingest = AsyncIngestEngine(
+                    self.config_file, self.database_manager,
+                    latest_cache=self.mqtt_client.latest_cache,
+                    broadcaster=broadcaster,
+                    batch_size=self.config.getint('INGEST', 'batch_size', fallback=500),
+                    flush_interval=self.config.getfloat('INGEST', 'flush_interval', fallback=1.0),
+                    max_queue_size=self.config.getint('INGEST', 'max_queue_size', fallback=10000)
+                )
+                logging.info("异步入库引擎初始化完成")
+            
             # 初始化ESP32模拟器
             self.esp32_simulator = ESP32Simulator(self.config_file)
             if not self.esp32_simulator:
@@ -152,6 +180,18 @@ class ESP32BackendSystem:
             if not all([self.mqtt_client, self.esp32_simulator, self.web_server]):
                 raise Exception("系统组件未正确初始化")
             
+            # 启动入库写线程（需在MQTT开始收消息之前）
+            if self.ingest_writer:
+                self.ingest_writer.start()
+            
+            # 启动数据保留策略
+            if self.retention_manager:
+                self.retention_manager.start()
+            
+            # 启动异步入库引擎
+            if self.async_ingest:
+                self.async_ingest.start()
+            
             # 启动MQTT客户端
             if self.mqtt_client:
                 self.mqtt_client.connect()
@@ -192,6 +232,11 @@ class ESP32BackendSystem:
         try:
             logging.info("正在停止系统组件...")
             
+            # 多进程部署：由子进程各自停止组件
+            if self.deployment:
+                self.deployment.stop()
+                self.deployment = None
+            
             # 停止ESP32模拟器
             if self.esp32_simulator:
                 self.esp32_simulator.disconnect()
@@ -200,6 +245,22 @@ class ESP32BackendSystem:
             if self.mqtt_client:
                 self.mqtt_client.disconnect()
             
+            # 停止异步入库引擎，写入剩余数据
+            if self.async_ingest:
+                self.async_ingest.stop()
+            
+            # 停止入库写线程，写入队列中剩余的数据
+            if self.ingest_writer:
+                self.ingest_writer.stop()
+            
+            # 停止数据保留策略
+            if self.retention_manager:
+                self.retention_manager.stop()
+            
+            # 关闭数据库连接池
+            if self.database_manager:
+                self.database_manager.close()
+            
             logging.info("所有系统组件已停止")
             
         except Exception as e:
@@ -217,11 +278,39 @@ class ESP32BackendSystem:
         self.shutdown_event.set()
         self.stop_components()
         logging.info("系统已关闭")
+        # 写出队列中剩余的日志
+        if self.log_listener:
+            self.log_listener.stop()
+            self.log_listener = None
         sys.exit(0)
     
+    def run_multiprocess(self):
+        """多进程部署：主进程只负责启动和监控子进程"""
+        if self.config.get('MQTT', 'transport', fallback='tcp').lower() == 'loopback':
+            # 进程内代理只在入库进程内可见 (模拟器 -> 入库)，Web工作进程发布的IO1控制命令无法送达
+            logging.warning("transport = loopback 时Web工作进程无法发布控制命令，建议使用 single 部署模式")
+        self.deployment = MultiProcessDeployment(self.config_file, self.config)
+        self.deployment.start()
+        self.running = True
+        
+        web_port = self.config.get('WEB_SERVER', 'port')
+        logging.info(f"ESP32后台系统启动成功 (多进程模式)，本地访问: http://localhost:{web_port}")
+        logging.info("按 Ctrl+C 停止系统")
+        
+        while self.running and not self.shutdown_event.is_set():
+            self.deployment.check_processes()
+            if time.time() % 60 < 1:
+                logging.info(f"子进程状态 - {self.deployment.get_status()}")
+            self.shutdown_event.wait(1)
+        return True
+    
     def run(self):
         """运行主循环"""
         try:
+            # 多进程部署模式
+            if self.config.get('DEPLOYMENT', 'mode', fallback='single').lower() == 'multiprocess':
+                return self.run_multiprocess()
+            
             # 初始化组件
             if not self.initialize_components():
                 logging.error("系统组件初始化失败，退出")
@@ -0,0 +1,253 @@
+import math
+import threading
+from bisect import bisect_left
+
+# Prometheus文本格式的Content-Type
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 延迟直方图默认分桶 (秒)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 批大小直方图分桶 (行)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+def format_value(value):
+    """Prometheus文本格式的取值 (布尔值输出为1/0)"""
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def format_labels(names, values, extra=None):
+    """标签文本 {name="value",...}，extra为额外的 (名称, 值)，如直方图的le"""
+    pairs = [(name, str(value)) for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class _CounterValue:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+class _GaugeValue:
+    __slots__ = ('value', 'function', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """采集时调用function取值 (如队列深度)，热路径上没有任何开销"""
+        self.function = function
+
+    def get(self):
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception:
+                return math.nan
+        return self.value
+
+class _HistogramValue:
+    __slots__ = ('bounds', 'counts', 'sum', 'lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # 最后一个计数对应 +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+class Metric:
+    """一个指标及其各标签组合的取值
+
+    无标签指标直接调用 inc/set/observe；有标签的先用 labels(标签值...) 取得子项，
+    调用方可以把子项保存下来，热路径上只剩一次加锁累加。
+    """
+
+    type = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_value(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签: {', '.join(self.labelnames)}")
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_value())
+        return child
+
+    def samples(self):
+        """(后缀, 标签文本, 取值) 列表"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {format_value(value)}")
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _new_value(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def samples(self):
+        return [('', format_labels(self.labelnames, values), child.value)
+                for values, child in list(self._children.items())]
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def _new_value(self):
+        return _GaugeValue()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def set_function(self, function):
+        self._default.set_function(function)
+
+    def samples(self):
+        return [('', format_labels(self.labelnames, values), child.get())
+                for values, child in list(self._children.items())]
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+
+    def _new_value(self):
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def samples(self):
+        result = []
+        for values, child in list(self._children.items()):
+            with child.lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), counts):
+                cumulative += count
+                result.append(('_bucket', format_labels(self.labelnames, values, ('le', format_value(bound))),
+                               cumulative))
+            labels = format_labels(self.labelnames, values)
+            result.append(('_sum', labels, total))
+            result.append(('_count', labels, cumulative))
+        return result
+
+class MetricsRegistry:
+    """指标注册表，render 输出 Prometheus 文本格式"""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"指标 {metric.name} 已注册")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+# 进程内共用的注册表和指标。多进程部署时每个进程各自计数:
+# 入库相关指标在入库进程中，HTTP指标在各Web工作进程中
+registry = MetricsRegistry()
+
+messages_received = registry.counter(
+    'esp32_mqtt_messages_received_total', "收到的MQTT消息数 (按路由)", ('topic',))
+messages_decoded = registry.counter(
+    'esp32_mqtt_messages_decoded_total', "解码成功的消息数 (按负载类型)", ('topic',))
+messages_invalid = registry.counter(
+    'esp32_mqtt_messages_invalid_total', "格式错误被丢弃的消息数 (按负载类型)", ('topic',))
+samples_received = registry.counter(
+    'esp32_telemetry_samples_received_total', "收到的遥测采样数 (批量消息按采样计)")
+rows_written = registry.counter(
+    'esp32_ingest_rows_written_total', "已写入数据库的数据行数", ('table',))
+rows_dropped = registry.counter(
+    'esp32_ingest_rows_dropped_total', "丢弃的数据行数 (queue_full: 入库队列已满, db_error: 写入失败)", ('reason',))
+queue_depth = registry.gauge(
+    'esp32_ingest_queue_depth', "入库队列中等待写入的消息数")
+mqtt_connected = registry.gauge(
+    'esp32_mqtt_connected', "MQTT连接状态 (1为已连接)")
+db_batch_rows = registry.histogram(
+    'esp32_db_batch_rows', "每次批量写入的行数", buckets=SIZE_BUCKETS)
+db_commit_seconds = registry.histogram(
+    'esp32_db_commit_seconds', "批量写入事务耗时 (秒)")
+ingest_latency_seconds = registry.histogram(
+    'esp32_ingest_latency_seconds', "入库链路延迟 (秒): publish_receive / receive_commit / commit_readback", ('stage',))
+http_request_seconds = registry.histogram(
+    'esp32_http_request_duration_seconds', "HTTP请求处理耗时 (秒，按路由)", ('method', 'route', 'status'))
+
+# 按负载类型预先取得的子项，供两种入库引擎的消息处理函数直接累加
+decoded = {kind: messages_decoded.labels(kind) for kind in ('telemetry', 'io1', 'status')}
+invalid = {kind: messages_invalid.labels(kind) for kind in ('telemetry', 'io1', 'status')}
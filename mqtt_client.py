@@ -1,19 +1,47 @@
 import paho.mqtt.client as mqtt
+import os
 import json
+import time
 import logging
 import configparser
+import metrics
 from datetime import datetime
+from database import DEFAULT_DEVICE_ID, DEFAULT_CHANNEL
+from latest_cache import LatestValueCache
+from loopback_broker import LoopbackClient
+from topic_router import router_from_config, shared_subscription
+from payload_codec import decode_payload, sample_offsets, device_time_ms, PayloadError
+from latency_tracker import latency_tracker
+from log_setup import SampledLogger
+
+# 每条消息的处理日志按采样输出，格式错误的告警按采样限流
+ingest_log = SampledLogger()
+payload_warning_log = SampledLogger(logging.WARNING)
 
 class MQTTClient:
-    def __init__(self, config_file, database_manager):
+    def __init__(self, config_file, database_manager, ingest_writer=None, latest_cache=None, broadcaster=None,
+                 client_id=None, subscribe=True, worker_id=None):
         self.config = configparser.ConfigParser()
         self.config.read(config_file)
         self.database_manager = database_manager
+        # 写后入库队列（可选），设置后消息处理不再同步写数据库
+        self.ingest_writer = ingest_writer
         
         # MQTT配置
         self.broker = self.config.get('MQTT', 'broker')
         self.port = self.config.getint('MQTT', 'port')
-        self.client_id = self.config.get('MQTT', 'client_id')
+        # subscribe=False 时只用于发布控制命令 (如Web工作进程)，不接收数据
+        self.subscribe = subscribe
+        # 共享订阅组: 设置后以 $share/<组>/<主题> 订阅，同组的多个入库进程分摊消息，每条消息只投递给其中一个
+        self.shared_group = self.config.get('MQTT', 'shared_group', fallback='').strip() if subscribe else ''
+        self.protocol = self.config.get('MQTT', 'protocol', fallback='3.1.1').strip()
+        # tcp: 连接外部MQTT代理; loopback: 同一进程内的代理 (loopback_broker)，不需要mosquitto，不经过TCP
+        self.transport = self.config.get('MQTT', 'transport', fallback='tcp').strip().lower()
+        # 多进程部署时每个进程需要不同的client_id；共享订阅的每个入库进程追加worker编号 (默认进程号)
+        self.client_id = client_id or self.config.get('MQTT', 'client_id')
+        if self.shared_group and not client_id:
+            worker_id = worker_id or self.config.get('MQTT', 'worker_id', fallback='') or os.getpid()
+            self.client_id = f"{self.client_id}_{worker_id}"
         self.username = self.config.get('MQTT', 'username')
         self.password = self.config.get('MQTT', 'password')
         self.keepalive = self.config.getint('MQTT', 'keepalive')
@@ -22,9 +50,20 @@ class MQTTClient:
         self.ad1_topic = self.config.get('TOPICS', 'ad1_data')
         self.io1_control_topic = self.config.get('TOPICS', 'io1_control')
         self.status_topic = self.config.get('TOPICS', 'status')
+        # 按主题模式路由，telemetry 模式如 esp32/{device_id}/{channel}/data 从主题中取得设备和通道
+        self.router = router_from_config(self.config, {
+            'ad1_data': self.handle_ad1_data,
+            'telemetry': self.handle_ad1_data,
+            'io1_control': self.handle_io1_control,
+            'status': self.handle_status
+        })
         
         # 创建MQTT客户端
-        self.client = mqtt.Client(client_id=self.client_id)
+        protocol = mqtt.MQTTv5 if self.protocol == '5' else mqtt.MQTTv311
+        if self.transport == 'loopback':
+            self.client = LoopbackClient(client_id=self.client_id, protocol=protocol)
+        else:
+            self.client = mqtt.Client(client_id=self.client_id, protocol=protocol)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
@@ -36,17 +75,25 @@ class MQTTClient:
         # 连接状态
         self.connected = False
         self.current_io1_state = False
+        self.messages_received = 0
+        
+        # 按设备/通道的最新值缓存，供Web层直接读取而不查询数据库
+        self.latest_cache = latest_cache if latest_cache is not None else LatestValueCache()
+        # 实时推送（可选），每条消息转发给浏览器订阅者
+        self.broadcaster = broadcaster
         
-    def on_connect(self, client, userdata, flags, rc):
+    def on_connect(self, client, userdata, flags, rc, properties=None):
         """MQTT连接回调"""
         if rc == 0:
             self.connected = True
             logging.info("MQTT连接成功")
             
             # 订阅相关主题
-            client.subscribe(self.ad1_topic)
-            client.subscribe(self.io1_control_topic)
-            client.subscribe(self.status_topic)
+            if self.subscribe:
+                for topic in self.router.subscriptions():
+                    client.subscribe(shared_subscription(topic, self.shared_group))
+                if self.shared_group:
+                    logging.info(f"已加入共享订阅组 {self.shared_group} (client_id={self.client_id})")
             
             # 发布上线状态
             self.publish_status("online")
@@ -58,21 +105,16 @@ class MQTTClient:
         """MQTT消息接收回调"""
         try:
             topic = msg.topic
-            payload = msg.payload.decode('utf-8')
+            self.messages_received += 1
+            # 每条消息的日志只在DEBUG级别输出；负载以bytes直接交给解码器
+            logging.debug("收到消息: %s -> %s", topic, msg.payload)
             
-            logging.info(f"收到消息: {topic} -> {payload}")
-            
-            if topic == self.ad1_topic:
-                self.handle_ad1_data(payload)
-            elif topic == self.io1_control_topic:
-                self.handle_io1_control(payload)
-            elif topic == self.status_topic:
-                self.handle_status(payload)
+            self.router.dispatch(topic, msg.payload)
                 
         except Exception as e:
             logging.error(f"处理MQTT消息失败: {e}")
     
-    def on_disconnect(self, client, userdata, rc):
+    def on_disconnect(self, client, userdata, rc, properties=None):
         """MQTT断开连接回调"""
         self.connected = False
         logging.warning("MQTT连接断开")
@@ -80,59 +122,116 @@ class MQTTClient:
         if rc != 0:
             logging.error(f"意外断开连接，错误码: {rc}")
     
-    def handle_ad1_data(self, payload):
-        """处理AD1数据"""
+    def handle_ad1_data(self, payload, device_id=None, channel=None):
+        """处理AD1数据，device_id/channel 来自主题时优先于负载中的字段"""
         try:
-            data = json.loads(payload)
-            if 'value' in data:
-                value = data['value']
-                # 保存到数据库
-                self.database_manager.save_ad1_data(value)
-                logging.info(f"AD1数据已保存: {value}")
+            record = decode_payload('telemetry', payload)
+            metrics.decoded['telemetry'].inc()
+            device_id = device_id or record.device_id or DEFAULT_DEVICE_ID
+            channel = channel or record.channel or DEFAULT_CHANNEL
+            if record.values is not None:
+                self.handle_ad1_batch(record, device_id, channel)
+                return
+            value = record.value
+            ts = int(time.time() * 1000)
+            metrics.samples_received.inc()
+            device_ts = device_time_ms(record.timestamp, ts)
+            if device_ts is not None:
+                latency_tracker.record('publish_receive', max(0, ts - device_ts))
+            self.latest_cache.update(device_id, channel, value, ts)
+            if self.broadcaster:
+                self.broadcaster.publish('ad1', {'device_id': device_id, 'channel': channel, 'value': value, 'ts': ts})
+            # 保存到数据库
+            if self.ingest_writer:
+                self.ingest_writer.submit('telemetry', (device_id, channel, ts, value, device_ts, ts))
             else:
-                logging.warning("AD1数据格式错误，缺少value字段")
-        except json.JSONDecodeError:
-            logging.error("AD1数据JSON格式错误")
+                self.database_manager.save_ad1_data(value, device_id, channel, ts, device_ts)
+            ingest_log.log('ad1', "AD1数据已保存: %s/%s = %s", device_id, channel, value)
+        except PayloadError as e:
+            metrics.invalid['telemetry'].inc()
+            payload_warning_log.log('ad1', "AD1数据格式错误: %s", e)
         except Exception as e:
             logging.error(f"处理AD1数据失败: {e}")
     
-    def handle_io1_control(self, payload):
+    def handle_ad1_batch(self, record, device_id, channel):
+        """处理批量采样：整批在一次事务中写入，最新值缓存和实时推送只取最后一个采样"""
+        # 设备时间戳可能是设备启动后的毫秒数，按采样间隔把最后一个采样对齐到接收时间
+        offsets = sample_offsets(record)
+        now = int(time.time() * 1000)
+        end_ts = now - offsets[-1]
+        # 设备时钟已同步时同时记录设备采样时间，没有base_ts时不记录
+        device_end = device_time_ms(record.base_ts + offsets[-1], now) if record.base_ts is not None else None
+        if device_end is None:
+            rows = [(device_id, channel, end_ts + offset, value, None, now)
+                    for offset, value in zip(offsets, record.values)]
+        else:
+            latency_tracker.record('publish_receive', max(0, now - device_end))
+            device_base = device_end - offsets[-1]
+            rows = [(device_id, channel, end_ts + offset, value, device_base + offset, now)
+                    for offset, value in zip(offsets, record.values)]
+        metrics.samples_received.inc(len(rows))
+        _, _, ts, value, _, _ = rows[-1]
+        self.latest_cache.update(device_id, channel, value, ts)
+        if self.broadcaster:
+            self.broadcaster.publish('ad1', {'device_id': device_id, 'channel': channel, 'value': value, 'ts': ts})
+        if self.ingest_writer:
+            self.ingest_writer.submit_many('telemetry', rows)
+        else:
+            self.database_manager.save_batch({'telemetry': rows})
+        ingest_log.log('ad1_batch', "AD1批量数据已保存: %s/%s %d 个采样", device_id, channel, len(rows))
+    
+    def handle_io1_control(self, payload, device_id=None):
         """处理IO1控制状态"""
         try:
-            data = json.loads(payload)
-            if 'state' in data:
-                state = data['state']
-                self.current_io1_state = state
-                # 保存到数据库
-                self.database_manager.save_io1_control(state)
-                logging.info(f"IO1控制状态已保存: {state}")
+            record = decode_payload('io1', payload)
+            metrics.decoded['io1'].inc()
+            state = record.state
+            self.current_io1_state = state
+            device_id = device_id or record.device_id or DEFAULT_DEVICE_ID
+            self.latest_cache.update(device_id, record.channel or 'IO1', state)
+            if self.broadcaster:
+                self.broadcaster.publish('io1', {'device_id': device_id, 'state': state})
+            # 保存到数据库
+            if self.ingest_writer:
+                self.ingest_writer.submit('io1_control', (state,))
             else:
-                logging.warning("IO1控制数据格式错误，缺少state字段")
-        except json.JSONDecodeError:
-            logging.error("IO1控制数据JSON格式错误")
+                self.database_manager.save_io1_control(state)
+            ingest_log.log('io1', "IO1控制状态已保存: %s", state)
+        except PayloadError as e:
+            metrics.invalid['io1'].inc()
+            payload_warning_log.log('io1', "IO1控制数据格式错误: %s", e)
         except Exception as e:
             logging.error(f"处理IO1控制数据失败: {e}")
     
-    def handle_status(self, payload):
+    def handle_status(self, payload, device_id=None):
         """处理设备状态"""
         try:
-            data = json.loads(payload)
-            if 'status' in data:
-                status = data['status']
-                # 保存到数据库
-                self.database_manager.save_device_status(status)
-                logging.info(f"设备状态已保存: {status}")
+            record = decode_payload('status', payload)
+            metrics.decoded['status'].inc()
+            status = record.status
+            device_id = device_id or record.device_id or DEFAULT_DEVICE_ID
+            self.latest_cache.update(device_id, 'status', status)
+            if self.broadcaster:
+                self.broadcaster.publish('status', {'device_id': device_id, 'status': status})
+            # 保存到数据库
+            if self.ingest_writer:
+                self.ingest_writer.submit('device_status', (status,))
             else:
-                logging.warning("设备状态数据格式错误，缺少status字段")
-        except json.JSONDecodeError:
-            logging.error("设备状态数据JSON格式错误")
+                self.database_manager.save_device_status(status)
+            ingest_log.log('status', "设备状态已保存: %s", status)
+        except PayloadError as e:
+            metrics.invalid['status'].inc()
+            payload_warning_log.log('status', "设备状态数据格式错误: %s", e)
         except Exception as e:
             logging.error(f"处理设备状态失败: {e}")
     
     def connect(self):
         """连接到MQTT代理"""
+        if self.subscribe:
+            # 负责入库的客户端导出连接状态指标
+            metrics.mqtt_connected.set_function(self.get_connection_status)
         try:
-            logging.info(f"正在连接到MQTT代理: {self.broker}:{self.port}")
+            logging.info(f"正在连接到MQTT代理: {self.broker}:{self.port} ({self.transport})")
             self.client.connect(self.broker, self.port, self.keepalive)
             self.client.loop_start()
             
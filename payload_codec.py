@@ -0,0 +1,292 @@
+import json
+import struct
+from collections import namedtuple
+from datetime import datetime
+from itertools import accumulate
+from typing import List, Optional, Union
+
+# 可选的高速JSON解码库: 优先msgspec (直接解码为带类型检查的结构体)，其次orjson，最后标准库json
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class PayloadError(ValueError):
+    """负载格式错误 (不是合法JSON、不是对象、缺少字段或字段类型不符)"""
+
+_REQUIRED = object()
+
+class ListOf:
+    """列表字段，元素类型为 types"""
+
+    def __init__(self, types):
+        self.types = types if isinstance(types, tuple) else (types,)
+
+NUMBER = (int, float)
+TIMESTAMP = (int, float, str)
+
+# 每种负载的字段: (字段名, 允许的类型, 默认值)；未列出的字段 (unit、wifi_rssi、ip等) 解码时忽略
+# 遥测负载为单个采样 (value) 或一批采样 (base_ts + deltas + values)，两者必须有其一，见 PayloadCodec.decode
+PAYLOAD_SCHEMAS = {
+    'telemetry': (
+        ('value', NUMBER, None),
+        ('device_id', str, None),
+        ('channel', str, None),
+        ('timestamp', TIMESTAMP, None),
+        ('base_ts', int, None),
+        ('deltas', ListOf(int), None),
+        ('values', ListOf(NUMBER), None),
+    ),
+    'io1': (
+        ('state', bool, _REQUIRED),
+        ('device_id', str, None),
+        ('channel', str, None),
+        ('command', str, None),
+        ('timestamp', TIMESTAMP, None),
+    ),
+    'status': (
+        ('status', str, _REQUIRED),
+        ('device_id', str, None),
+        ('io1_state', bool, None),
+        ('timestamp', TIMESTAMP, None),
+    ),
+}
+
+# 紧凑二进制遥测格式 (小端):
+#   版本号 u8 (=1) | 采样值 u16 | 设备时间戳 u32 (毫秒, 固件为millis()) | [设备ID长度 u8 + UTF-8] | [通道长度 u8 + UTF-8]
+# 设备ID和通道可省略 (由主题提供)。合法JSON不可能以0x01开头，解码时按首字节自动识别，同一主题上两种格式可以混用。
+#
+# 批量采样格式 (小端):
+#   版本号 u8 (=2) | 采样数 u16 | 首个采样的设备时间戳 u32 | 采样数 x (与上一采样的间隔毫秒 u16, 采样值 u16) | [设备ID] | [通道]
+BINARY_VERSION = 1
+BINARY_BATCH_VERSION = 2
+BINARY_HEADER = struct.Struct('<BHI')
+
+def encode_telemetry_binary(value, timestamp=0, device_id=None, channel=None):
+    """编码二进制遥测负载，value为0~65535的整数采样值 (如12位ADC)"""
+    payload = BINARY_HEADER.pack(BINARY_VERSION, int(value), int(timestamp) & 0xFFFFFFFF)
+    if device_id is not None or channel is not None:
+        encoded = (device_id or '').encode('utf-8')[:255]
+        payload += bytes([len(encoded)]) + encoded
+    if channel is not None:
+        encoded = channel.encode('utf-8')[:255]
+        payload += bytes([len(encoded)]) + encoded
+    return payload
+
+def encode_telemetry_batch_binary(values, deltas, base_ts=0, device_id=None, channel=None):
+    """编码二进制批量采样负载，deltas[i]为第i个采样与上一采样的间隔(毫秒)，deltas[0]通常为0"""
+    count = len(values)
+    samples = [0] * (2 * count)
+    samples[0::2] = deltas
+    samples[1::2] = values
+    payload = BINARY_HEADER.pack(BINARY_BATCH_VERSION, count, int(base_ts) & 0xFFFFFFFF)
+    payload += struct.pack(f'<{2 * count}H', *samples)
+    if device_id is not None or channel is not None:
+        encoded = (device_id or '').encode('utf-8')[:255]
+        payload += bytes([len(encoded)]) + encoded
+    if channel is not None:
+        encoded = channel.encode('utf-8')[:255]
+        payload += bytes([len(encoded)]) + encoded
+    return payload
+
+def sample_offsets(record):
+    """批量采样记录中各采样相对第一个采样的时间偏移(毫秒)"""
+    return list(accumulate(record.deltas))
+
+# 设备时间戳与服务器时间相差超过该值时不视为同一时钟 (如固件的millis()启动时间)
+DEVICE_CLOCK_WINDOW_MS = 10 * 60 * 1000
+
+def device_time_ms(timestamp, now_ms):
+    """把设备上报的时间戳换算为UTC毫秒时间，无法换算 (设备没有同步时钟) 时返回None
+
+    支持ISO格式字符串 (模拟器)、毫秒时间戳，以及二进制格式中截断为u32的毫秒时间戳，
+    后者按最接近now_ms的时间还原。
+    """
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, str):
+        try:
+            return int(datetime.fromisoformat(timestamp).timestamp() * 1000)
+        except ValueError:
+            return None
+    timestamp = int(timestamp)
+    if timestamp <= 0xFFFFFFFF:
+        timestamp += (now_ms - timestamp + 0x80000000) // 0x100000000 * 0x100000000
+    if abs(now_ms - timestamp) > DEVICE_CLOCK_WINDOW_MS:
+        return None
+    return timestamp
+
+RECORD_NAMES = {'telemetry': 'TelemetryRecord', 'io1': 'IO1Record', 'status': 'StatusRecord'}
+
+def _msgspec_type(types, default):
+    if isinstance(types, ListOf):
+        field_type = List[Union[types.types]]
+    else:
+        field_type = Union[types] if isinstance(types, tuple) else types
+    return field_type if default is _REQUIRED else Optional[field_type]
+
+class PayloadCodec:
+    """入站负载解码器
+
+    各主题的负载结构在创建时预编译一次，decode 直接把 bytes 解码为字段固定的记录 (带属性访问)，
+    格式错误的负载抛出 PayloadError。
+    backend: 'msgspec' / 'orjson' / 'json'，默认选择已安装的最快实现。
+    """
+
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = 'msgspec' if msgspec is not None else 'orjson' if orjson is not None else 'json'
+        if backend == 'msgspec' and msgspec is None or backend == 'orjson' and orjson is None:
+            raise ValueError(f"JSON解码库 {backend} 未安装")
+        self.backend = backend
+        self.record_types = {}
+        self._decoders = {}
+
+        for kind, fields in PAYLOAD_SCHEMAS.items():
+            if backend == 'msgspec':
+                # msgspec在解码的同时完成类型检查，不会先构造中间dict
+                record_type = msgspec.defstruct(
+                    RECORD_NAMES[kind],
+                    [(name, _msgspec_type(types, default)) if default is _REQUIRED
+                     else (name, _msgspec_type(types, default), default)
+                     for name, types, default in fields],
+                    frozen=True
+                )
+                self._decoders[kind] = msgspec.json.Decoder(record_type).decode
+            else:
+                record_type = namedtuple(RECORD_NAMES[kind], [name for name, _, _ in fields],
+                                         defaults=[None if default is _REQUIRED else default
+                                                   for _, _, default in fields])
+                loads = orjson.loads if backend == 'orjson' else json.loads
+                self._decoders[kind] = self._compile(record_type, fields, loads)
+            self.record_types[kind] = record_type
+        self._telemetry_record = self.record_types['telemetry']
+
+    @staticmethod
+    def _compile(record_type, fields, loads):
+        """生成基于dict的解码函数 (orjson/json)"""
+        # 按精确类型比较: JSON解码结果不会出现子类，且自然排除了数值字段中的true/false
+        checks = []
+        for name, types, default in fields:
+            if isinstance(types, ListOf):
+                checks.append((name, frozenset((list,)), default is _REQUIRED, frozenset(types.types)))
+            else:
+                classes = frozenset(types if isinstance(types, tuple) else (types,))
+                checks.append((name, classes, default is _REQUIRED, None))
+        # 标准库json解析str比解析bytes快 (省去编码检测)
+        decode_bytes = loads is json.loads
+
+        def decode(payload):
+            if decode_bytes and isinstance(payload, bytes):
+                try:
+                    payload = payload.decode('utf-8')
+                except UnicodeDecodeError:
+                    raise PayloadError("负载不是UTF-8编码") from None
+            try:
+                data = loads(payload)
+            except ValueError as e:
+                raise PayloadError(f"JSON格式错误: {e}") from None
+            if data.__class__ is not dict:
+                raise PayloadError("负载不是JSON对象")
+            values = []
+            for name, types, required, item_types in checks:
+                value = data.get(name)
+                if value is None:
+                    if required:
+                        raise PayloadError(f"缺少{name}字段")
+                elif value.__class__ not in types:
+                    raise PayloadError(f"{name}字段类型错误")
+                elif item_types is not None:
+                    for item in value:
+                        if item.__class__ not in item_types:
+                            raise PayloadError(f"{name}字段元素类型错误")
+                values.append(value)
+            return record_type._make(values)
+        return decode
+
+    def decode_binary_telemetry(self, payload):
+        """解码二进制遥测负载"""
+        size = len(payload)
+        if size < BINARY_HEADER.size:
+            raise PayloadError("二进制负载长度不足")
+        _, value, timestamp = BINARY_HEADER.unpack_from(payload)
+        device_id = channel = None
+        offset = BINARY_HEADER.size
+        try:
+            if offset < size:
+                end = offset + 1 + payload[offset]
+                device_id = payload[offset + 1:end].decode('utf-8') or None
+                offset = end
+                if offset < size:
+                    end = offset + 1 + payload[offset]
+                    channel = payload[offset + 1:end].decode('utf-8') or None
+                    offset = end
+        except UnicodeDecodeError:
+            raise PayloadError("二进制负载中的字符串不是UTF-8编码") from None
+        if offset > size:
+            raise PayloadError("二进制负载长度不足")
+        return self._telemetry_record(value, device_id, channel, timestamp)
+
+    def decode_binary_batch(self, payload):
+        """解码二进制批量采样负载"""
+        size = len(payload)
+        if size < BINARY_HEADER.size:
+            raise PayloadError("二进制负载长度不足")
+        _, count, base_ts = BINARY_HEADER.unpack_from(payload)
+        offset = BINARY_HEADER.size + 4 * count
+        if count == 0 or offset > size:
+            raise PayloadError("二进制负载长度不足")
+        samples = struct.unpack_from(f'<{2 * count}H', payload, BINARY_HEADER.size)
+        device_id = channel = None
+        try:
+            if offset < size:
+                end = offset + 1 + payload[offset]
+                device_id = payload[offset + 1:end].decode('utf-8') or None
+                offset = end
+                if offset < size:
+                    end = offset + 1 + payload[offset]
+                    channel = payload[offset + 1:end].decode('utf-8') or None
+                    offset = end
+        except UnicodeDecodeError:
+            raise PayloadError("二进制负载中的字符串不是UTF-8编码") from None
+        if offset > size:
+            raise PayloadError("二进制负载长度不足")
+        return self._telemetry_record(None, device_id, channel, None, base_ts,
+                                      list(samples[0::2]), list(samples[1::2]))
+
+    def decode(self, kind, payload):
+        """解码负载 (bytes或str) 为 kind 对应的记录，遥测负载同时支持JSON和二进制格式"""
+        if kind != 'telemetry':
+            return self._decode_json(kind, payload)
+        head = payload[:1]
+        if head == b'\x01':
+            return self.decode_binary_telemetry(payload)
+        if head == b'\x02':
+            return self.decode_binary_batch(payload)
+        record = self._decode_json(kind, payload)
+        if record.values is not None:
+            # 带values即按批量采样处理 (即使同时带value)，缺少base_ts时视为没有设备时间
+            if not record.values or record.deltas is None or len(record.deltas) != len(record.values):
+                raise PayloadError("批量采样的values与deltas长度不一致")
+        elif record.value is None:
+            raise PayloadError("缺少value字段")
+        return record
+
+    def _decode_json(self, kind, payload):
+        if self.backend != 'msgspec':
+            return self._decoders[kind](payload)
+        try:
+            return self._decoders[kind](payload)
+        except msgspec.ValidationError as e:
+            raise PayloadError(str(e)) from None
+        except msgspec.DecodeError as e:
+            raise PayloadError(f"JSON格式错误: {e}") from None
+
+# 进程内共用的默认解码器
+default_codec = PayloadCodec()
+decode_payload = default_codec.decode
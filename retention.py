@@ -0,0 +1,137 @@
+import time
+import threading
+import logging
+from database import ROLLUP_RESOLUTIONS
+
+class RetentionManager:
+    """数据保留策略
+    
+    后台线程定期分块删除过期的原始数据、汇总数据和事件数据，
+    每块一个短事务，块之间让出写锁，最后做增量空闲页回收，
+    使数据库文件大小和查询代价保持有界。
+    """
+    
+    def __init__(self, database_manager, raw_days=30, rollup_days=None, event_days=90,
+                 chunk_size=5000, chunk_pause=0.05, vacuum_pages=1000,
+                 check_interval=3600, convert_existing_db=False):
+        self.database_manager = database_manager
+        self.raw_days = raw_days
+        # {粒度秒数: 保留天数}，0表示永久保留
+        self.rollup_days = rollup_days or {60: 90, 3600: 730, 86400: 0}
+        self.event_days = event_days
+        self.chunk_size = chunk_size
+        self.chunk_pause = chunk_pause
+        self.vacuum_pages = vacuum_pages
+        self.check_interval = check_interval
+        self.convert_existing_db = convert_existing_db
+        
+        self.running = False
+        self.stop_event = threading.Event()
+        self.retention_thread = None
+    
+    @classmethod
+    def from_config(cls, config, database_manager):
+        """从config.ini的[RETENTION]节创建"""
+        section = 'RETENTION'
+        return cls(
+            database_manager,
+            raw_days=config.getint(section, 'raw_days', fallback=30),
+            rollup_days={
+                60: config.getint(section, 'rollup_minute_days', fallback=90),
+                3600: config.getint(section, 'rollup_hour_days', fallback=730),
+                86400: config.getint(section, 'rollup_day_days', fallback=0),
+            },
+            event_days=config.getint(section, 'event_days', fallback=90),
+            chunk_size=config.getint(section, 'chunk_size', fallback=5000),
+            chunk_pause=config.getfloat(section, 'chunk_pause', fallback=0.05),
+            vacuum_pages=config.getint(section, 'vacuum_pages', fallback=1000),
+            check_interval=config.getint(section, 'check_interval', fallback=3600),
+            convert_existing_db=config.getboolean(section, 'convert_existing_db', fallback=False)
+        )
+    
+    def start(self):
+        """启动保留策略线程"""
+        if self.running:
+            return
+        self.running = True
+        self.stop_event.clear()
+        self.retention_thread = threading.Thread(target=self.retention_loop, name="retention", daemon=True)
+        self.retention_thread.start()
+        logging.info(f"数据保留策略已启动 - 原始数据保留 {self.raw_days} 天")
+    
+    def stop(self, timeout=10):
+        """停止保留策略线程"""
+        if not self.running:
+            return
+        self.running = False
+        self.stop_event.set()
+        self.retention_thread.join(timeout=timeout)
+        logging.info("数据保留策略已停止")
+    
+    def retention_loop(self):
+        """保留策略线程主循环"""
+        if not self.database_manager.is_incremental_vacuum_enabled():
+            if self.convert_existing_db:
+                self.database_manager.convert_to_incremental_vacuum()
+            else:
+                logging.warning("数据库未启用增量回收，删除后文件不会缩小 "
+                                "(设置 [RETENTION] convert_existing_db = True 进行一次性转换)")
+        
+        while self.running:
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error(f"执行数据保留策略失败: {e}")
+            self.stop_event.wait(self.check_interval)
+    
+    def run_once(self):
+        """执行一轮过期数据清理，返回 {类别: 删除行数}"""
+        now_ms = int(time.time() * 1000)
+        deleted = {}
+        
+        if self.raw_days > 0:
+            cutoff = now_ms - self.raw_days * 86400000
+            deleted['telemetry'] = self._purge(
+                lambda: self.database_manager.purge_telemetry_chunk(cutoff, self.chunk_size))
+        
+        for resolution in ROLLUP_RESOLUTIONS:
+            days = self.rollup_days.get(resolution, 0)
+            if days > 0:
+                cutoff = now_ms - days * 86400000
+                deleted[f'rollup_{resolution}'] = self._purge(
+                    lambda: self.database_manager.purge_rollup_chunk(resolution, cutoff, self.chunk_size))
+        
+        if self.event_days > 0:
+            for table in ('ad1_data', 'io1_control', 'device_status'):
+                deleted[table] = self._purge(
+                    lambda: self.database_manager.purge_event_chunk(table, self.event_days, self.chunk_size))
+        
+        if any(deleted.values()) and self.vacuum_pages > 0:
+            self._vacuum()
+        
+        if any(deleted.values()):
+            logging.info(f"过期数据清理完成: {deleted}")
+        return deleted
+    
+    def _purge(self, delete_chunk):
+        """循环执行分块删除，直到没有过期数据或线程停止"""
+        total = 0
+        while True:
+            count = delete_chunk()
+            total += count
+            if count < self.chunk_size or self.stop_event.is_set():
+                return total
+            # 让出写锁，避免长时间阻塞入库
+            time.sleep(self.chunk_pause)
+    
+    def _vacuum(self):
+        """分批回收空闲页"""
+        if not self.database_manager.is_incremental_vacuum_enabled():
+            return
+        previous = None
+        while not self.stop_event.is_set():
+            remaining = self.database_manager.incremental_vacuum(self.vacuum_pages)
+            if remaining <= 0 or remaining == previous:
+                break
+            previous = remaining
+            time.sleep(self.chunk_pause)
@@ -0,0 +1,340 @@
+import json
+import time
+import struct
+import logging
+from multiprocessing import shared_memory
+from log_setup import SampledLogger
+
+oversize_log = SampledLogger(logging.WARNING)
+
+class SharedLatestTable:
+    """基于共享内存的最新值表
+
+    多进程部署时，入库进程写入、各Web工作进程只读，接口与 LatestValueCache 相同。
+    共享内存由固定大小的槽位组成，每个 (设备, 通道) 占一个槽位，槽位分配后不再移动；
+    每个槽位带序列号 (seqlock)：写者写入前后各加一，读者发现序列号为奇数或前后不一致时重读，
+    因此读写双方都不需要跨进程锁。只允许一个写进程。
+    """
+
+    MAGIC = b'ESLV'
+    # 头部: 魔数, 槽位容量, 已用槽位数, 全局最近更新的槽位
+    HEADER_FORMAT = '<4sIIi'
+    # 每个通道最近更新的槽位: 通道名, 槽位号
+    CHANNEL_INDEX_FORMAT = '<16si'
+    CHANNEL_INDEX_SIZE = 32
+    # 槽位: 序列号, 设备名, 通道名, 数据时间(毫秒), 更新时间(秒), JSON编码的值
+    SLOT_FORMAT = '<I64s16sqd48s'
+    DEVICE_SIZE = 64
+    CHANNEL_SIZE = 16
+    VALUE_SIZE = 48
+
+    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+    CHANNEL_ENTRY_SIZE = struct.calcsize(CHANNEL_INDEX_FORMAT)
+    SLOTS_OFFSET = HEADER_SIZE + CHANNEL_ENTRY_SIZE * CHANNEL_INDEX_SIZE
+    SLOT_SIZE = struct.calcsize(SLOT_FORMAT)
+
+    def __init__(self, name, capacity=4096, create=False):
+        self.name = name
+        self.create = create
+        if create:
+            size = self.SLOTS_OFFSET + self.SLOT_SIZE * capacity
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                # 上次异常退出残留的共享内存，清除后重建
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self.buf = self.shm.buf
+            self.buf[:self.SLOTS_OFFSET] = bytes(self.SLOTS_OFFSET)
+            struct.pack_into(self.HEADER_FORMAT, self.buf, 0, self.MAGIC, capacity, 0, -1)
+            for index in range(self.CHANNEL_INDEX_SIZE):
+                struct.pack_into(self.CHANNEL_INDEX_FORMAT, self.buf,
+                                 self.HEADER_SIZE + index * self.CHANNEL_ENTRY_SIZE, b'', -1)
+        else:
+            # 附加进程需由创建者通过multiprocessing启动，与创建者共用资源跟踪器，
+            # 退出时不会提前删除共享内存
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.buf = self.shm.buf
+            magic, capacity, _, _ = struct.unpack_from(self.HEADER_FORMAT, self.buf, 0)
+            if magic != self.MAGIC:
+                raise ValueError(f"共享内存 {name} 不是最新值表")
+        self.capacity = capacity
+
+        # 本进程的 (设备, 通道) -> 槽位 索引，读进程按需扫描新增槽位补全
+        self._slots = {}
+        self._scanned = 0
+        self._channel_entries = {}
+        if not create:
+            self._refresh_slots()
+
+    def close(self):
+        """断开共享内存，创建者同时删除共享内存"""
+        self.buf = None
+        self.shm.close()
+        if self.create:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    # ---- 写入 (仅入库进程) ----
+
+    def update(self, device_id, channel, value, ts=None):
+        """更新最新值，ts为数据时间(毫秒)"""
+        now = time.time()
+        if ts is None:
+            ts = int(now * 1000)
+        key = (device_id, channel)
+        slot = self._slots.get(key)
+        if slot is None:
+            # 名称截断后读者无法按原名查到，也可能切断UTF-8字符，超长的名称不写入
+            if (len(device_id.encode('utf-8')) > self.DEVICE_SIZE
+                    or len(channel.encode('utf-8')) > self.CHANNEL_SIZE):
+                oversize_log.log('name', "设备或通道名过长，不写入共享最新值表: %s/%s", device_id, channel)
+                return
+            slot = self._allocate_slot(key)
+            if slot is None:
+                return
+        encoded_value = self.encode_value(value)
+        if encoded_value is None:
+            oversize_log.log('value', "最新值过长，不写入共享最新值表: %s/%s", device_id, channel)
+            return
+
+        offset = self.SLOTS_OFFSET + slot * self.SLOT_SIZE
+        seq = struct.unpack_from('<I', self.buf, offset)[0]
+        struct.pack_into('<I', self.buf, offset, seq + 1)
+        struct.pack_into(self.SLOT_FORMAT, self.buf, offset, seq + 1,
+                         device_id.encode('utf-8')[:64], channel.encode('utf-8')[:16],
+                         int(ts), now, encoded_value)
+        struct.pack_into('<I', self.buf, offset, seq + 2)
+
+        self._set_latest_slot(channel, slot)
+
+    @classmethod
+    def encode_value(cls, value):
+        """值编码为不超过VALUE_SIZE字节的JSON，不能截断JSON
+
+        过长的字符串 (如设备状态) 按字符截断后以 … 结尾，其他类型的值过长时返回None。
+        """
+        encoded = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if len(encoded) <= cls.VALUE_SIZE:
+            return encoded
+        if not isinstance(value, str):
+            return None
+        # 每个字符编码后至少1字节，逐步缩短直到放得下
+        text = value[:cls.VALUE_SIZE]
+        while text:
+            text = text[:-1]
+            encoded = json.dumps(text + '…', ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            if len(encoded) <= cls.VALUE_SIZE:
+                return encoded
+        return None
+
+    def _allocate_slot(self, key):
+        """为新的 (设备, 通道) 分配槽位"""
+        _, capacity, used, _ = struct.unpack_from(self.HEADER_FORMAT, self.buf, 0)
+        if used >= capacity:
+            logging.warning(f"共享最新值表已满 ({capacity} 个槽位)，忽略 {key[0]}/{key[1]}")
+            return None
+        self._slots[key] = used
+        # 先写入槽位键，再增加已用数，读者看到的槽位都已完整
+        offset = self.SLOTS_OFFSET + used * self.SLOT_SIZE
+        struct.pack_into(self.SLOT_FORMAT, self.buf, offset, 0,
+                         key[0].encode('utf-8')[:64], key[1].encode('utf-8')[:16], 0, 0.0, b'null')
+        struct.pack_into('<I', self.buf, 8, used + 1)
+        return used
+
+    def _set_latest_slot(self, channel, slot):
+        """记录全局和该通道最近更新的槽位"""
+        struct.pack_into('<i', self.buf, 12, slot)
+        index = self._channel_entries.get(channel)
+        if index is None:
+            index = self._find_channel_entry(channel, allocate=True)
+            if index is None:
+                return
+            self._channel_entries[channel] = index
+        struct.pack_into(self.CHANNEL_INDEX_FORMAT, self.buf,
+                         self.HEADER_SIZE + index * self.CHANNEL_ENTRY_SIZE,
+                         channel.encode('utf-8')[:16], slot)
+
+    def _find_channel_entry(self, channel, allocate=False):
+        """查找通道索引项的位置"""
+        encoded = channel.encode('utf-8')[:16]
+        for index in range(self.CHANNEL_INDEX_SIZE):
+            name, slot = struct.unpack_from(self.CHANNEL_INDEX_FORMAT, self.buf,
+                                            self.HEADER_SIZE + index * self.CHANNEL_ENTRY_SIZE)
+            name = name.rstrip(b'\0')
+            if name == encoded:
+                return index
+            if not name:
+                return index if allocate else None
+        return None
+
+    # ---- 读取 (任意进程) ----
+
+    def _read_slot(self, slot):
+        """按seqlock协议读取槽位，返回 (设备, 通道, 值, ts, 更新时间)"""
+        offset = self.SLOTS_OFFSET + slot * self.SLOT_SIZE
+        # 写进程若在写入中途退出，序列号会停在奇数，重试有限次后直接返回
+        for _ in range(1000):
+            fields = struct.unpack_from(self.SLOT_FORMAT, self.buf, offset)
+            seq_after = struct.unpack_from('<I', self.buf, offset)[0]
+            if fields[0] % 2 == 0 and fields[0] == seq_after:
+                break
+        _, device, channel, ts, updated, value = fields
+        # 槽位内容异常 (如旧版本写入的截断数据) 时值按None返回，不让读者抛出异常
+        try:
+            decoded = json.loads(value.rstrip(b'\0') or b'null')
+        except ValueError:
+            decoded = None
+        return (device.rstrip(b'\0').decode('utf-8', 'replace'), channel.rstrip(b'\0').decode('utf-8', 'replace'),
+                decoded, ts, updated)
+
+    def _refresh_slots(self):
+        """扫描其他进程新分配的槽位"""
+        used = struct.unpack_from('<I', self.buf, 8)[0]
+        for slot in range(self._scanned, used):
+            device, channel, _, _, _ = self._read_slot(slot)
+            self._slots[(device, channel)] = slot
+        self._scanned = used
+
+    def _to_dict(self, slot, now=None):
+        device_id, channel, value, ts, updated = self._read_slot(slot)
+        if not updated:
+            return None
+        return {
+            'device_id': device_id,
+            'channel': channel,
+            'value': value,
+            'ts': ts,
+            'age': round((now or time.time()) - updated, 3)
+        }
+
+    def get(self, device_id, channel):
+        """获取最新值，不存在时返回None"""
+        slot = self._slots.get((device_id, channel))
+        if slot is None:
+            self._refresh_slots()
+            slot = self._slots.get((device_id, channel))
+            if slot is None:
+                return None
+        return self._to_dict(slot)
+
+    def get_latest(self, channel=None):
+        """获取所有设备中最近更新的一条 (可按通道过滤)"""
+        if channel is None:
+            slot = struct.unpack_from('<i', self.buf, 12)[0]
+        else:
+            index = self._channel_entries.get(channel)
+            if index is None:
+                index = self._find_channel_entry(channel)
+                if index is None:
+                    return None
+                self._channel_entries[channel] = index
+            slot = struct.unpack_from(self.CHANNEL_INDEX_FORMAT, self.buf,
+                                      self.HEADER_SIZE + index * self.CHANNEL_ENTRY_SIZE)[1]
+        if slot < 0:
+            return None
+        return self._to_dict(slot)
+
+    def snapshot(self, max_age=None):
+        """获取所有条目，max_age(秒)用于过滤掉过期条目"""
+        self._refresh_slots()
+        now = time.time()
+        entries = []
+        for slot in range(self._scanned):
+            entry = self._to_dict(slot, now)
+            if entry is not None and (max_age is None or entry['age'] <= max_age):
+                entries.append(entry)
+        return entries
+
+    def changed_since(self, versions):
+        """返回自上次调用以来更新过的条目，versions为调用方保存的 {槽位: 序列号}"""
+        self._refresh_slots()
+        changed = []
+        for slot in range(self._scanned):
+            seq = struct.unpack_from('<I', self.buf, self.SLOTS_OFFSET + slot * self.SLOT_SIZE)[0]
+            if seq % 2 == 0 and seq != versions.get(slot, 0):
+                versions[slot] = seq
+                entry = self._to_dict(slot)
+                if entry is not None:
+                    changed.append(entry)
+        return changed
+
+    def __len__(self):
+        return struct.unpack_from('<I', self.buf, 8)[0]
+
+class SharedSnapshot:
+    """基于共享内存的JSON快照
+
+    多进程部署时由入库进程定期写入 (如入库延迟统计)，Web工作进程读取最近一次写入的内容。
+    与 SharedLatestTable 的槽位相同，用序列号 (seqlock) 保证读者不会读到写了一半的内容。
+    """
+
+    MAGIC = b'ESSS'
+    # 头部: 魔数, 序列号, 数据长度, 写入时间(秒)
+    HEADER_FORMAT = '<4sIId'
+    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+    def __init__(self, name, size=8192, create=False):
+        self.name = name
+        self.create = create
+        if create:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=self.HEADER_SIZE + size)
+            except FileExistsError:
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=self.HEADER_SIZE + size)
+            self.buf = self.shm.buf
+            struct.pack_into(self.HEADER_FORMAT, self.buf, 0, self.MAGIC, 0, 0, 0.0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.buf = self.shm.buf
+            if struct.unpack_from(self.HEADER_FORMAT, self.buf, 0)[0] != self.MAGIC:
+                raise ValueError(f"共享内存 {name} 不是JSON快照")
+        # 附加进程按共享内存的实际大小计算容量
+        self.capacity = self.shm.size - self.HEADER_SIZE
+
+    def close(self):
+        """断开共享内存，创建者同时删除共享内存"""
+        self.buf = None
+        self.shm.close()
+        if self.create:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    def publish(self, data):
+        """写入快照 (仅一个写进程)，编码后超过容量时不写入并返回False"""
+        encoded = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if len(encoded) > self.capacity:
+            oversize_log.log('snapshot', "快照过大，不写入共享内存 %s: %d 字节", self.name, len(encoded))
+            return False
+        seq = struct.unpack_from('<I', self.buf, 4)[0]
+        struct.pack_into('<I', self.buf, 4, seq + 1)
+        self.buf[self.HEADER_SIZE:self.HEADER_SIZE + len(encoded)] = encoded
+        struct.pack_into('<Id', self.buf, 8, len(encoded), time.time())
+        struct.pack_into('<I', self.buf, 4, seq + 2)
+        return True
+
+    def read(self):
+        """读取最近一次写入的快照，返回 (数据, 写入时间)；尚未写入或一直读不到完整内容时返回 (None, None)"""
+        for _ in range(1000):
+            _, seq, length, updated = struct.unpack_from(self.HEADER_FORMAT, self.buf, 0)
+            if seq % 2:
+                continue
+            encoded = bytes(self.buf[self.HEADER_SIZE:self.HEADER_SIZE + length])
+            if struct.unpack_from('<I', self.buf, 4)[0] != seq:
+                continue
+            if not updated:
+                return None, None
+            try:
+                return json.loads(encoded), updated
+            except ValueError:
+                return None, None
+        return None, None
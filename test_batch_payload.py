@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量采样负载校验测试
+带values的负载按批量采样处理: values不能为空，deltas必须与values等长，否则解码时拒绝；
+缺少base_ts的批量采样照常入库，但不记录设备采样时间 (device_ts为NULL)。
+同时检查 paho 入口 (MQTTClient) 和 asyncio 入口 (AsyncIngestEngine)。
+不需要MQTT代理，直接运行: python test_batch_payload.py
+"""
+
+import os
+import sys
+import json
+import tempfile
+
+from database import DatabaseManager
+from mqtt_client import MQTTClient
+from async_ingest import AsyncIngestEngine
+from payload_codec import decode_payload, PayloadError
+
+MALFORMED = [
+    ('同时带value和values、缺少deltas', {"value": 1, "values": [1, 2]}),
+    ('values与deltas长度不一致', {"values": [1, 2, 3], "deltas": [0, 100], "base_ts": 0}),
+    ('values为空', {"values": [], "deltas": [], "base_ts": 0}),
+    ('缺少deltas', {"values": [1, 2], "base_ts": 0}),
+]
+NO_BASE_TS = {"values": [10, 20, 30], "deltas": [0, 100, 100]}
+
+def check_rejected():
+    ok = True
+    for name, payload in MALFORMED:
+        try:
+            decode_payload('telemetry', json.dumps(payload).encode('utf-8'))
+            print(f"❌ {name}: 未被拒绝")
+            ok = False
+        except PayloadError as e:
+            print(f"✅ {name}: 已拒绝 ({e})")
+    return ok
+
+def stored_rows(database_manager, device_id):
+    with database_manager.connection() as conn:
+        return conn.execute('''
+            SELECT t.value, t.device_ts FROM telemetry t JOIN devices d ON t.device = d.id
+            WHERE d.name = ? ORDER BY t.ts
+        ''', (device_id,)).fetchall()
+
+def check_no_base_ts(database_manager):
+    payload = json.dumps(NO_BASE_TS).encode('utf-8')
+    ok = True
+
+    mqtt_client = MQTTClient('config.ini', database_manager)
+    mqtt_client.handle_ad1_data(payload, 'batch_paho', 'AD1')
+
+    engine = AsyncIngestEngine('config.ini', database_manager)
+    item = engine.router.dispatch('esp32/batch_async/AD1/data', payload)
+    engine.executor.shutdown()
+    if item is not None:
+        database_manager.save_batch({item[0]: item[1]})
+
+    for device_id in ('batch_paho', 'batch_async'):
+        rows = stored_rows(database_manager, device_id)
+        values = [value for value, _ in rows]
+        passed = values == NO_BASE_TS['values'] and all(device_ts is None for _, device_ts in rows)
+        print(f"{'✅' if passed else '❌'} 缺少base_ts ({device_id}): 入库 {values}，"
+              f"device_ts {[device_ts for _, device_ts in rows]}")
+        ok = ok and passed
+    return ok
+
+def main():
+    temp_dir = tempfile.mkdtemp()
+    database_manager = DatabaseManager(os.path.join(temp_dir, 'batch.db'))
+    database_manager.init_database()
+    ok = check_rejected()
+    ok = check_no_base_ts(database_manager) and ok
+    database_manager.close()
+    print("✅ 批量采样负载校验测试通过" if ok else "❌ 批量采样负载校验测试失败")
+    return ok
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
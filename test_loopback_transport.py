@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程内MQTT代理测试 ([MQTT] transport = loopback)
+ESP32模拟器、入库客户端和写后队列在同一进程内通过 loopback_broker 通信，
+验证 模拟器 -> 入库 -> 数据库 的数据路径和 IO1控制命令 -> 模拟器 的控制路径，
+并测量发布到入库回调的延迟。不需要MQTT代理和网络，直接运行: python test_loopback_transport.py
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+import configparser
+
+from database import DatabaseManager
+from ingest_writer import IngestWriter
+from mqtt_client import MQTTClient
+from esp32_simulator import ESP32Simulator
+from loopback_broker import LoopbackClient
+
+LATENCY_MESSAGES = 2000
+
+def write_config(path, db_path):
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    config['MQTT']['transport'] = 'loopback'
+    config['DATABASE']['db_path'] = db_path
+    # 批量采样模式: 100Hz，每条消息10个采样
+    config['ESP32_SIMULATOR']['sample_rate'] = '100'
+    config['ESP32_SIMULATOR']['batch_samples'] = '10'
+    with open(path, 'w', encoding='utf-8') as f:
+        config.write(f)
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return condition()
+
+def measure_latency(config):
+    """发布 -> 订阅者on_message 的单程延迟 (微秒)"""
+    host, port = config['MQTT']['broker'], config.getint('MQTT', 'port')
+    received = []
+    done = threading.Event()
+
+    def on_message(client, userdata, msg):
+        received.append(time.perf_counter() - float(msg.payload))
+        if len(received) == LATENCY_MESSAGES:
+            done.set()
+
+    subscriber = LoopbackClient(client_id="latency_subscriber")
+    subscriber.on_connect = lambda client, userdata, flags, rc: client.subscribe('loopback_test/latency')
+    subscriber.on_message = on_message
+    subscriber.connect(host, port)
+    subscriber.loop_start()
+    publisher = LoopbackClient(client_id="latency_publisher")
+    publisher.connect(host, port)
+    publisher.loop_start()
+    wait_for(lambda: subscriber.is_connected() and publisher.is_connected())
+    for _ in range(LATENCY_MESSAGES):
+        publisher.publish('loopback_test/latency', repr(time.perf_counter()))
+        time.sleep(0.0002)
+    done.wait(5)
+    for client in (publisher, subscriber):
+        client.disconnect()
+        client.loop_stop()
+    samples = sorted(received)
+    if not samples:
+        return None
+    return samples[len(samples) // 2] * 1e6, samples[int(len(samples) * 0.99)] * 1e6
+
+def main():
+    temp_dir = tempfile.mkdtemp()
+    config_file = os.path.join(temp_dir, 'config.ini')
+    db_path = os.path.join(temp_dir, 'loopback.db')
+    write_config(config_file, db_path)
+    config = configparser.ConfigParser()
+    config.read(config_file)
+
+    database_manager = DatabaseManager(db_path)
+    database_manager.init_database()
+    ingest_writer = IngestWriter(database_manager, batch_size=100, flush_interval=0.1)
+    mqtt_client = MQTTClient(config_file, database_manager, ingest_writer)
+    simulator = ESP32Simulator(config_file)
+
+    ingest_writer.start()
+    mqtt_client.connect()
+    simulator.connect()
+    connected = wait_for(lambda: mqtt_client.connected and simulator.connected)
+    print(f"入库客户端: {'已连接' if mqtt_client.get_connection_status() else '未连接'}, "
+          f"模拟器: {'已连接' if simulator.connected else '未连接'}")
+
+    time.sleep(1.5)
+    mqtt_client.publish_io1_control(True)
+    control_ok = wait_for(lambda: simulator.io1_state is True)
+    print(f"IO1控制命令: {'已送达模拟器' if control_ok else '未送达'}")
+
+    simulator.disconnect()
+    time.sleep(0.2)
+    mqtt_client.disconnect()
+    ingest_writer.stop()
+    rows, _ = database_manager.get_telemetry_page('esp32_simulator', 'AD1', limit=10000)
+    database_manager.close()
+    print(f"收到消息: {mqtt_client.messages_received}，入库采样: {len(rows)}")
+
+    latency = measure_latency(config)
+    if latency:
+        print(f"发布 -> on_message 延迟: p50 {latency[0]:.0f}us, p99 {latency[1]:.0f}us")
+
+    ok = connected and control_ok and len(rows) >= 50 and latency is not None
+    print("✅ 进程内代理测试通过" if ok else "❌ 进程内代理测试失败")
+    return ok
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
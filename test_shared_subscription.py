@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享订阅测试
+在本机启动一个最小的MQTT代理替身 (支持MQTT 3.1.1/5 和 $share 共享订阅)，
+启动多个使用同一共享订阅组的 MQTTClient 入库进程，发布一批遥测消息，
+验证消息被分摊到各个进程、每条消息只入库一次。
+同样的检查再用进程内代理 ([MQTT] transport = loopback，见 loopback_broker) 运行一遍。
+不需要外部MQTT代理，直接运行: python test_shared_subscription.py [tcp|loopback]
+"""
+
+import os
+import sys
+import time
+import json
+import struct
+import asyncio
+import tempfile
+import threading
+import configparser
+import paho.mqtt.client as mqtt
+
+from database import DatabaseManager
+from mqtt_client import MQTTClient
+from loopback_broker import LoopbackClient, topic_matches
+
+WORKERS = 3
+MESSAGES = 300
+DEVICES = 5
+
+class BrokerStandIn:
+    """最小MQTT代理替身：CONNECT/SUBSCRIBE/PUBLISH(QoS0)/PING/DISCONNECT，共享订阅按轮询投递"""
+
+    def __init__(self):
+        self.sessions = {}           # writer -> 协议版本
+        self.subscriptions = []      # (过滤器, writer)
+        self.shared = {}             # (组, 过滤器) -> [writer, ...]
+        self.round_robin = {}        # (组, 过滤器) -> 下一个成员序号
+        self.loop = None
+        self.port = None
+        self.ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=asyncio.run, args=(self.serve(),), daemon=True).start()
+        self.ready.wait(5)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle_client, '127.0.0.1', 0)
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        async with server:
+            await server.serve_forever()
+
+    @staticmethod
+    async def read_varint(reader):
+        value, multiplier = 0, 1
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            value += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                return value
+            multiplier *= 128
+
+    @staticmethod
+    def encode_varint(value):
+        encoded = bytearray()
+        while True:
+            byte = value % 128
+            value //= 128
+            encoded.append(byte | 0x80 if value else byte)
+            if not value:
+                return bytes(encoded)
+
+    @staticmethod
+    def skip_properties(body, offset):
+        length, multiplier = 0, 1
+        while True:
+            byte = body[offset]
+            offset += 1
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                return offset + length
+            multiplier *= 128
+
+    def send(self, writer, packet_type, body):
+        writer.write(bytes([packet_type]) + self.encode_varint(len(body)) + body)
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                header = (await reader.readexactly(1))[0]
+                body = await reader.readexactly(await self.read_varint(reader))
+                packet_type = header & 0xF0
+                if packet_type == 0x10:
+                    version = body[6]
+                    self.sessions[writer] = version
+                    self.send(writer, 0x20, b'\x00\x00\x00' if version == 5 else b'\x00\x00')
+                elif packet_type == 0x80:
+                    self.subscribe(writer, body)
+                elif packet_type == 0x30:
+                    self.publish(header, body, self.sessions[writer])
+                elif packet_type == 0xC0:
+                    self.send(writer, 0xD0, b'')
+                elif packet_type == 0xE0:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.remove(writer)
+            writer.close()
+
+    def subscribe(self, writer, body):
+        version = self.sessions[writer]
+        packet_id = body[:2]
+        offset = self.skip_properties(body, 2) if version == 5 else 2
+        codes = b''
+        while offset < len(body):
+            length = struct.unpack_from('!H', body, offset)[0]
+            topic_filter = body[offset + 2:offset + 2 + length].decode('utf-8')
+            offset += 3 + length
+            if topic_filter.startswith('$share/'):
+                _, group, real_filter = topic_filter.split('/', 2)
+                self.shared.setdefault((group, real_filter), []).append(writer)
+            else:
+                self.subscriptions.append((topic_filter, writer))
+            codes += b'\x00'
+        self.send(writer, 0x90, packet_id + (b'\x00' if version == 5 else b'') + codes)
+
+    def publish(self, header, body, version):
+        length = struct.unpack_from('!H', body, 0)[0]
+        topic = body[2:2 + length].decode('utf-8')
+        offset = 2 + length
+        if version == 5:
+            offset = self.skip_properties(body, offset)
+        payload = body[offset:]
+        targets = [writer for topic_filter, writer in self.subscriptions if topic_matches(topic_filter, topic)]
+        for key, members in self.shared.items():
+            if members and topic_matches(key[1], topic):
+                index = self.round_robin.get(key, 0) % len(members)
+                self.round_robin[key] = index + 1
+                targets.append(members[index])
+        for target in targets:
+            topic_field = struct.pack('!H', length) + topic.encode('utf-8')
+            properties = b'\x00' if self.sessions.get(target) == 5 else b''
+            self.send(target, 0x30, topic_field + properties + payload)
+
+    def remove(self, writer):
+        self.sessions.pop(writer, None)
+        self.subscriptions = [(f, w) for f, w in self.subscriptions if w is not writer]
+        for members in self.shared.values():
+            if writer in members:
+                members.remove(writer)
+
+def write_config(path, port, db_path, transport):
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    config['MQTT']['broker'] = '127.0.0.1'
+    config['MQTT']['port'] = str(port)
+    config['MQTT']['transport'] = transport
+    config['MQTT']['protocol'] = '5'
+    config['MQTT']['shared_group'] = 'ingest'
+    config['DATABASE']['db_path'] = db_path
+    with open(path, 'w', encoding='utf-8') as f:
+        config.write(f)
+
+def run(transport):
+    if transport == 'loopback':
+        port = 1883
+        print("使用进程内MQTT代理 (transport = loopback)")
+    else:
+        broker = BrokerStandIn()
+        broker.start()
+        port = broker.port
+        print(f"MQTT代理替身已启动: 127.0.0.1:{port}")
+
+    temp_dir = tempfile.mkdtemp()
+    config_file = os.path.join(temp_dir, 'config.ini')
+    db_path = os.path.join(temp_dir, 'shared.db')
+    write_config(config_file, port, db_path, transport)
+
+    database_manager = DatabaseManager(db_path)
+    workers = []
+    for index in range(WORKERS):
+        worker = MQTTClient(config_file, database_manager, worker_id=f"w{index}")
+        worker.connect()
+        workers.append(worker)
+    print(f"已启动 {WORKERS} 个入库进程: {[w.client_id for w in workers]}")
+    time.sleep(0.5)
+
+    if transport == 'loopback':
+        publisher = LoopbackClient(client_id="shared_test_publisher", protocol=mqtt.MQTTv5)
+    else:
+        publisher = mqtt.Client(client_id="shared_test_publisher", protocol=mqtt.MQTTv5)
+    publisher.connect('127.0.0.1', port)
+    publisher.loop_start()
+    time.sleep(0.3)
+    for i in range(MESSAGES):
+        payload = json.dumps({'value': i})
+        publisher.publish(f"esp32/dev{i % DEVICES}/AD1/data", payload)
+    time.sleep(2)
+    publisher.loop_stop()
+    publisher.disconnect()
+
+    received = [w.messages_received for w in workers]
+    stored = []
+    for device in range(DEVICES):
+        rows, _ = database_manager.get_telemetry_page(f"dev{device}", 'AD1', limit=1000)
+        stored.extend(int(value) for _, _, value in rows)
+    for worker in workers:
+        worker.disconnect()
+    database_manager.close()
+
+    print(f"各入库进程收到的消息数: {received}")
+    print(f"入库行数: {len(stored)}，不重复的值: {len(set(stored))}")
+    # 每个入库进程上线时发布的 online 状态也经共享订阅只投递一次
+    ok = (sum(received) == MESSAGES + WORKERS and all(received)
+          and len(stored) == MESSAGES and sorted(stored) == list(range(MESSAGES)))
+    print(f"✅ 共享订阅测试通过 ({transport})：消息已分摊且没有重复" if ok else f"❌ 共享订阅测试失败 ({transport})")
+    return ok
+
+def main():
+    transports = sys.argv[1:] or ['tcp', 'loopback']
+    results = [run(transport) for transport in transports]
+    return all(results)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
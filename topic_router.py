@@ -0,0 +1,144 @@
+import logging
+import metrics
+
+unmatched_messages = metrics.messages_received.labels('unmatched')
+
+class TopicRoute:
+    """一条编译后的路由：订阅模式 + 处理函数"""
+
+    def __init__(self, pattern, handler, name=None):
+        self.pattern = pattern
+        self.handler = handler
+        self.name = name or pattern
+        # 模式中的 {参数} 按位置记录，匹配时从主题层级中直接取值
+        self.params = []
+        levels = pattern.split('/')
+        for index, level in enumerate(levels):
+            if level.startswith('{') and level.endswith('}'):
+                self.params.append((index, level[1:-1]))
+            elif level == '#' and index != len(levels) - 1:
+                raise ValueError(f"主题模式中 # 只能位于最后一级: {pattern}")
+        self.levels = levels
+        # 对应的MQTT订阅过滤器: {参数} 替换为 +
+        self.subscription = '/'.join('+' if level.startswith('{') and level.endswith('}') else level
+                                     for level in levels)
+        # 按路由名计数收到的消息
+        self.received = metrics.messages_received.labels(self.name)
+
+    def extract(self, levels):
+        """从已拆分的主题层级中取出参数"""
+        return {name: levels[index] for index, name in self.params}
+
+class _TrieNode:
+    __slots__ = ('children', 'wildcard', 'multi', 'route')
+
+    def __init__(self):
+        self.children = {}
+        self.wildcard = None
+        self.multi = None
+        self.route = None
+
+class TopicRouter:
+    """MQTT主题路由器
+
+    订阅模式在 add_route 时编译进按主题层级组织的前缀树，支持:
+      esp32/ad1/data                 精确主题
+      esp32/{device_id}/{channel}/data  单级通配并提取参数 (订阅时为 +)
+      esp32/+/status                 单级通配，不提取参数
+      esp32/#                        多级通配
+    匹配优先级为 精确 > 单级通配 > 多级通配。每条消息只做一次 split 和逐级字典查找，
+    不使用正则；已出现过的主题结果缓存在字典中，设备数量有限时绝大多数消息只需一次字典查找。
+    """
+
+    def __init__(self, cache_size=10000):
+        self.root = _TrieNode()
+        self.routes = []
+        self.cache_size = cache_size
+        self._cache = {}
+
+    def add_route(self, pattern, handler, name=None):
+        """添加路由，handler 调用方式为 handler(payload, **参数)"""
+        route = TopicRoute(pattern, handler, name)
+        node = self.root
+        for level in route.levels:
+            if level == '#':
+                if node.multi is None:
+                    node.multi = _TrieNode()
+                node = node.multi
+                break
+            if level == '+' or (level.startswith('{') and level.endswith('}')):
+                if node.wildcard is None:
+                    node.wildcard = _TrieNode()
+                node = node.wildcard
+            else:
+                node = node.children.setdefault(level, _TrieNode())
+        if node.route is not None:
+            logging.warning(f"主题模式 {pattern} 与 {node.route.pattern} 重复，后添加的生效")
+        node.route = route
+        self.routes.append(route)
+        self._cache.clear()
+        return route
+
+    def subscriptions(self):
+        """需要向MQTT代理订阅的主题过滤器 (去重，保持添加顺序)"""
+        return list(dict.fromkeys(route.subscription for route in self.routes))
+
+    def _match_node(self, node, levels, index):
+        if index == len(levels):
+            if node.route is not None:
+                return node.route
+            # "a/#" 同时匹配 "a"
+            return node.multi.route if node.multi is not None else None
+        child = node.children.get(levels[index])
+        if child is not None:
+            route = self._match_node(child, levels, index + 1)
+            if route is not None:
+                return route
+        if node.wildcard is not None:
+            route = self._match_node(node.wildcard, levels, index + 1)
+            if route is not None:
+                return route
+        if node.multi is not None:
+            return node.multi.route
+        return None
+
+    def match(self, topic):
+        """匹配主题，返回 (路由, 参数) ，没有匹配时返回 None"""
+        try:
+            return self._cache[topic]
+        except KeyError:
+            pass
+        levels = topic.split('/')
+        route = self._match_node(self.root, levels, 0)
+        result = (route, route.extract(levels)) if route is not None else None
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[topic] = result
+        return result
+
+    def dispatch(self, topic, payload):
+        """把消息分发给匹配的处理函数，返回处理函数的返回值；没有匹配的路由时返回 None"""
+        matched = self.match(topic)
+        if matched is None:
+            unmatched_messages.inc()
+            logging.debug("没有匹配的主题路由: %s", topic)
+            return None
+        route, params = matched
+        route.received.inc()
+        return route.handler(payload, **params)
+
+def shared_subscription(topic_filter, group):
+    """共享订阅过滤器 $share/<组>/<主题>，group为空时原样返回"""
+    return f"$share/{group}/{topic_filter}" if group else topic_filter
+
+def router_from_config(config, handlers):
+    """按配置文件 [TOPICS] 节创建路由器
+
+    handlers: {配置项名: 处理函数}，如 {'ad1_data': ..., 'telemetry': ...}，配置中不存在的项被忽略
+    """
+    router = TopicRouter()
+    for option, handler in handlers.items():
+        pattern = config.get('TOPICS', option, fallback='')
+        if pattern:
+            router.add_route(pattern, handler, name=option)
+    return router
@@ -1,19 +1,59 @@
-from flask import Flask, send_from_directory
+from flask import Flask, Response, send_from_directory, jsonify, request, g
 from flask_cors import CORS
 import configparser
 import logging
+import json
+import time
+import metrics
+from latency_tracker import latency_tracker
+from datetime import datetime
+from database import DEFAULT_CHANNEL, MAX_PAGE_SIZE
+
+# orjson为可选依赖，安装后历史数据序列化更快
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_response(payload, status=200):
+    """紧凑JSON响应 (不排序键、不缩进)"""
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+    return Response(body, status=status, mimetype='application/json')
+
+def format_ts(ts):
+    """毫秒时间戳转ISO格式字符串"""
+    return datetime.fromtimestamp(ts / 1000).isoformat(timespec='seconds')
 
 class WebServer:
-    def __init__(self, config_file, database_manager, mqtt_client):
+    def __init__(self, config_file, database_manager, mqtt_client, latest_cache=None, broadcaster=None,
+                 latency_snapshot=None):
         self.config = configparser.ConfigParser()
         self.config.read(config_file)
-        
+        self.database_manager = database_manager
+        self.mqtt_client = mqtt_client
+        # 最新值缓存，默认使用MQTT客户端维护的缓存
+        if latest_cache is None and mqtt_client is not None:
+            latest_cache = mqtt_client.latest_cache
+        self.latest_cache = latest_cache
+        # 实时推送，默认使用MQTT客户端的推送器
+        if broadcaster is None and mqtt_client is not None:
+            broadcaster = mqtt_client.broadcaster
+        self.broadcaster = broadcaster
+        # 多进程部署时入库延迟由入库进程统计，经共享内存快照读取
+        self.latency_snapshot = latency_snapshot
+        self.stream_keepalive = self.config.getint('WEB_SERVER', 'stream_keepalive', fallback=15)
+        self.stream_client_limit = self.stream_limit()
+
         # 获取端口配置
         self.port = self.config.getint('WEB_SERVER', 'port')
-        
+
         # 创建Flask应用
         self.app = Flask(__name__, static_folder='static')
-        
+        self.app.json.sort_keys = False
+
         # CORS配置
         CORS(self.app, resources={
             r"/*": {"origins": "*"}
@@ -23,19 +63,356 @@ class WebServer:
         @self.app.route('/')
         def index():
             return send_from_directory('static', 'web_accessible.html')
-            
+
         @self.app.route('/web_accessible.html')
         def serve_html():
             return send_from_directory('static', 'web_accessible.html')
-            
+
         @self.app.route('/static/<path:filename>')
         def static_files(filename):
             return send_from_directory('static', filename)
 
-        # 其他原有API路由保持不变...
-        # [保留原有的API路由代码]
+        self.register_api_routes()
+        self.register_history_routes()
+        self.register_stream_routes()
+        if self.config.getboolean('WEB_SERVER', 'metrics', fallback=True):
+            self.register_metrics_routes()
+
+    def register_api_routes(self):
+        """系统状态、当前值和IO1控制API
+
+        当前值接口只读取最新值缓存，不访问数据库。
+        """
+        @self.app.route('/api/test')
+        def test_api():
+            return jsonify({
+                'success': True,
+                'message': 'API服务运行正常',
+                'timestamp': datetime.now().isoformat()
+            })
+
+        @self.app.route('/api/status')
+        def system_status():
+            return jsonify({
+                'success': True,
+                'data': {
+                    'system_status': 'running',
+                    'mqtt_connected': self.mqtt_connected(),
+                    'io1_current_state': self.current_io1_state(),
+                    'device_status': self.latest_value(channel='status'),
+                    'last_update': datetime.now().isoformat()
+                }
+            })
+
+        @self.app.route('/api/mqtt/status')
+        def mqtt_status():
+            return jsonify({
+                'success': True,
+                'data': {
+                    'connected': self.mqtt_connected(),
+                    'broker': f"{self.mqtt_client.broker}:{self.mqtt_client.port}" if self.mqtt_client else None
+                }
+            })
+
+        @self.app.route('/api/latest')
+        def latest_values():
+            # max_age(秒): 只返回最近更新过的条目
+            return jsonify({
+                'success': True,
+                'data': self.latest_cache.snapshot(request.args.get('max_age', type=float)) if self.latest_cache else []
+            })
+
+        @self.app.route('/api/latency')
+        def ingest_latency():
+            # 最近一个统计窗口内各阶段延迟的分位数 (毫秒)
+            if self.latency_snapshot is None:
+                return jsonify({'success': True, 'data': latency_tracker.snapshot()})
+            data, updated = self.latency_snapshot.read()
+            if data is None:
+                return jsonify({'success': False, 'message': '入库进程尚未发布延迟统计'}), 503
+            # age: 快照距离入库进程写入的秒数
+            data['age'] = round(time.time() - updated, 3)
+            return jsonify({'success': True, 'data': data})
+
+        @self.app.route('/api/ad1')
+        def ad1_value():
+            latest = self.latest_ad1()
+            if latest is None:
+                return jsonify({'success': False, 'error': '暂无AD1数据'}), 404
+            return jsonify({
+                'success': True,
+                'value': latest['value'],
+                'timestamp': format_ts(latest['ts']),
+                'age': latest['age']
+            })
+
+        @self.app.route('/api/ad1/current')
+        def ad1_current():
+            latest = self.latest_ad1()
+            if latest is None:
+                return jsonify({'success': False, 'error': '暂无AD1数据'}), 404
+            return jsonify({
+                'success': True,
+                'data': dict(latest, timestamp=format_ts(latest['ts']))
+            })
+
+        @self.app.route('/api/ad1/data')
+        def ad1_data():
+            limit = max(1, min(request.args.get('limit', default=50, type=int), MAX_PAGE_SIZE))
+            rows = self.database_manager.get_latest_ad1_data(limit)
+            # format=columns 返回列式数组，数据量大时体积更小
+            if request.args.get('format') == 'columns':
+                return json_response({
+                    'success': True,
+                    'data': {
+                        'value': [value for value, _ in rows],
+                        'timestamp': [timestamp for _, timestamp in rows]
+                    }
+                })
+            return json_response({
+                'success': True,
+                'data': [{'value': value, 'timestamp': timestamp} for value, timestamp in rows]
+            })
+
+        @self.app.route('/api/io1/current')
+        def io1_current():
+            return jsonify({
+                'success': True,
+                'data': {'state': self.current_io1_state()}
+            })
+
+        @self.app.route('/api/io1/control', methods=['GET', 'POST'])
+        def io1_control():
+            if request.method == 'GET':
+                limit = max(1, min(request.args.get('limit', default=50, type=int), MAX_PAGE_SIZE))
+                rows = self.database_manager.get_latest_io1_control(limit)
+                return json_response({
+                    'success': True,
+                    'data': [{'state': bool(state), 'timestamp': timestamp} for state, timestamp in rows]
+                })
+
+            data = request.get_json(silent=True) or {}
+            if 'state' not in data:
+                return jsonify({'success': False, 'error': '缺少state字段'}), 400
+            # 只接受JSON布尔值，字符串 "false" 等不做转换
+            if not isinstance(data['state'], bool):
+                return jsonify({'success': False, 'error': 'state必须为布尔值 true/false'}), 400
+            return self.set_io1_state(data['state'])
+
+        @self.app.route('/api/io1/toggle', methods=['POST'])
+        def io1_toggle():
+            return self.set_io1_state(not self.current_io1_state())
+
+        @self.app.route('/api/devices')
+        def devices():
+            return jsonify({
+                'success': True,
+                'data': self.database_manager.get_devices()
+            })
+
+        @self.app.route('/api/telemetry/<device_id>/<channel>/rollup')
+        def telemetry_rollup(device_id, channel):
+            since = request.args.get('since', type=int)
+            until = request.args.get('until', type=int)
+            if since is None or until is None:
+                return jsonify({'success': False, 'error': '缺少since/until参数'}), 400
+            resolution, rows = self.database_manager.query_telemetry_rollup(
+                device_id, channel, since, until,
+                max_points=request.args.get('max_points', default=500, type=int)
+            )
+            # 列式返回: 每个字段一个数组
+            columns = list(zip(*rows)) if rows else [(), (), (), (), ()]
+            return json_response({
+                'success': True,
+                'resolution': resolution,
+                'data': dict(zip(('bucket', 'min', 'max', 'avg', 'count'), map(list, columns)))
+            })
+
+    def mqtt_connected(self):
+        """MQTT连接状态"""
+        return self.mqtt_client.get_connection_status() if self.mqtt_client else False
+
+    def current_io1_state(self):
+        """当前IO1状态，优先读取最新值缓存"""
+        latest = self.latest_value(channel='IO1')
+        if latest is not None:
+            return bool(latest['value'])
+        return bool(self.mqtt_client.get_current_io1_state()) if self.mqtt_client else False
+
+    def latest_value(self, device_id=None, channel=DEFAULT_CHANNEL):
+        """从缓存获取最新值，未指定设备时取最近更新的设备"""
+        if self.latest_cache is None:
+            return None
+        if device_id:
+            return self.latest_cache.get(device_id, channel)
+        return self.latest_cache.get_latest(channel)
+
+    def latest_ad1(self):
+        """最新AD1值，可用 ?device_id=&channel= 指定设备和通道"""
+        return self.latest_value(request.args.get('device_id'), request.args.get('channel', DEFAULT_CHANNEL))
+
+    def set_io1_state(self, state):
+        """通过MQTT下发IO1控制命令"""
+        if not self.mqtt_client or not self.mqtt_client.publish_io1_control(state):
+            return jsonify({'success': False, 'error': 'MQTT未连接，控制命令发送失败'}), 503
+        return jsonify({
+            'success': True,
+            'new_state': state,
+            'message': f'IO1状态已设置为 {state}'
+        })
+
+    def register_history_routes(self):
+        """历史数据分页查询API
+
+        通用参数: since/until (时间范围), cursor (上一页返回的next_cursor),
+        limit (每页条数), order (desc/asc)
+        """
+        @self.app.route('/api/telemetry/<device_id>/<channel>/history')
+        def telemetry_history(device_id, channel):
+            try:
+                rows, next_cursor = self.database_manager.get_telemetry_page(
+                    device_id, channel,
+                    since=request.args.get('since', type=int),
+                    until=request.args.get('until', type=int),
+                    cursor=request.args.get('cursor'),
+                    limit=request.args.get('limit', default=100, type=int),
+                    ascending=request.args.get('order', 'desc') == 'asc'
+                )
+                return json_response({
+                    'success': True,
+                    'data': [{'ts': ts, 'value': value} for _, ts, value in rows],
+                    'next_cursor': next_cursor
+                })
+            except ValueError as e:
+                return jsonify({'success': False, 'error': f'参数错误: {e}'}), 400
+
+        @self.app.route('/api/ad1/history')
+        def ad1_history():
+            return telemetry_history(request.args.get('device_id', self.default_device_id()),
+                                     request.args.get('channel', DEFAULT_CHANNEL))
+
+        @self.app.route('/api/io1/history')
+        def io1_history():
+            return self.event_history('io1_control', 'state')
+
+        @self.app.route('/api/status/history')
+        def status_history():
+            return self.event_history('device_status', 'status')
+
+    def register_stream_routes(self):
+        """实时推送API (Server-Sent Events)，浏览器用 EventSource 订阅"""
+        @self.app.route('/api/stream')
+        def live_stream():
+            if self.broadcaster is None:
+                return jsonify({'success': False, 'error': '实时推送未启用'}), 404
+            # ?device_id= 只接收指定设备的事件
+            subscriber = self.broadcaster.subscribe(request.args.get('device_id'), self.stream_client_limit)
+            if subscriber is None:
+                return jsonify({'success': False, 'error': '实时推送客户端数已达上限'}), 503
+            return Response(
+                self.broadcaster.stream(subscriber, self.stream_keepalive),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+
+        @self.app.route('/api/stream/stats')
+        def live_stream_stats():
+            if self.broadcaster is None:
+                return jsonify({'success': False, 'error': '实时推送未启用'}), 404
+            return jsonify({'success': True, 'data': self.broadcaster.get_stats()})
+
+    def stream_limit(self):
+        """本进程允许的实时推送客户端数
+
+        waitress 中每个打开的 /api/stream 连接一直占用一个工作线程，推送客户端数达到线程数时
+        其他API请求只能排队，整个REST接口失去响应。因此保留 stream_reserved_threads 个线程给普通请求，
+        推送客户端数不超过 threads - stream_reserved_threads；开发服务器每个请求一个线程，不受此限制。
+        """
+        max_clients = self.config.getint('WEB_SERVER', 'stream_max_clients', fallback=16)
+        if self.config.get('WEB_SERVER', 'server', fallback='dev').lower() != 'waitress':
+            return max_clients
+        threads = self.config.getint('WEB_SERVER', 'threads', fallback=8)
+        reserved = self.config.getint('WEB_SERVER', 'stream_reserved_threads', fallback=max(2, threads // 4))
+        limit = max(0, threads - max(1, reserved))
+        if max_clients > limit:
+            logging.warning(f"stream_max_clients = {max_clients} 过大: waitress 共 {threads} 个线程，"
+                            f"保留 {max(1, reserved)} 个给普通请求，实时推送客户端上限降为 {limit}")
+            return limit
+        return max_clients
+
+    def register_metrics_routes(self):
+        """Prometheus指标 (/metrics)，并按路由记录每个HTTP请求的处理耗时"""
+        @self.app.before_request
+        def start_timer():
+            g.request_start = time.perf_counter()
+
+        @self.app.after_request
+        def record_latency(response):
+            start = g.pop('request_start', None)
+            if start is not None:
+                # 按路由模式而不是实际路径分类，避免设备名等参数产生大量标签
+                rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+                metrics.http_request_seconds.labels(request.method, rule, response.status_code).observe(
+                    time.perf_counter() - start)
+            return response
+
+        @self.app.route('/metrics')
+        def prometheus_metrics():
+            return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+    def default_device_id(self):
+        """未指定设备时使用的设备名"""
+        return self.config.get('WEB_SERVER', 'default_device_id', fallback='esp32_simulator')
+
+    def event_history(self, table, value_name):
+        """事件表分页查询"""
+        try:
+            rows, next_cursor = self.database_manager.get_event_page(
+                table,
+                since=request.args.get('since'),
+                until=request.args.get('until'),
+                cursor=request.args.get('cursor'),
+                limit=request.args.get('limit', default=50, type=int),
+                ascending=request.args.get('order', 'desc') == 'asc'
+            )
+            return json_response({
+                'success': True,
+                'data': [{value_name: value, 'timestamp': timestamp} for _, value, timestamp in rows],
+                'next_cursor': next_cursor
+            })
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'参数错误: {e}'}), 400
+
+    def start(self, listen_socket=None):
+        """启动Web服务器
+
+        [WEB_SERVER] server = waitress 使用多线程生产级WSGI服务器，
+        server = dev 使用Flask自带的开发服务器。
+        listen_socket为已监听的套接字 (多进程共享端口时使用，仅waitress支持)。
+        """
+        host = self.config.get('WEB_SERVER', 'host')
+        port = self.port
+        server = self.config.get('WEB_SERVER', 'server', fallback='dev').lower()
+
+        if server == 'waitress':
+            try:
+                from waitress import serve
+            except ImportError:
+                logging.warning("未安装waitress，回退到Flask开发服务器 (pip install waitress)")
+            else:
+                threads = self.config.getint('WEB_SERVER', 'threads', fallback=8)
+                logging.info(f"Web服务器以waitress模式启动: {host}:{port}, 线程数 {threads}")
+                if listen_socket is not None:
+                    listen = {'sockets': [listen_socket]}
+                else:
+                    listen = {'host': host, 'port': port}
+                serve(self.app, **listen,
+                      threads=threads,
+                      backlog=self.config.getint('WEB_SERVER', 'backlog', fallback=1024),
+                      connection_limit=self.config.getint('WEB_SERVER', 'connection_limit', fallback=1000),
+                      channel_timeout=self.config.getint('WEB_SERVER', 'keepalive_timeout', fallback=120),
+                      ident=None)
+                return
 
-    def start(self):
-        self.app.run(host=self.config.get('WEB_SERVER', 'host'),
-                   port=self.config.getint('WEB_SERVER', 'port'),
-                   debug=False)
\ No newline at end of file
+        logging.info(f"Web服务器以开发服务器模式启动: {host}:{port}")
+        self.app.run(host=host, port=port, debug=False, threaded=True)
\ No newline at end of file